@@ -1,5 +1,7 @@
+import json
 import sys
 import os
+from datetime import datetime, timezone
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from scrapers import brigitte_sauvager
@@ -7,12 +9,74 @@ from scrapers import brigitte_sauvager
 
 from airflow.providers.postgres.hooks.postgres import PostgresHook
 
+# Repo root (db_migrations.py), when the DAG is deployed inside the repo
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+
+def ensure_schema():
+    """Applies pending migrations like run_scrapers.setup_database(), if db_migrations is deployed"""
+    if REPO_ROOT not in sys.path:
+        sys.path.append(REPO_ROOT)
+    try:
+        import db_migrations
+    except ImportError:
+        print("db_migrations.py not found next to the DAG: schema left as is.")
+        return False
+    conn = PostgresHook(postgres_conn_id='supabase_db').get_conn()
+    try:
+        db_migrations.migrate(conn)
+    finally:
+        conn.close()
+    return True
+
+def run_bookkeeping(sql, parameters=None):
+    """Runs a statement the load does not depend on (views, data_version, run log...).
+    On a schema without it (migrations not applied) the listings still land: warn, don't fail."""
+    try:
+        PostgresHook(postgres_conn_id='supabase_db').run(sql, parameters=parameters)
+        return True
+    except Exception as e:
+        print(f"Skipped ({e.__class__.__name__}: {e}): {sql.strip().splitlines()[0]}")
+        return False
+
 def get_existing_urls():
     """Checks Supabase for URLs we already have to avoid duplicates"""
     hook = PostgresHook(postgres_conn_id='supabase_db')
-    records = hook.get_records("SELECT image_url FROM properties")
+    # Archived listings too, once the archive exists (migration 9)
+    has_archive = hook.get_first("SELECT to_regclass('properties_archive') IS NOT NULL")[0]
+    if has_archive:
+        records = hook.get_records("SELECT image_url FROM properties UNION SELECT image_url FROM properties_archive")
+    else:
+        records = hook.get_records("SELECT image_url FROM properties")
     return {row[0] for row in records}
 
+# Bumps the counter the Streamlit app polls to know when to refresh
+BUMP_DATA_VERSION_SQL = """
+    WITH bumped AS (
+        UPDATE data_version
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    )
+    SELECT pg_notify('listings_updated', version::text) FROM bumped
+"""
+
+def record_scrape_run(started_at, all_listings, new_listings):
+    """Latest run for the app header and monitoring (see db_migrations, migration 10)"""
+    site_counts = {}
+    for l in all_listings:
+        site_counts.setdefault(l['site'], {'scraped': 0, 'inserted': 0})['scraped'] += 1
+    for l in new_listings:
+        site_counts.setdefault(l['site'], {'scraped': 0, 'inserted': 0})['inserted'] += 1
+    run_bookkeeping(
+        "SELECT record_scrape_run(%s, 'success', %s, %s, 0, %s)",
+        parameters=(started_at, len(all_listings), len(new_listings), json.dumps(site_counts)),
+    )
+
+def mark_seen(all_listings):
+    """Bumps last_seen of listings scraped again, so the archive job keeps them"""
+    urls = sorted({l['image_url'] for l in all_listings if l.get('image_url')})
+    if urls:
+        run_bookkeeping("SELECT touch_listings(%s, CURRENT_DATE)", parameters=(urls,))
+
 def save_to_supabase(new_listings):
     """Batch inserts only the new listings into Supabase"""
     if not new_listings:
@@ -25,12 +89,20 @@ def save_to_supabase(new_listings):
     # Format the data for the Airflow 'insert_rows' helper
     values = [[l[f] for f in fields] for l in new_listings]
     
+    # This month's partition (rows would otherwise land in properties_default)
+    run_bookkeeping("SELECT ensure_properties_partitions(CURRENT_DATE, CURRENT_DATE + 62)")
     hook.insert_rows(table='properties', rows=values, target_fields=fields)
+    # Views first: the app reloads from canonical_listings as soon as the version moves
+    if run_bookkeeping("SELECT refresh_listing_views()"):
+        run_bookkeeping(BUMP_DATA_VERSION_SQL)
     print(f"Successfully uploaded {len(new_listings)} listings.")
 
 def run_full_process():
     """This replaces your old 'run()' function from run_scrapers.py"""
     print("Starting automated scrape...")
+    # Aware UTC: stored in the DB session's time zone, like finished_at's CURRENT_TIMESTAMP
+    started_at = datetime.now(timezone.utc)
+    ensure_schema()
     
     # 1. Scrape
     all_raw_listings = brigitte_sauvager.scrape()
@@ -40,4 +112,6 @@ def run_full_process():
     new_listings = [l for l in all_raw_listings if l['image_url'] not in existing_urls]
     
     # 3. Save
-    save_to_supabase(new_listings)
\ No newline at end of file
+    mark_seen(all_raw_listings)
+    save_to_supabase(new_listings)
+    record_scrape_run(started_at, all_raw_listings, new_listings)
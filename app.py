@@ -3,21 +3,32 @@
 # =============================================================
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import pg8000.native
 import re as _re
-import base64
 import os
 import re
+import time
 from urllib.parse import urlencode
 from datetime import date, timedelta
 from pathlib import Path
 
+from assets import AssetRegistry, data_uri, style_tag
+from cache_utils import LRUCache
+import db_search
+from card_renderer import LOGO_SYMBOL_ID, render_cards, svg_sprite
+from facets import FacetIndex, sparkline
+from pagination import PagePlan
+from perf import Profiler, write_json_line
+from listing_snapshot import ListingSnapshot, add_derived_columns, fetch_price_histories, fetch_properties
+from search_index import SearchIndex, tokenize
+
 # =============================================================
 # CONFIG
 # =============================================================
 
-PAGE_SIZE = 51  # Cards per page -- change here to test different values
+PAGE_SIZE = 51  # Max cards per page (a busy scrape date spans several pages)
 
 # 1. Grab the secret from Streamlit's storage
 if "DATABASE_URL" in st.secrets:
@@ -41,68 +52,76 @@ CURRENT_FOLDER = Path(__file__).parent
 IMAGES_FOLDER = CURRENT_FOLDER / "img"
 CSS_PATH = CURRENT_FOLDER / "styles.css"
 LOGO_PATH = IMAGES_FOLDER / "logo-nant-immo.svg"
+NO_IMAGE_PATH = IMAGES_FOLDER / "no-image.svg"
+
+DEV_MODE = os.environ.get("DEV_MODE", "false").lower() == "true"
+
+# Timing spans per rerun (perf.py): shown in a panel in DEV_MODE, appended as
+# JSON lines to PERF_LOG when set. Disabled = shared no-op spans.
+PERF_LOG = os.environ.get("PERF_LOG") or None
+profiler = Profiler(enabled=DEV_MODE or PERF_LOG is not None)
 
 # =============================================================
 # FONCTIONS UTILITAIRES
 # =============================================================
 
-def load_css(file_path):
-    """Charge un fichier CSS externe"""
-    with open(file_path) as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
-
-def image_to_base64(image_path):
-    """Convertit une image en base64 pour l'afficher en HTML"""
-    with open(image_path, "rb") as file:
-        image_bytes = file.read()
-    return base64.b64encode(image_bytes).decode()
+@st.cache_resource
+def get_assets():
+    """Registre des fichiers statiques, lus une fois par process (re-vérifiés en DEV_MODE)"""
+    return AssetRegistry(CURRENT_FOLDER, watch=DEV_MODE)
 
-def load_svg_as_text(svg_path):
-    """Charge un SVG en tant que texte pour l'insérer inline"""
-    with open(svg_path, "r", encoding="utf-8") as file:
-        return file.read()
-
-def load_data_from_db():
+def get_db_connection():
+    """Ouvre une connexion pg8000 à partir de DATABASE_URL"""
     # pg8000: pure-Python postgres driver -- uses Python ssl, not libpq's bundled OpenSSL
     # This avoids a recurring libpq TLS state corruption after long Mac uptime
     m = _re.match(r'postgresql://([^:]+):([^@]+)@([^:]+):(\d+)/(\w+)', DATABASE_URL)
     user, password, host, port, dbname = m.groups()
-    conn = pg8000.native.Connection(
+    return pg8000.native.Connection(
         user=user, password=password, host=host,
         port=int(port), database=dbname,
         ssl_context=True, timeout=10
     )
+
+def load_data_from_db():
+    conn = get_db_connection()
     try:
-        query = 'SELECT * FROM properties WHERE canonical_id IS NULL ORDER BY id DESC'
-        rows = conn.run(query)
-        columns = [desc['name'] for desc in conn.columns]
-        df = pd.DataFrame(rows, columns=columns)
-        # pg8000 returns Decimal for numeric columns; cast to float for downstream arithmetic
-        import decimal
-        for col in df.columns:
-            if df[col].apply(lambda x: isinstance(x, decimal.Decimal)).any():
-                df[col] = df[col].astype(float)
-        # pg8000 returns JSONB as a string; parse price_history into Python lists
-        import json as _json
-        if 'price_history' in df.columns:
-            df['price_history'] = df['price_history'].apply(
-                lambda x: _json.loads(x) if isinstance(x, str) else x
-            )
+        df = fetch_properties(conn, 'SELECT * FROM canonical_listings ORDER BY id DESC')
     finally:
         conn.close()
-    return df
+    return add_derived_columns(df)
 
-def format_price(price):
-    """Formate le prix pour l'affichage"""
-    if pd.notna(price):
-        return f"{int(price):,} €".replace(",", " ")
-    return "Prix non disponible"
-
-def format_price_per_m2(price_per_m2):
-    """Formate le prix au m² pour l'affichage sur les cartes"""
-    if pd.notna(price_per_m2) and price_per_m2 > 0:
-        return f"{int(round(price_per_m2)):,} €/m²".replace(",", " ")
-    return None
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def get_last_scrape_run(data_version):
+    """(finished_at, site_counts) of the latest successful scrape_runs row, None if unavailable"""
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.run(
+                "SELECT finished_at, site_counts FROM scrape_runs "
+                "WHERE status = 'success' ORDER BY finished_at DESC LIMIT 1"
+            )
+        finally:
+            conn.close()
+    except Exception:
+        return None
+    return (rows[0][0], rows[0][1]) if rows else None
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def last_scrape_from_snapshot(data_version, _df):
+    """Fallback without scrape_runs: latest created_at of the latest scrape date, once per snapshot"""
+    last_date = _df['scraped_date'].max()
+    return pd.to_datetime(_df.loc[_df['scraped_date'] == last_date, 'created_at']).max()
+
+def last_scrape_time():
+    """Latest scrape as a Paris-time Timestamp: scrape_runs if readable, else the snapshot"""
+    # DATA_VERSION is a new time_ns() on every DEV_MODE rerun: the TTL alone keys it there
+    last_run = get_last_scrape_run(None if DEV_MODE else DATA_VERSION)
+    ts = pd.Timestamp(last_run[0]) if last_run else last_scrape_from_snapshot(DATA_VERSION, df)
+    try:
+        import zoneinfo
+        return ts.tz_localize('UTC').astimezone(zoneinfo.ZoneInfo('Europe/Paris'))
+    except Exception:
+        return ts  # fallback: UTC, better than nothing
 
 def parse_price_input(raw: str) -> int | None:
     """
@@ -166,44 +185,53 @@ def load_favorites_from_url():
     return set()
 
 
-def clean_ouestfrance_title(title):
-    """
-    Strips boilerplate from OuestFrance titles.
-    e.g. "Vente appartement 5 pièces - Nantes Zola 44 - 73 m²"
-      -> "5 pièces - Nantes Zola - 73 m²"
-
-    The scraper appends m² at the end, so the department code (e.g. "44")
-    is no longer the last token. We strip it wherever it appears as a
-    standalone 2-digit number preceded by a space, bounded by " - " or end.
-    """
-    # Remove leading "Vente appartement " (case-insensitive)
-    title = re.sub(r'^Vente\s+appartement\s+', '', title, flags=re.IGNORECASE)
-    # Remove department code: 2-digit number as a standalone word,
-    # optionally followed by " - " or end of string
-    title = re.sub(r'\s+\d{2}(?=\s*(?:-|$))', '', title)
-    return title.strip()
+def pop_card_action(name):
+    """Listing id of a card link (?fav=<id> / ?flag=<id>), removed from the URL; None if absent"""
+    if name not in st.query_params:
+        return None
+    value = st.query_params[name]
+    del st.query_params[name]
+    try:
+        return int(value)
+    except ValueError:
+        return None
 
 
 # =============================================================
 # CHARGEMENT DES RESSOURCES
 # =============================================================
 
-# CSS
-load_css(CSS_PATH)
+# Read, minified and encoded once per process (see assets.py); a rerun only
+# looks the results up.
+assets = get_assets()
 
-# Logo en base64
-logo_base64 = image_to_base64(LOGO_PATH)
+# CSS
+styles_html = assets.build(CSS_PATH.name, "style", style_tag)
+st.markdown(styles_html, unsafe_allow_html=True)
+
+# Logo as an SVG sprite: the full markup is emitted once per page
+# (logo_sprite_html), header and cards reference it with <use>
+logo_sprite_html, logo_svg_use = assets.build(
+    LOGO_PATH.relative_to(CURRENT_FOLDER).as_posix(), "sprite",
+    lambda raw: svg_sprite(raw.decode("utf-8"), LOGO_SYMBOL_ID),
+)
 
-# For card logos (inline SVG)
-logo_svg_text = load_svg_as_text(LOGO_PATH)
+# No-image placeholder: base64 SVG used for cards without a photo
+no_image_data_uri = assets.build(
+    NO_IMAGE_PATH.relative_to(CURRENT_FOLDER).as_posix(), "data_uri", data_uri("image/svg+xml"),
+)
 
-# No-image placeholder: base64 SVG used as onerror fallback on card <img> tags
-NO_IMAGE_PATH = IMAGES_FOLDER / "no-image.svg"
-no_image_base64 = image_to_base64(NO_IMAGE_PATH)
-no_image_data_uri = f"data:image/svg+xml;base64,{no_image_base64}"
+# thumbnail_proxy.py base URL: cards then load resized WebP variants via srcset.
+# Unset = photos hotlinked at full size (still lazy-loaded).
+THUMBNAIL_PROXY_URL = os.environ.get("THUMBNAIL_PROXY_URL") or None
 
 # Données (cache de 10 minutes)
-DEV_MODE = os.environ.get("DEV_MODE", "false").lower() == "true"
+
+# Keyword search backend: "index" (in-process SearchIndex, default) or
+# "postgres" (full-text query on properties.search_vector, see db_search.py).
+# SEARCH_TRIGRAM=true adds substring matches through the pg_trgm index.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "index").lower()
+SEARCH_TRIGRAM = os.environ.get("SEARCH_TRIGRAM", "false").lower() == "true"
 
 # In production, hide the Annonces nav item from the top bar.
 # Listings stays in st.navigation() so Streamlit can route to it, but
@@ -218,32 +246,60 @@ if not DEV_MODE:
         unsafe_allow_html=True,
     )
 
+SNAPSHOT_MAX_AGE = 600     # fallback refresh period when data_version cannot be read
+VERSION_POLL_SECONDS = 30  # how often each process asks the DB for data_version
+
+# Arrow snapshots published by run_scrapers.py; cold starts map the latest
+# one instead of downloading properties. Empty SNAPSHOT_DIR = DB only.
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", str(CURRENT_FOLDER / "data" / "snapshots")) or None
+# Several Streamlit workers on one node: share SNAPSHOT_DIR as a locked
+# cache so a new data_version is loaded once per node, not once per worker.
+SHARED_SNAPSHOT_CACHE = os.environ.get("SHARED_SNAPSHOT_CACHE", "false").lower() == "true"
+
 if DEV_MODE:
-    # Pas de cache pendant le dev
+    # Pas de cache pendant le dev: full reload, fresh version on every rerun
     def get_data():
-        return load_data_from_db()
+        return load_data_from_db(), time.time_ns(), None
 else:
-    # Cache en production
-    @st.cache_data(ttl=600)
-    def get_data():
-        return load_data_from_db()
-
-df = get_data()
+    # Cache en production: one snapshot per process, kept current by
+    # watermark deltas instead of re-downloading the whole table.
+    # The scraper bumps data_version after each successful load, so a
+    # refresh happens right after a scrape and never in between.
+    @st.cache_resource
+    def _listing_snapshot():
+        return ListingSnapshot(get_db_connection, snapshot_dir=SNAPSHOT_DIR,
+                               shared=SHARED_SNAPSHOT_CACHE)
+
+    @st.cache_data(ttl=VERSION_POLL_SECONDS, show_spinner=False)
+    def get_source_version():
+        """Single-row read of data_version; None if unavailable (timer fallback)"""
+        try:
+            conn = get_db_connection()
+            try:
+                return conn.run('SELECT version FROM data_version')[0][0]
+            finally:
+                conn.close()
+        except Exception:
+            return None
 
-# Compute price per m² as a derived column (never stored in DB — pure derivative)
-df['price_per_m2'] = df.apply(
-    lambda r: round(r['price_numeric'] / r['square_meters'], 2)
-    if pd.notna(r['price_numeric']) and pd.notna(r['square_meters']) and r['square_meters'] > 0
-    else None,
-    axis=1
-)
+    def get_data():
+        """(df, version, search index) of one published state, never a mix of two"""
+        snapshot = _listing_snapshot()
+        snapshot.refresh(max_age=SNAPSHOT_MAX_AGE, source_version=get_source_version())
+        return snapshot.current
 
-# Cast scraped_date to actual dates for range filtering
-df['scraped_date_dt'] = pd.to_datetime(df['scraped_date'], errors='coerce').dt.date
+with profiler.span("get_data") as _span:
+    # SNAPSHOT_INDEX: the snapshot's own search index, None in DEV_MODE
+    df, DATA_VERSION, SNAPSHOT_INDEX = get_data()
+    _span.rows_out = len(df)
 
 # Favoris (session state)
 if 'favorites' not in st.session_state:
     st.session_state.favorites = load_favorites_from_url()
+# Heart links on the cards point to ?<params>&fav=<id>: toggle once per click
+_fav_toggle = pop_card_action("fav")
+if _fav_toggle is not None:
+    st.session_state.favorites ^= {_fav_toggle}
 # Write favorites to URL immediately — tightens the PTR race window so a
 # reload fired before the bottom-of-script query_params.update() still
 # captures the current state.
@@ -263,6 +319,20 @@ PROPERTY_TYPE_GROUPS = {
 }
 ALL_PROPERTY_TYPE_LABELS = list(PROPERTY_TYPE_GROUPS.keys())
 
+# Sort label -> (column, ascending). None column = DB order (date, newest first).
+SORT_OPTIONS = {
+    "Date (récent → ancien)":  (None,              None),
+    "Prix (croissant)":        ("price_numeric",   True),
+    "Prix (décroissant)":      ("price_numeric",   False),
+    "Prix/m² (croissant)":     ("price_per_m2",    True),
+    "Prix/m² (décroissant)":   ("price_per_m2",    False),
+    "Surface (croissante)":    ("square_meters",   True),
+    "Surface (décroissante)":  ("square_meters",   False),
+}
+# Relevance ranking only exists when Postgres answers the search
+if SEARCH_BACKEND == "postgres":
+    SORT_OPTIONS["Pertinence"] = ("search_rank", False)
+
 # Applied filter state — persists across dialog open/close cycles.
 # Initialised from URL params so bookmarked links still work on first load.
 if 'applied_search' not in st.session_state:
@@ -285,15 +355,6 @@ if 'applied_sort_label' not in st.session_state:
     # Get sort from URL, default to "Date (récent → ancien)"
     url_sort = st.query_params.get("sort", "Date (récent → ancien)")
     # Validate it's a valid sort option
-    SORT_OPTIONS = {
-        "Date (récent → ancien)":  (None,              None),
-        "Prix (croissant)":        ("price_numeric",   True),
-        "Prix (décroissant)":      ("price_numeric",   False),
-        "Prix/m² (croissant)":     ("price_per_m2",    True),
-        "Prix/m² (décroissant)":   ("price_per_m2",    False),
-        "Surface (croissante)":    ("square_meters",   True),
-        "Surface (décroissante)":  ("square_meters",   False),
-    }
     if url_sort not in SORT_OPTIONS:
         url_sort = "Date (récent → ancien)"
     st.session_state.applied_sort_label = url_sort
@@ -361,13 +422,7 @@ def flag_report_dialog(row_id: int, row_title: str, row_site: str):
     )
     if st.button("Envoyer le signalement", type="primary", use_container_width=True):
         try:
-            m = _re.match(r'postgresql://([^:]+):([^@]+)@([^:]+):(\d+)/(\w+)', DATABASE_URL)
-            _u, _pw, _h, _p, _db = m.groups()
-            conn = pg8000.native.Connection(
-                user=_u, password=_pw, host=_h,
-                port=int(_p), database=_db,
-                ssl_context=True, timeout=10
-            )
+            conn = get_db_connection()
             conn.run(
                 "INSERT INTO dedup_reports (id_a, site_a, notes) VALUES (:id_a, :site_a, :notes)",
                 id_a=row_id, site_a=row_site, notes=notes.strip() or None
@@ -380,6 +435,13 @@ def flag_report_dialog(row_id: int, row_title: str, row_site: str):
 
 @st.dialog("⌂ Types", width="large")
 def filter_panel():
+    # Result counts per option, from the facet index (no rescan of the listings)
+    facets, facet_matrix, facet_stats = facet_counts()
+    pending_sites = st.session_state.get('sites_multiselect')
+    if pending_sites is None:
+        pending_sites = st.session_state.applied_selected_sites or facets.sites
+    _type_counts = facets.type_counts(facet_matrix, pending_sites)
+
     # ------------------------------------------------------------------
     # Scope: Types
     # Not a filter -- Reset does not touch this section.
@@ -397,6 +459,7 @@ def filter_panel():
         key='property_types_multiselect',
         label_visibility='collapsed',
         placeholder="Choisir les types",
+        format_func=lambda label: f"{label} ({_type_counts.get(label, 0)})",
     )
 
     st.divider()
@@ -461,6 +524,8 @@ def filter_panel():
         st.caption("! Prix min. invalide")
     if raw_price_max.strip() and price_max is None:
         st.caption("! Prix max. invalide")
+    if sparkline(facet_stats['price']):
+        st.caption(f"Prix des résultats : {sparkline(facet_stats['price'])}")
 
     st.divider()
 
@@ -488,21 +553,14 @@ def filter_panel():
         "Surface max. (m²)", min_value=0, max_value=max_m2, value=default_m2_max, step=5,
         placeholder="Pas de maximum", key="m2_max"
         )
+    if sparkline(facet_stats['surface']):
+        st.caption(f"Surfaces des résultats : {sparkline(facet_stats['surface'])}")
     
     st.divider()
 
     # ------------------------------------------------------------------
     # Tri
     # ------------------------------------------------------------------
-    SORT_OPTIONS = {
-        "Date (récent → ancien)":  (None,              None),
-        "Prix (croissant)":        ("price_numeric",   True),
-        "Prix (décroissant)":      ("price_numeric",   False),
-        "Prix/m² (croissant)":     ("price_per_m2",    True),
-        "Prix/m² (décroissant)":   ("price_per_m2",    False),
-        "Surface (croissante)":    ("square_meters",   True),
-        "Surface (décroissante)":  ("square_meters",   False),
-    }
 
     # Get current sort label from session state (which is initialized from URL on first load)
     current_sort_label = st.session_state.applied_sort_label
@@ -546,12 +604,14 @@ def filter_panel():
     if 'sites_multiselect' not in st.session_state:
         st.session_state['sites_multiselect'] = default_sites
 
+    _site_counts = facets.site_counts(facet_matrix, selected_ptype_labels)
     selected_sites = st.multiselect(
         "Sources actives",
         options=available_sites,
         key='sites_multiselect',
         label_visibility='collapsed',
         placeholder="Choisir les agences",
+        format_func=lambda site: f"{site} ({_site_counts.get(site, 0)})",
     )
 
     st.divider()
@@ -586,12 +646,23 @@ def filter_panel():
     else:
         selected_date_min = date_range
         selected_date_max = date_max_data
+    if sparkline(list(facet_stats['dates'].values())):
+        st.caption(f"Annonces par jour : {sparkline(list(facet_stats['dates'].values()))}")
 
     st.divider()
 
+    # Live count on the button while only sources/types differ from the applied filters
+    _live_count = None if show_favorites else live_result_count(
+        facets, facet_matrix, selected_sites, selected_ptype_labels,
+        dict(search_term=search_term, price_min=price_min, price_max=price_max,
+             m2_min=m2_min, m2_max=m2_max,
+             selected_date_min=selected_date_min, selected_date_max=selected_date_max),
+    )
+    _apply_label = "Appliquer" if _live_count is None else f"Appliquer · {_live_count} annonces"
+
     # Apply button — copies all local widget values into persistent session
     # state keys, then reruns. The main body reads exclusively from those keys.
-    if st.button("Appliquer", use_container_width=True, type="primary", key="fab_apply_filters"):
+    if st.button(_apply_label, use_container_width=True, type="primary", key="fab_apply_filters"):
         st.session_state.applied_search           = search_term
         st.session_state.applied_show_favorites   = show_favorites
         st.session_state.applied_price_min        = raw_price_min
@@ -610,10 +681,269 @@ def filter_panel():
     st.divider()
 
     # Infos en bas
-    st.caption(f"Mis à jour: {df['scraped_date'].max()}")
+    st.caption(f"Mis à jour: {last_scrape_time():%Y-%m-%d}")
     st.caption(f"Total: {len(df)} annonces")
 
 
+# =============================================================
+# FILTRAGE (résultats mis en cache)
+# =============================================================
+
+FILTER_CACHE_SIZE = 128  # distinct filter combinations kept across all sessions
+
+@st.cache_resource
+def _filter_cache():
+    """Process-wide LRU of filter results: normalized filter tuple -> PagePlan."""
+    return LRUCache(maxsize=FILTER_CACHE_SIZE)
+
+
+CARD_CACHE_SIZE = 2000  # rendered card fragments kept across all sessions
+
+@st.cache_resource
+def _card_cache():
+    """Process-wide LRU of card HTML: (id, data version, favorite, overlay) -> (html, title)."""
+    return LRUCache(maxsize=CARD_CACHE_SIZE)
+
+
+@st.cache_resource(max_entries=2)
+def get_search_index(data_version, _df):
+    """Accent-folded keyword index over title + description, built once per snapshot.
+
+    _df is not hashed by Streamlit (leading underscore): data_version alone
+    identifies the snapshot.
+    """
+    return SearchIndex.from_columns(_df['id'], _df['title'], _df['description'])
+
+
+@st.cache_data(ttl=600, max_entries=256)
+def search_ranks_from_db(search_term, data_version):
+    """{id: rank} for a keyword query answered by Postgres (SEARCH_BACKEND=postgres)."""
+    conn = get_db_connection()
+    try:
+        return db_search.search_ranks(conn, search_term, trigram=SEARCH_TRIGRAM)
+    finally:
+        conn.close()
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def price_histories_from_db(ids, data_version):
+    """{id: [{price, date}, ...]} for one page of listings (data_version keys the cache)."""
+    conn = get_db_connection()
+    try:
+        return fetch_price_histories(conn, ids)
+    finally:
+        conn.close()
+
+
+def get_filter_plan(filter_key, filter_args):
+    """(PagePlan, cache hit) for normalized filter_key; filter_args are filter_listings() kwargs."""
+    cache = _filter_cache()
+    plan = cache.get(filter_key)
+    if plan is not None:
+        return plan, True
+    plan = PagePlan.build(
+        filter_listings(df, search_index=get_searcher(DATA_VERSION, df), **filter_args), PAGE_SIZE,
+    )
+    cache.put(filter_key, plan)
+    return plan, False
+
+
+FACET_CACHE_SIZE = 64  # facet counts of recent filter combinations
+
+@st.cache_resource
+def _facet_cache():
+    """Process-wide LRU: normalized filter tuple -> facet counts of its result."""
+    return LRUCache(maxsize=FACET_CACHE_SIZE)
+
+
+@st.cache_resource(max_entries=2)
+def get_facet_index(data_version, _df):
+    """Integer-coded facet columns, built once per snapshot (see facets.py)."""
+    return FacetIndex(_df, PROPERTY_TYPE_GROUPS)
+
+
+def facet_counts():
+    """Counts for the filter form, from the last applied filters of this session.
+
+    Returns (facets, matrix, counts): matrix is the site x type crosstab of
+    the applied filters with sources and types left open (so every option
+    gets a count), counts the dates and histograms of the applied result.
+    Before the listings page has run, both cover the whole snapshot.
+    """
+    facets = get_facet_index(DATA_VERSION, df)
+    applied = st.session_state.get('applied_filter')
+    if applied is None or applied[0][0] != DATA_VERSION:
+        return facets, facets.crosstab(), facets.counts()
+    filter_key, filter_args = applied
+    cache = _facet_cache()
+    cached = cache.get(filter_key)
+    if cached is None:
+        # Same key layout as page_listings(): sources, types and the agency
+        # overlay opened up
+        all_sites = tuple(facets.sites)
+        open_key = (filter_key[0], all_sites, *filter_key[2:10], None, "")
+        open_args = {**filter_args, 'selected_sites': list(all_sites),
+                     'active_ptypes': None, 'agency_filter': ''}
+        open_plan, _ = get_filter_plan(open_key, open_args)
+        plan, _ = get_filter_plan(filter_key, filter_args)
+        cached = (facets.crosstab(open_plan.rows), facets.counts(plan.rows))
+        cache.put(filter_key, cached)
+    return (facets, *cached)
+
+
+def live_result_count(facets, matrix, sites, type_labels, pending):
+    """Result count of the pending form, or None when the matrix cannot tell.
+
+    Exact while only sources and types differ from the applied filters:
+    pending holds the form's other values, compared with the applied ones.
+    The matrix leaves the agency overlay open, so it cannot count one.
+    """
+    applied = st.session_state.get('applied_filter')
+    if applied is None or applied[0][0] != DATA_VERSION:
+        return None
+    args = applied[1]
+    if args.get('agency_filter'):
+        return None
+    if any(args[name] != value for name, value in pending.items()):
+        return None
+    return facets.selection_count(matrix, sites, type_labels)
+
+
+class PostgresSearch:
+    """Same search() interface as SearchIndex, served by the GIN index.
+
+    ranks keeps the ts_rank of the last query for the "Pertinence" sort.
+    """
+
+    def __init__(self, data_version):
+        self.data_version = data_version
+        self.ranks = {}
+
+    def search(self, query):
+        if not query.strip():
+            return None
+        self.ranks = search_ranks_from_db(query.strip(), self.data_version)
+        return set(self.ranks)
+
+
+def get_searcher(data_version, df):
+    """Keyword search engine for the configured SEARCH_BACKEND"""
+    if SEARCH_BACKEND == "postgres":
+        return PostgresSearch(data_version)
+    if SNAPSHOT_INDEX is not None:
+        # Published with df and DATA_VERSION: a concurrent delta cannot
+        # pair this rerun's frame with the next snapshot's index
+        return SNAPSHOT_INDEX
+    return get_search_index(data_version, df)
+
+
+def filter_listings(df, selected_sites, selected_date_min, selected_date_max,
+                    search_term, price_min, price_max, m2_min, m2_max,
+                    sort_label, active_ptypes, agency_filter, search_index):
+    """Applies the applied-filter state to the full frame and returns the sorted result.
+
+    Pure function of its arguments (no session state) so its output can be
+    cached under the normalized filter key built in page_listings().
+    """
+    filtered_df = df
+
+    # Filtrer par site
+    filtered_df = filtered_df[filtered_df['site'].isin(selected_sites)]
+
+    # Filtrer par plage de dates
+    filtered_df = filtered_df[
+        (filtered_df['scraped_date_dt'] >= selected_date_min) &
+        (filtered_df['scraped_date_dt'] <= selected_date_max)
+    ]
+
+    # Filtrer par recherche: posting-list intersection, accent/case-insensitive,
+    # each word matched as a prefix ("etag" finds "étage")
+    if search_term:
+        matching_ids = search_index.search(search_term)
+        if matching_ids is not None:
+            filtered_df = filtered_df[filtered_df['id'].isin(matching_ids)]
+            ranks = getattr(search_index, 'ranks', None)
+            if ranks:
+                filtered_df = filtered_df.assign(search_rank=filtered_df['id'].map(ranks))
+
+    # Filtrer par prix min
+    if price_min is not None:
+        filtered_df = filtered_df[filtered_df['price_numeric'] >= price_min]
+
+    # Filtrer par prix max
+    if price_max is not None:
+        filtered_df = filtered_df[filtered_df['price_numeric'] <= price_max]
+
+    # Filtrer par surface min
+    if m2_min is not None:
+        filtered_df = filtered_df[
+            (filtered_df['square_meters'] >= m2_min) |
+            (filtered_df['square_meters'].isna())  # Garde les annonces sans m² renseignés
+        ]
+
+    # Filtrer par surface max
+    if m2_max is not None:
+        filtered_df = filtered_df[
+            (filtered_df['square_meters'] <= m2_max) |
+            (filtered_df['square_meters'].isna())  # Garde les annonces sans m² renseignés
+        ]
+
+    # Filtrer par type de bien
+    # active_ptypes holds display labels (e.g. "Appartements").
+    # Expand to raw DB values via PROPERTY_TYPE_GROUPS before filtering.
+    if active_ptypes is not None and set(active_ptypes) != set(ALL_PROPERTY_TYPE_LABELS):
+        # _named_types: types explicitly claimed by a named group (Appartements/Maisons/Parkings).
+        # Anything not in this set is either NULL (mystery) or a non-residential type
+        # (commercial, terrain, chateau, etc.) -- all treated as "Autres".
+        # This means "Autres" never needs manual maintenance as new types are added.
+        _named_types = [v for label in PROPERTY_TYPE_GROUPS if label != 'Autres'
+                        for v in PROPERTY_TYPE_GROUPS[label]]
+        if 'Autres' in active_ptypes:
+            # Autres selected: include anything not claimed by a named group
+            _raw_types = [v for label in active_ptypes if label != 'Autres'
+                          for v in PROPERTY_TYPE_GROUPS[label]]
+            filtered_df = filtered_df[
+                filtered_df['property_type'].isin(_raw_types) |
+                (~filtered_df['property_type'].isin(_named_types))
+            ]
+        else:
+            # Autres not selected: include only explicitly named types + NULL pass-through
+            _raw_types = [v for label in active_ptypes for v in PROPERTY_TYPE_GROUPS[label]]
+            filtered_df = filtered_df[
+                filtered_df['property_type'].isin(_raw_types) |
+                (filtered_df['property_type'].isna())
+            ]
+
+    # Filtrer par agence (overlay -- ephemeral, does not touch applied_selected_sites)
+    if agency_filter:
+        filtered_df = filtered_df[filtered_df['site'] == agency_filter]
+
+    # Trier
+    sort_col, sort_asc = SORT_OPTIONS[sort_label]
+    if sort_col == 'search_rank' and 'search_rank' not in filtered_df.columns:
+        sort_col = None  # "Pertinence" without a keyword: keep date order
+    if sort_col is None:
+        # Default: preserve DB order (created_at DESC, scrape_order ASC)
+        # The DataFrame already arrives in this order from the query — no-op.
+        pass
+    elif sort_col in ('price_per_m2', 'price_numeric', 'square_meters', 'search_rank'):
+        # Listings with no value sink to the bottom regardless of direction
+        filtered_df = filtered_df.sort_values(
+            by=sort_col,
+            ascending=sort_asc,
+            na_position='last',
+            kind='stable'  # ties keep id DESC: pagination's keyset order
+        )
+    else:
+        filtered_df = filtered_df.sort_values(
+            by=sort_col,
+            ascending=sort_asc,
+            kind='stable'
+        )
+
+    return filtered_df
+
+
 # =============================================================
 # PAGE FUNCTIONS
 # =============================================================
@@ -622,6 +952,15 @@ def page_listings():
     """Main listings page -- all rendering lives here."""
     agency_filter = st.query_params.get("agency", "")
 
+    # DEV_MODE flag links on the cards point to ?<params>&flag=<id>
+    _flag_id = pop_card_action("flag")
+    if DEV_MODE and _flag_id is not None:
+        _flagged = df.loc[df['id'] == _flag_id]
+        if len(_flagged):
+            _title = _flagged['title'].iloc[0]
+            flag_report_dialog(_flag_id, row_title=_title if isinstance(_title, str) else '',
+                               row_site=_flagged['site'].iloc[0])
+
     # Spoof window.innerWidth on the parent frame so Streamlit's compiled JS
     # always sees a desktop-width viewport and renders st.navigation(position="top")
     # as a top bar rather than collapsing it into a sidebar drawer on mobile.
@@ -691,8 +1030,9 @@ def page_listings():
     # =============================================================
     
     st.markdown(f"""
+        {logo_sprite_html}
         <div class="header-container">
-            <img src="data:image/svg+xml;base64,{logo_base64}" alt="Logo" class="header-logo">
+            <span class="header-logo" role="img" aria-label="Logo">{logo_svg_use}</span>
             <p class="logo-text">Nant'Immo</p>
         </div>
     """, unsafe_allow_html=True)
@@ -987,18 +1327,8 @@ def page_listings():
     m2_min = st.session_state.applied_m2_min
     m2_max = st.session_state.applied_m2_max
     
-    # Sort
-    SORT_OPTIONS = {
-        "Date (récent → ancien)":  (None,            None),
-        "Prix (croissant)":        ("price_numeric",  True),
-        "Prix (décroissant)":      ("price_numeric",  False),
-        "Prix/m² (croissant)":     ("price_per_m2",   True),
-        "Prix/m² (décroissant)":   ("price_per_m2",   False),
-        "Surface (croissante)":    ("square_meters",  True),
-        "Surface (décroissante)":  ("square_meters",  False),
-    }
+    # Sort (resolved to a column inside filter_listings)
     sort_label = st.session_state.applied_sort_label
-    sort_col, sort_asc = SORT_OPTIONS[sort_label]
     
     # Dates
     try:
@@ -1038,128 +1368,85 @@ def page_listings():
     # FILTRAGE DES DONNÉES
     # =============================================================
     
-    if not selected_sites:
-        st.warning("! Sélectionnez au moins une source")
-        filtered_df = pd.DataFrame()
-    else:
-        filtered_df = df.copy()
-    
-        # Filtrer par site
-        filtered_df = filtered_df[filtered_df['site'].isin(selected_sites)]
-    
-        # Filtrer par plage de dates
-        filtered_df = filtered_df[
-            (filtered_df['scraped_date_dt'] >= selected_date_min) &
-            (filtered_df['scraped_date_dt'] <= selected_date_max)
-        ]
-    
-        # Filtrer par recherche
-        if search_term:
-            search_mask = (
-                filtered_df['title'].str.contains(search_term, case=False, na=False) |
-                filtered_df['description'].str.contains(search_term, case=False, na=False)
-            )
-            filtered_df = filtered_df[search_mask]
-    
-        # Filtrer par prix min
-        if price_min is not None:
-            filtered_df = filtered_df[filtered_df['price_numeric'] >= price_min]
-    
-        # Filtrer par prix max
-        if price_max is not None:
-            filtered_df = filtered_df[filtered_df['price_numeric'] <= price_max]
-    
-        # Filtrer par surface min
-        if m2_min is not None:
-            filtered_df = filtered_df[
-                (filtered_df['square_meters'] >= m2_min) |
-                (filtered_df['square_meters'].isna())  # Garde les annonces sans m² renseignés
-            ]
-    
-        # Filtrer par surface max
-        if m2_max is not None:
-            filtered_df = filtered_df[
-                (filtered_df['square_meters'] <= m2_max) |
-                (filtered_df['square_meters'].isna())  # Garde les annonces sans m² renseignés
-            ]
-    
-        # Filtrer par type de bien
-        # applied_property_types holds display labels (e.g. "Appartements").
-        # Expand to raw DB values via PROPERTY_TYPE_GROUPS before filtering.
-        _active_ptypes = st.session_state.applied_property_types
-        if _active_ptypes is not None and set(_active_ptypes) != set(ALL_PROPERTY_TYPE_LABELS):
-            # _named_types: types explicitly claimed by a named group (Appartements/Maisons/Parkings).
-            # Anything not in this set is either NULL (mystery) or a non-residential type
-            # (commercial, terrain, chateau, etc.) -- all treated as "Autres".
-            # This means "Autres" never needs manual maintenance as new types are added.
-            _named_types = [v for label in PROPERTY_TYPE_GROUPS if label != 'Autres'
-                            for v in PROPERTY_TYPE_GROUPS[label]]
-            if 'Autres' in _active_ptypes:
-                # Autres selected: include anything not claimed by a named group
-                _raw_types = [v for label in _active_ptypes if label != 'Autres'
-                              for v in PROPERTY_TYPE_GROUPS[label]]
-                filtered_df = filtered_df[
-                    filtered_df['property_type'].isin(_raw_types) |
-                    (~filtered_df['property_type'].isin(_named_types))
-                ]
-            else:
-                # Autres not selected: include only explicitly named types + NULL pass-through
-                _raw_types = [v for label in _active_ptypes for v in PROPERTY_TYPE_GROUPS[label]]
-                filtered_df = filtered_df[
-                    filtered_df['property_type'].isin(_raw_types) |
-                    (filtered_df['property_type'].isna())
-                ]
-    
-        # Filtrer par agence (overlay -- ephemeral, does not touch applied_selected_sites)
-        if agency_filter:
-            filtered_df = filtered_df[filtered_df['site'] == agency_filter]
-    
-        # Filtrer par favoris
-        if show_favorites:
-            filtered_df = filtered_df[filtered_df['id'].isin(st.session_state.favorites)]
-    
-        # Trier
-        if sort_col is None:
-            # Default: preserve DB order (created_at DESC, scrape_order ASC)
-            # The DataFrame already arrives in this order from the query — no-op.
-            pass
-        elif sort_col in ('price_per_m2', 'price_numeric', 'square_meters'):
-            # Listings with no value sink to the bottom regardless of direction
-            filtered_df = filtered_df.sort_values(
-                by=sort_col,
-                ascending=sort_asc,
-                na_position='last'
-            )
+    with profiler.span("filter", rows_in=len(df)) as _span:
+        if not selected_sites:
+            st.warning("! Sélectionnez au moins une source")
+            filter_key = None
+            plan = PagePlan.build(df.iloc[0:0], PAGE_SIZE)
         else:
-            filtered_df = filtered_df.sort_values(
-                by=sort_col,
-                ascending=sort_asc
+            # Everything except the favourites toggle goes into the cache key:
+            # heart taps and page changes reuse the cached row list untouched.
+            _ptypes = st.session_state.applied_property_types
+            filter_key = (
+                DATA_VERSION,
+                tuple(sorted(selected_sites)),
+                selected_date_min,
+                selected_date_max,
+                # index backend ignores word order/accents; Postgres websearch syntax does not
+                search_term.strip() if SEARCH_BACKEND == "postgres" else " ".join(sorted(set(tokenize(search_term)))),
+                price_min,
+                price_max,
+                m2_min,
+                m2_max,
+                sort_label,
+                tuple(sorted(_ptypes)) if _ptypes is not None else None,
+                agency_filter,
             )
-    
+            # The cache holds the page plan (row labels in page order + page
+            # boundaries): a page change slices it, nothing is re-filtered
+            filter_args = dict(
+                selected_sites=selected_sites, selected_date_min=selected_date_min,
+                selected_date_max=selected_date_max, search_term=search_term,
+                price_min=price_min, price_max=price_max, m2_min=m2_min, m2_max=m2_max,
+                sort_label=sort_label, active_ptypes=_ptypes, agency_filter=agency_filter,
+            )
+            plan, _hit = get_filter_plan(filter_key, filter_args)
+            _span.extra = "cache hit" if _hit else "cache miss"
+            # The filter form reads its facet counts from this (see facet_counts)
+            st.session_state.applied_filter = (filter_key, filter_args)
+
+            # Filtrer par favoris (applied after the cache -- favourites change on every heart tap)
+            if show_favorites:
+                _fav_rows = plan.rows[np.isin(plan.ids, list(st.session_state.favorites))]
+                plan = PagePlan.build(df.loc[_fav_rows], PAGE_SIZE)
+        _span.rows_out = plan.total
+    _n_filtered = plan.total
+    _n_filtered_sites = plan.n_sites
+
+    # Page cursor: after a data refresh (new DATA_VERSION, same filters) new
+    # listings shift the page numbers -- go back to the page that now holds
+    # the listing the visitor was looking at
+    _anchor_key = (filter_key[1:], show_favorites) if filter_key else None
+    _prev_anchor = st.session_state.get('page_anchor')
+    if (_prev_anchor and _prev_anchor[0] == _anchor_key and _prev_anchor[1] != DATA_VERSION
+            and _prev_anchor[2] is not None):
+        _anchored_page = plan.page_of(_prev_anchor[2])
+        if _anchored_page is not None and _anchored_page != st.session_state.current_page:
+            st.session_state.current_page = _anchored_page
+            st.query_params["page"] = str(_anchored_page)
+
     # =============================================================
     # UI - STATISTIQUES ON TOP
     # =============================================================
     
-    # Last scrape hour: max created_at among rows that share the most recent scraped_date.
-    # created_at is a datetime; extract HH:MM in Paris local time for display.
-    _last_date = df['scraped_date'].max()
-    _last_ts = pd.to_datetime(df.loc[df['scraped_date'] == _last_date, 'created_at']).max()
-    try:
-        import zoneinfo
-        _paris = zoneinfo.ZoneInfo('Europe/Paris')
-        _last_hour = _last_ts.tz_localize('UTC').astimezone(_paris).strftime('%Hh%M')
-    except Exception:
-        _last_hour = _last_ts.strftime('%Hh%M')  # fallback: UTC, better than nothing
+    # Last scrape: end of the latest successful run, one indexed row of
+    # scrape_runs (written by the scrapers). Without it, the latest created_at
+    # of the latest scraped_date, computed once per snapshot.
+    _stats_span = profiler.span("stats")
+    with _stats_span:
+        _last_local = last_scrape_time()
+        _last_date = _last_local.strftime('%Y-%m-%d')
+        _last_hour = _last_local.strftime('%Hh%M')
     
-    st.markdown(f"""
+    _stats_html = f"""
         <div class="stats-container">
             <div class="stat-item">
                 <p class="stat-label">Annonces:</p>
-                <p class="stat-value">{len(filtered_df)} / {len(df)}</p>
+                <p class="stat-value">{_n_filtered} / {len(df)}</p>
             </div>
             <div class="stat-item">
                 <p class="stat-label">Agences:</p>
-                <p class="stat-value">{filtered_df['site'].nunique()} / {df['site'].nunique()}</p>
+                <p class="stat-value">{_n_filtered_sites} / {df['site'].nunique()}</p>
             </div>
         </div>
             <br>
@@ -1169,21 +1456,18 @@ def page_listings():
                 <p class="stat-value">{_last_date} · {_last_hour}</p>
             </div>
         </div>
-    """, unsafe_allow_html=True)
+    """
+    _stats_span.bytes = len(_stats_html)
+    st.markdown(_stats_html, unsafe_allow_html=True)
     
     # DEV_MODE toolbar: shows dedup stats and link to review page.
     # Never rendered in production (DEV_MODE=false).
     if DEV_MODE:
-        m = _re.match(r'postgresql://([^:]+):([^@]+)@([^:]+):(\d+)/(\w+)', DATABASE_URL)
-        _u, _pw, _h, _p, _db = m.groups()
-        _conn = pg8000.native.Connection(
-            user=_u, password=_pw, host=_h,
-            port=int(_p), database=_db,
-            ssl_context=True, timeout=10
-        )
+        _conn = get_db_connection()
         try:
             _linked_count = _conn.run(
-                'SELECT COUNT(*) as n FROM properties WHERE canonical_id IS NOT NULL'
+                # Pre-aggregated per site/date by refresh_listing_views()
+                'SELECT COALESCE(SUM(linked), 0) FROM listing_stats'
             )[0][0]
         finally:
             _conn.close()
@@ -1202,7 +1486,7 @@ def page_listings():
     # UI - LISTE DES ANNONCES
     # =============================================================
     
-    if len(filtered_df) == 0:
+    if _n_filtered == 0:
         if not selected_sites:
             pass  # Warning already shown above
         else:
@@ -1211,16 +1495,19 @@ def page_listings():
         # Pagination -- bypassed in agency overlay mode (flat list, all listings).
         # When agency_filter is active: page_df = full filtered set, no nav bars rendered.
         if agency_filter:
-            page_df      = filtered_df
+            page_df      = df.loc[plan.rows]
             current_page = 0
             total_pages  = 1
             first_url = prev_url = next_url = last_url = ''
             first_attr = prev_attr = next_attr = last_attr = 'aria-disabled="true"'
         else:
-            unique_dates = sorted(filtered_df['scraped_date_dt'].unique(), reverse=True)
-            total_pages  = max(1, len(unique_dates))
-            current_page = min(st.session_state.current_page, total_pages - 1)  # clamp after filter
-            page_df      = filtered_df[filtered_df['scraped_date_dt'] == unique_dates[current_page]] if unique_dates else filtered_df.iloc[0:0]
+            # One scrape date per page, at most PAGE_SIZE cards: only this
+            # page's rows are materialized
+            total_pages  = plan.page_count
+            current_page = plan.clamp(st.session_state.current_page)  # clamp after filter
+            _start, _stop = plan.bounds(current_page)
+            page_df      = df.loc[plan.rows[_start:_stop]]
+            st.session_state.page_anchor = (_anchor_key, DATA_VERSION, plan.anchor(current_page))
     
             # Nav bar — pure HTML links, no st.columns needed
             def _nav_url(p):
@@ -1272,38 +1559,13 @@ def page_listings():
             </script>
         """, height=0)
     
-        # Inject all heart color rules in a single st.markdown call to avoid
-        # per-card empty stMarkdownContainer elements that create row gaps.
-        _fav_bottom = '37px' if DEV_MODE else '21px'  # DEV_MODE adds flag button below, shifting the card anchor
-        heart_styles = ''.join(
-            (
-                f".st-key-fav_{row['id']} [data-testid='stBaseButton-secondary'] {{"
-                f" bottom: {_fav_bottom} !important;"
-                f" background: {'#10B981' if row['id'] in st.session_state.favorites else 'transparent'} !important;"
-                f" border-color: {'#10B981' if row['id'] in st.session_state.favorites else 'var(--border-cream)'} !important; }}"
-                # Always the same filled glyph (U+2665). Unfavorited: knock fill to transparent,
-                # draw outline via -webkit-text-stroke. Same path = identical optical size.
-                + (f".st-key-fav_{row['id']} button p {{"
-                   f" color: #ffffff !important;"
-                   f" -webkit-text-stroke: 0 !important;"
-                   f" font-size: 1.4rem !important; }}"
-                   if row['id'] in st.session_state.favorites else
-                   f".st-key-fav_{row['id']} button p {{"
-                   f" color: transparent !important;"
-                   f" -webkit-text-stroke: 1px #ffffff !important;"
-                   f" font-size: 1.4rem !important; }}")
-            )
-            for _, row in page_df.iterrows()
-        )
-        st.markdown(f'<style>{heart_styles}</style>', unsafe_allow_html=True)
-    
         # Agency overlay banner -- shown only when ?agency= is active.
         # × is a plain <a href> that drops agency from current params and
         # returns to the exact same page, filters untouched.
         if agency_filter:
             _dismiss_params = {k: v for k, v in st.query_params.items() if k != 'agency'}
             _dismiss_url = '?' + urlencode(_dismiss_params) if _dismiss_params else '?'
-            _agency_count = len(filtered_df)
+            _agency_count = plan.total
             st.markdown(
                 f'<div class="agency-banner">'
                 f'<span class="agency-banner-name">{agency_filter}</span>'
@@ -1313,138 +1575,61 @@ def page_listings():
                 unsafe_allow_html=True,
             )
     
-        # Afficher les cartes, row-by-row (3 per row) to avoid empty column gaps on last row
-        for chunk_start in range(0, len(page_df), 3):
-            chunk = page_df.iloc[chunk_start:chunk_start+3]
-            cols = st.columns(3) if len(chunk) == 3 else st.columns(len(chunk))
-            for col, (_, row) in zip(cols, chunk.iterrows()):
-    
-                # Prix principal
-                price_display = format_price(row['price_numeric'])
-    
-                # Prix au m² (shown only when both values are available)
-                price_m2_display = format_price_per_m2(row['price_per_m2'])
-    
-                # Titre : nettoyer le préfixe/suffixe pour OuestFrance
-                raw_title = row['title'] if pd.notna(row['title']) else ''
-                if row['site'] == 'Ouest France Immo':
-                    title = clean_ouestfrance_title(raw_title)
-                else:
-                    title = raw_title
-    
-                # Description : tronquer à 100 caractères
-                raw_desc = row['description'] if pd.notna(row['description']) else ''
-                description = (raw_desc[:150] + '…') if len(raw_desc) > 150 else (raw_desc or 'Pas de description')
-    
-                is_favorited = row['id'] in st.session_state.favorites
-                button_key = f"fav_{row['id']}"
-    
-                # Price history: derive change signal from price_history JSONB.
-                # price_history is [{price, date}, ...] oldest first.
-                ph = row.get('price_history')
-                ph = ph if (ph and isinstance(ph, list)) else []
-                sq = row.get('square_meters')  # used to compute per-entry m2 price
-                if ph:
-                    prev_price = ph[-1].get('price')
-                    if prev_price is not None and row['price_numeric'] is not None:
-                        if row['price_numeric'] < prev_price:
-                            p_color, p_arrow = '#10B981', '&#8595;'  # green, down
-                        else:
-                            p_color, p_arrow = '#ef4444', '&#8593;'  # red, up
-                        amount_html = f'<span style="color:{p_color}">{p_arrow} {price_display}</span>'
-                    else:
-                        amount_html = price_display
-                    # One line per history entry: price - m2/price - date
-                    entry_lines = []
-                    for e in ph:
-                        ep = e.get('price')
-                        if ep is None:
-                            continue
-                        ed = e.get('date', '')
-                        em2 = (f' - {int(round(ep / sq)):,} €/m²'.replace(',', ' '))\
-                              if (sq and sq > 0) else ''
-                        entry_lines.append(
-                            f'<span class="card-price-history-entry">{format_price(ep)}{em2} - {ed}</span>'
-                        )
-                    history_section = (
-                        f'<div class="card-price-history">'
-                        f'<span class="card-price-history-label">Evolution du prix:</span>'
-                        + ''.join(entry_lines) +
-                        f'</div>'
-                    )
-                else:
-                    amount_html     = price_display
-                    history_section = ''
-    
-                # Build price block: optional history section above, price row at bottom.
-                # The fav button is absolutely positioned into the price row by CSS.
-                if price_m2_display:
-                    price_block = (
-                        f'{history_section}'
-                        f'<div class="card-price-row">'
-                        f'<span class="card-price-amount">{amount_html}</span>'
-                        f'<div class="card-price-sep"></div>'
-                        f'<span class="card-price-m2">{price_m2_display}</span>'
-                        f'</div>'
-                    )
-                else:
-                    price_block = (
-                        f'{history_section}'
-                        f'<div class="card-price-row">'
-                        f'<span class="card-price-amount">{amount_html}</span>'
-                        f'</div>'
-                    )
-    
-                with col:
-                    _live = row['live_url']
-                    _url  = row['url']
-                    _raw_url = _live if isinstance(_live, str) and _live.startswith('http') else _url
-                    card_url = _raw_url if isinstance(_raw_url, str) and _raw_url.startswith('http') else '#'
-                    card_html = f"""
-                    <div class="card-wrapper">
-                        <div class="card">
-                            <a href="{card_url}" target="_blank" class="card-link">
-                                <img src="{row['image_url'] if isinstance(row['image_url'], str) and row['image_url'].startswith('http') else no_image_data_uri}" class="card-image" alt="Photo">
-                            </a>
-                            <div class="card-header">
-                                <div class="card-header-badge">{logo_svg_text}</div>
-                                <div class="card-header-meta">{f'{row["site"]}<br>' if agency_filter else f'<a href="?{urlencode({**dict(st.query_params), "agency": row["site"]})}" class="agency-filter-link" target="_self">{row["site"]}</a>'}{row['scraped_date']}{' · #' + str(row['id']) if DEV_MODE else ''}</div>
-                            </div>
-                            <a href="{card_url}" target="_blank" class="card-link">
-                                <div class="card-title">{title}</div>
-                                <div class="card-description">{description}</div>
-                            </a>
-                            {price_block}
-                        </div>
-                    </div>
-                    """
-                    st.markdown(card_html, unsafe_allow_html=True)
-    
-                    if st.button("\u2764\uFE0E", key=button_key, help="is_fav" if is_favorited else "not_fav"):
-                        if is_favorited:
-                            st.session_state.favorites.remove(row['id'])
-                        else:
-                            st.session_state.favorites.add(row['id'])
-                        st.rerun()
-    
-                    if DEV_MODE:
-                        if st.button("\U0001f6a9", key=f"flag_{row['id']}", help="Signaler comme doublon"):
-                            flag_report_dialog(row['id'], row_title=title, row_site=row['site'])
-    
-        # Set stColumn to position:relative so the absolutely-positioned fav
-        # button anchors to its own column instead of escaping to a distant
-        # static ancestor. Runs once; guard prevents re-injection on rerun.
+        # Build every card's HTML in one pass over the page's column arrays.
+        # Agency links are computed once per site, not once per card.
+        # Price history is not part of the snapshot: fetch it for this page's
+        # cards only. A failed query just renders the cards without it, and
+        # keeps them out of the shared card cache: other sessions must not
+        # get history-less cards once the DB is back.
+        with profiler.span("price_history", rows_in=len(page_df)) as _span:
+            try:
+                _histories = price_histories_from_db(tuple(page_df['id'].tolist()), DATA_VERSION)
+                _history_ok = True
+            except Exception:
+                _histories = {}
+                _history_ok = False
+            page_df = page_df.assign(price_history=page_df['id'].map(_histories))
+            _span.rows_out = len(_histories)
+
+        with profiler.span("render_cards", rows_in=len(page_df)) as _span:
+            _params = dict(st.query_params)
+            if agency_filter:
+                agency_hrefs = None
+            else:
+                agency_hrefs = {site: '?' + urlencode({**_params, "agency": site})
+                                for site in page_df['site'].unique()}
+            cards = render_cards(page_df, logo_svg_use, no_image_data_uri,
+                                 agency_hrefs=agency_hrefs, dev_mode=DEV_MODE,
+                                 favorites=st.session_state.favorites,
+                                 cache=_card_cache() if _history_ok else None,
+                                 data_version=DATA_VERSION, thumb_base=THUMBNAIL_PROXY_URL,
+                                 action_href='?' + (urlencode(_params) + '&' if _params else ''))
+            _span.rows_out = len(cards)
+            if profiler.enabled:
+                _span.bytes = sum(len(card.html) for card in cards)
+
+        # Afficher les cartes: the whole grid is one markdown element, hearts
+        # and flags included (links, see card_renderer.py).
+        with profiler.span("emit_cards", rows_in=len(cards)):
+            st.markdown('<div class="card-grid">' + ''.join(card.html for card in cards) + '</div>',
+                        unsafe_allow_html=True)
+
+        # Heart/flag links end in #card-<id>, but the grid renders after the
+        # browser's own anchor jump: scroll back to that card once it exists.
         st.components.v1.html("""
             <script>
             (function() {
-                if (window.parent.__nantimmoColFixed) return;
-                window.parent.__nantimmoColFixed = true;
-                function fixCols() {
-                    var cols = window.parent.document.querySelectorAll('[data-testid="stColumn"]');
-                    if (!cols.length) { setTimeout(fixCols, 100); return; }
-                    cols.forEach(function(c) { c.style.position = 'relative'; });
+                var loc = window.parent.location;
+                var m = (loc.hash || '').match(/^#card-(\\d+)$/);
+                if (!m) return;
+                var tries = 30;
+                function scroll() {
+                    var card = window.parent.document.getElementById('card-' + m[1]);
+                    if (!card) { if (--tries) setTimeout(scroll, 100); return; }
+                    card.scrollIntoView({block: 'center'});
+                    window.parent.history.replaceState(null, '', loc.pathname + loc.search);
                 }
-                setTimeout(fixCols, 200);
+                scroll();
             })();
             </script>
         """, height=0)
@@ -1461,6 +1646,15 @@ def page_listings():
                 </div>
             """, unsafe_allow_html=True)
 
+    # Rerun profile: DEV_MODE panel and/or one JSON line in PERF_LOG
+    if profiler.enabled:
+        if PERF_LOG:
+            write_json_line(PERF_LOG, profiler, page="listings", data_version=DATA_VERSION,
+                            filtered=_n_filtered)
+        if DEV_MODE:
+            with st.expander(f"⏱ Profil du rerun · {profiler.total_ms():.0f} ms"):
+                st.dataframe(pd.DataFrame(profiler.report()), hide_index=True, use_container_width=True)
+
 
 # =============================================================
 # FILTER PAGE (inline render, no dialog wrapper)
@@ -1471,7 +1665,7 @@ def page_listings():
 
 def page_filter():
     """Filter form rendered as a full page (no dialog wrapper)."""
-    load_css(CSS_PATH)
+    # styles.css is already injected at module level, which runs before any page
 
     # Header row: title left, dismiss X right.
     # X uses st.switch_page so it behaves identically to Apply -- returns to
@@ -1483,6 +1677,13 @@ def page_filter():
         if st.button("\u00d7", key="pf_dismiss", help="Retour aux annonces"):
             st.switch_page(_listings_page)
 
+    # Result counts per option, from the facet index (no rescan of the listings)
+    facets, facet_matrix, facet_stats = facet_counts()
+    pending_sites = st.session_state.get('sites_multiselect')
+    if pending_sites is None:
+        pending_sites = st.session_state.applied_selected_sites or facets.sites
+    _type_counts = facets.type_counts(facet_matrix, pending_sites)
+
     # ------------------------------------------------------------------
     # Scope: Types
     # ------------------------------------------------------------------
@@ -1499,6 +1700,7 @@ def page_filter():
         key='property_types_multiselect',
         label_visibility='collapsed',
         placeholder="Choisir les types",
+        format_func=lambda label: f"{label} ({_type_counts.get(label, 0)})",
     )
 
     st.divider()
@@ -1544,6 +1746,8 @@ def page_filter():
         st.caption("! Prix min. invalide")
     if raw_price_max.strip() and price_max is None:
         st.caption("! Prix max. invalide")
+    if sparkline(facet_stats['price']):
+        st.caption(f"Prix des résultats : {sparkline(facet_stats['price'])}")
     st.divider()
 
     m2_min_data = df['square_meters'].min()
@@ -1557,17 +1761,10 @@ def page_filter():
         m2_min = st.number_input("Surface min. (m²)", min_value=0, max_value=max_m2, value=default_m2_min, step=5, placeholder="Pas de minimum", key="pf_m2_min")
     with col2:
         m2_max = st.number_input("Surface max. (m²)", min_value=0, max_value=max_m2, value=default_m2_max, step=5, placeholder="Pas de maximum", key="pf_m2_max")
+    if sparkline(facet_stats['surface']):
+        st.caption(f"Surfaces des résultats : {sparkline(facet_stats['surface'])}")
     st.divider()
 
-    SORT_OPTIONS = {
-        "Date (récent → ancien)":  (None,            None),
-        "Prix (croissant)":        ("price_numeric",  True),
-        "Prix (décroissant)":      ("price_numeric",  False),
-        "Prix/m² (croissant)":     ("price_per_m2",   True),
-        "Prix/m² (décroissant)":   ("price_per_m2",   False),
-        "Surface (croissante)":    ("square_meters",  True),
-        "Surface (décroissante)":  ("square_meters",  False),
-    }
     current_sort_label = st.session_state.applied_sort_label
     if current_sort_label not in SORT_OPTIONS:
         current_sort_label = "Date (récent → ancien)"
@@ -1591,7 +1788,9 @@ def page_filter():
                 st.session_state['sites_multiselect'] = []
     if 'sites_multiselect' not in st.session_state:
         st.session_state['sites_multiselect'] = default_sites
-    selected_sites = st.multiselect("Sources actives", options=available_sites, key='sites_multiselect', label_visibility='collapsed', placeholder="Choisir les agences")
+    _site_counts = facets.site_counts(facet_matrix, selected_ptype_labels)
+    selected_sites = st.multiselect("Sources actives", options=available_sites, key='sites_multiselect', label_visibility='collapsed', placeholder="Choisir les agences",
+                                    format_func=lambda site: f"{site} ({_site_counts.get(site, 0)})")
     st.divider()
 
     date_min_data = df['scraped_date_dt'].min()
@@ -1613,9 +1812,18 @@ def page_filter():
     else:
         selected_date_min = date_range
         selected_date_max = date_max_data
+    if sparkline(list(facet_stats['dates'].values())):
+        st.caption(f"Annonces par jour : {sparkline(list(facet_stats['dates'].values()))}")
     st.divider()
 
-    if st.button("Appliquer", use_container_width=True, type="primary", key="pf_apply_filters"):
+    _live_count = None if show_favorites else live_result_count(
+        facets, facet_matrix, selected_sites, selected_ptype_labels,
+        dict(search_term=search_term, price_min=price_min, price_max=price_max,
+             m2_min=m2_min, m2_max=m2_max,
+             selected_date_min=selected_date_min, selected_date_max=selected_date_max),
+    )
+    _apply_label = "Appliquer" if _live_count is None else f"Appliquer · {_live_count} annonces"
+    if st.button(_apply_label, use_container_width=True, type="primary", key="pf_apply_filters"):
         st.session_state.applied_search           = search_term
         st.session_state.applied_show_favorites   = show_favorites
         st.session_state.applied_price_min        = raw_price_min
@@ -1632,7 +1840,7 @@ def page_filter():
         st.switch_page(_listings_page)
 
     st.divider()
-    st.caption(f"Mis à jour: {df['scraped_date'].max()}")
+    st.caption(f"Mis à jour: {last_scrape_time():%Y-%m-%d}")
     st.caption(f"Total: {len(df)} annonces")
 
 
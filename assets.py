@@ -0,0 +1,96 @@
+"""
+assets.py -- static resources (CSS, SVG, placeholders) read once per process
+
+app.py used to re-read styles.css and the SVGs from disk and re-encode them
+on every rerun. AssetRegistry reads each file once, fingerprints it by
+content hash, and memoizes whatever is derived from it (minified <style>
+tag, SVG sprite, data URI) until that hash changes.
+
+With watch=True (DEV_MODE) a cheap stat() per access picks up edits to
+styles.css without restarting Streamlit; otherwise files are never touched
+again after the first load.
+"""
+
+import base64
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+
+# String literals are kept verbatim by the minifier (e.g. the @import URL)
+_CSS_STRING_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+
+def minify_css(css):
+    """Drop comments and redundant whitespace (strings left untouched)"""
+    parts = _CSS_STRING_RE.split(_CSS_COMMENT_RE.sub('', css))
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:  # string literal
+            out.append(part)
+            continue
+        part = re.sub(r'\s+', ' ', part)
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', part)
+        # Only after ':' -- a space before it is a descendant combinator (".a :hover")
+        part = re.sub(r':\s+', ':', part)
+        part = part.replace(';}', '}')
+        out.append(part)
+    return ''.join(out).strip()
+
+
+def style_tag(raw):
+    """Bytes of a CSS file -> minified <style> block for st.markdown"""
+    return f'<style>{minify_css(raw.decode("utf-8"))}</style>'
+
+
+def data_uri(mime):
+    """Builder: bytes -> base64 data URI of the given type"""
+    def build(raw):
+        return f'data:{mime};base64,{base64.b64encode(raw).decode()}'
+    return build
+
+
+class AssetRegistry:
+    """Files under root, loaded once and fingerprinted by content hash.
+
+    build(name, kind, builder) memoizes builder(raw_bytes) per (name, kind);
+    the result is recomputed only when the file's content hash changes.
+    Thread-safe: one registry is shared by every session.
+    """
+
+    def __init__(self, root, watch=False):
+        self.root = Path(root)
+        self.watch = watch
+        self._files = {}    # name -> (stat signature, digest, raw bytes)
+        self._derived = {}  # (name, kind) -> (digest, value)
+        self._lock = threading.Lock()
+
+    def _load(self, name):
+        entry = self._files.get(name)
+        if entry is not None and not self.watch:
+            return entry
+        stat = os.stat(self.root / name)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if entry is None or entry[0] != signature:
+            raw = (self.root / name).read_bytes()
+            entry = (signature, hashlib.sha256(raw).hexdigest()[:12], raw)
+            self._files[name] = entry
+        return entry
+
+    def digest(self, name):
+        """Short content hash of a file (changes whenever the file does)"""
+        with self._lock:
+            return self._load(name)[1]
+
+    def build(self, name, kind, builder):
+        """builder(raw bytes) for name, cached until the content changes"""
+        with self._lock:
+            _, digest, raw = self._load(name)
+            cached = self._derived.get((name, kind))
+            if cached is not None and cached[0] == digest:
+                return cached[1]
+            value = builder(raw)
+            self._derived[(name, kind)] = (digest, value)
+            return value
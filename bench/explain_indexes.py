@@ -0,0 +1,276 @@
+"""
+bench/explain_indexes.py -- check that every app query is served by an index
+
+Builds the full schema (db_migrations) in a scratch schema of the
+DATABASE_URL database, fills it with synthetic listings (1M by default,
+~10% linked as duplicates) across monthly partitions, archives the oldest
+duplicates, ANALYZEs, then runs EXPLAIN on each query shape the app, the
+scrapers and the review page issue. Prints the access path and
+the planner's cost per query; exits 1 if a query expected to use an index
+falls back to a sequential scan.
+
+    python bench/explain_indexes.py
+    python bench/explain_indexes.py --rows 200000 --analyze   # EXPLAIN ANALYZE timings
+    python bench/explain_indexes.py --keep                    # leave the schema for psql
+
+Nothing outside the scratch schema is touched, apart from the shared
+extensions and text search config that migration 5 creates in public if
+missing (they outlive the scratch schema).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db_migrations
+import db_search
+import dedup_candidates
+import listing_snapshot
+
+SCHEMA = 'bench_explain'
+
+SITES = ['Brigitte Sauvager', 'Graslin Immobilier', 'Ouest France Immo', 'Nantes Habitat',
+         'Cabinet Kervégan', 'Agence du Centre', 'Immo de Loire', 'Erdre Immobilier']
+
+# ~2000 listings per scrape date (500 days at 1M rows); id order = scrape order.
+# Every 10th row is a duplicate of the row just before it, first seen 30 days
+# earlier (an older sighting, so archive_listings() may move it).
+_FILL_SQL = '''
+    INSERT INTO properties (site, title, price, price_numeric, description, url, image_url,
+                            scraped_date, created_at, property_type, square_meters, canonical_id,
+                            last_seen, listing_ref)
+    SELECT
+        (%(sites)s::text[])[1 + g %% 8],
+        'Appartement ' || (1 + g %% 6) || ' pièces ' ||
+            (ARRAY['balcon', 'jardin', 'terrasse', 'ascenseur', 'cave', 'parking'])[1 + g %% 6],
+        (100000 + (g * 7919) %% 700000)::text || ' €',
+        100000 + (g * 7919) %% 700000,
+        'Bel appartement lumineux, ' ||
+            (ARRAY['proche tram', 'vue Erdre', 'quartier Zola', 'centre Bouffay', 'calme'])[1 + g %% 5] ||
+            ', ' || (ARRAY['balcon', 'jardin', 'terrasse', 'ascenseur', 'cave', 'parking'])[1 + (g / 7) %% 6] ||
+            -- dedup job markers on linked rows (classify_match() derives match_tier from them)
+            CASE WHEN g %% 20 = 0 THEN ' -- ref A' || g WHEN g %% 10 = 0 THEN ' -- fingerprint 0.9' ELSE '' END,
+        'https://example.com/annonce/' || g,
+        'https://example.com/photos/' || g || '.jpg',
+        to_char(DATE '2026-02-04' - ((%(rows)s - g) / 2000) - CASE WHEN g %% 10 = 0 THEN 30 ELSE 0 END,
+                'YYYY-MM-DD'),
+        TIMESTAMP '2026-02-04 20:00' - ((%(rows)s - g) / 2000) * INTERVAL '1 day',
+        (ARRAY['appartement', 'appartement', 'maison', 'loft', 'parking', 'terrain'])[1 + (g / 3) %% 6],
+        12 + (g * 31) %% 200,
+        CASE WHEN g %% 10 = 0 THEN g - 1 END,
+        DATE '2026-02-04' - ((%(rows)s - g) / 2000) - CASE WHEN g %% 10 = 0 THEN 30 ELSE 0 END,
+        CASE WHEN g %% 3 = 0 THEN 'A' || g END
+    FROM generate_series(1, %(rows)s) AS g
+'''
+
+# One previous price for every 5th listing
+_FILL_HISTORY_SQL = '''
+    INSERT INTO price_history (property_id, date, price)
+    SELECT g, to_char(DATE '2026-02-04' - ((%(rows)s - g) / 2000) - 30, 'YYYY-MM-DD'),
+           110000 + (g * 7919) %% 700000
+    FROM generate_series(5, %(rows)s, 5) AS g
+'''
+
+_FILL_REPORTS_SQL = '''
+    INSERT INTO dedup_reports (id_a, site_a, notes, reported_at, resolved)
+    SELECT g * 37, 'Graslin Immobilier', 'doublon ?',
+           TIMESTAMP '2026-02-04' - g * INTERVAL '1 hour', g %% 20 <> 0
+    FROM generate_series(1, 10000) AS g
+'''
+
+# Two runs a day, one in ten failed
+_FILL_RUNS_SQL = '''
+    INSERT INTO scrape_runs (started_at, finished_at, status, scraped, inserted)
+    SELECT TIMESTAMP '2026-02-04 20:00' - g * INTERVAL '12 hours' - INTERVAL '5 minutes',
+           TIMESTAMP '2026-02-04 20:00' - g * INTERVAL '12 hours',
+           CASE WHEN g %% 10 = 3 THEN 'failed' ELSE 'success' END, 2000, 2000
+    FROM generate_series(0, 999) AS g
+'''
+
+# (name, sql, params, expect_index). Params use the synthetic data's ranges.
+QUERIES = [
+    ('snapshot full load (view)',
+     'SELECT * FROM canonical_listings ORDER BY id DESC',
+     {}, False),  # reads the whole view: a seq scan is the right plan
+    ('snapshot delta (view)',
+     'SELECT * FROM canonical_listings WHERE updated_at > %(wm)s OR created_at > %(wm)s ORDER BY id DESC',
+     {'wm': '2026-02-03 00:00'}, True),
+    ('snapshot delta (dropped ids)',
+     listing_snapshot._DROPPED_QUERY.replace(':wm', '%(wm)s'),
+     {'wm': '2026-02-03 00:00'}, True),
+    ('date page',
+     'SELECT * FROM properties WHERE canonical_id IS NULL AND scraped_date = %(d)s ORDER BY id DESC',
+     {'d': '2026-01-15'}, True),
+    ('last scrape date',
+     'SELECT max(scraped_date) FROM properties WHERE canonical_id IS NULL',
+     {}, True),
+    ('site + date range',
+     'SELECT id FROM properties WHERE canonical_id IS NULL AND site = %(site)s AND scraped_date >= %(d)s',
+     {'site': 'Graslin Immobilier', 'd': '2026-01-20'}, True),
+    ('type + price range',
+     '''SELECT id FROM properties WHERE canonical_id IS NULL AND property_type = 'maison'
+        AND price_numeric BETWEEN 300000 AND 320000''',
+     {}, True),
+    ('surface range',
+     'SELECT id FROM properties WHERE canonical_id IS NULL AND square_meters BETWEEN 20 AND 22',
+     {}, True),
+    ('keyword search (GIN)',
+     db_search._SEARCH_SQL.replace(':q', '%(q)s'),
+     {'q': 'terrasse calme'}, True),
+    ('DEV toolbar linked count',
+     'SELECT COALESCE(SUM(linked), 0) FROM listing_stats',
+     {}, False),  # a few thousand pre-aggregated rows, scanned whole
+    ('review page pairs (first page)',
+     '''SELECT p.id, p.title, c.id, c.title FROM properties p
+        JOIN properties c ON c.id = p.canonical_id
+        WHERE p.canonical_id IS NOT NULL
+        ORDER BY p.scraped_date DESC, p.id DESC LIMIT 50''',
+     {}, True),
+    ('review page, tier 2 (next page)',
+     '''SELECT p.id, p.title, c.id, c.title FROM properties p
+        JOIN properties c ON c.id = p.canonical_id
+        WHERE p.canonical_id IS NOT NULL AND p.match_tier = 2
+          AND (p.scraped_date, p.id) < (%(d)s, %(id)s)
+        ORDER BY p.scraped_date DESC, p.id DESC LIMIT 50''',
+     {'d': '2025-12-01', 'id': 10**9}, True),
+    ('review page tier counts',
+     'SELECT COALESCE(match_tier, 0), count(*) FROM properties WHERE canonical_id IS NOT NULL GROUP BY 1',
+     {}, True),
+    ('price history (one page)',
+     '''SELECT property_id, date, price FROM price_history
+        WHERE property_id = ANY(%(ids)s) ORDER BY property_id, date, id''',
+     {'ids': list(range(500_000, 500_051))}, True),
+    ('header: last successful run',
+     '''SELECT finished_at, site_counts FROM scrape_runs
+        WHERE status = 'success' ORDER BY finished_at DESC LIMIT 1''',
+     {}, True),
+    ('report candidates (price bucket)',
+     dedup_candidates._BUCKET_SQL.format(type_clause='= %(type)s'),
+     {'type': 'maison', 'price': 310000, 'price_lo': 294500, 'price_hi': 325500,
+      'm2': 90.0, 'm2_lo': 82.8, 'm2_hi': 97.2, 'group': 1, 'limit': dedup_candidates.MAX_FETCHED}, True),
+    ('report candidates (shared ref)',
+     dedup_candidates._REF_SQL,
+     {'ref': 'A999', 'group': 1}, True),
+    ('pending reports',
+     'SELECT * FROM dedup_reports WHERE NOT resolved ORDER BY reported_at DESC',
+     {}, True),
+    ('scrape hits (touch_listings)',
+     '''UPDATE properties SET last_seen = %(d)s
+        WHERE image_url = ANY(%(urls)s) AND (last_seen IS NULL OR last_seen < %(d)s)''',
+     {'d': '2026-02-05', 'urls': [f'https://example.com/photos/{g}.jpg' for g in range(1, 4001)]}, True),
+    ('duplicate check (all image urls)',
+     'SELECT image_url FROM properties UNION SELECT image_url FROM properties_archive',
+     {}, False),  # reads every row by design
+]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def access_paths(plan):
+    """Scan nodes of a plan as 'Node Type on relation (index)'"""
+    paths = []
+    for node in plan_nodes(plan):
+        if 'Scan' in node['Node Type']:
+            label = node['Node Type']
+            if node.get('Index Name'):
+                label += f" {node['Index Name']}"
+            elif node.get('Relation Name'):
+                label += f" {node['Relation Name']}"
+            paths.append(label)
+    return paths
+
+
+def uses_index(plan, empty_relations=()):
+    """No sequential scan, except over relations known to be empty (spare partitions)"""
+    scans = [n for n in plan_nodes(plan) if 'Scan' in n['Node Type']]
+    return bool(scans) and not any(n['Node Type'] == 'Seq Scan'
+                                   and n.get('Relation Name') not in empty_relations
+                                   for n in scans)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='EXPLAIN every app query against a synthetic table')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (runs the queries)')
+    parser.add_argument('--keep', action='store_true', help=f'keep the {SCHEMA} schema afterwards')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    cursor = conn.cursor()
+    cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+    cursor.execute(f'SET search_path TO {SCHEMA}, public')
+    conn.commit()
+
+    failures = 0
+    try:
+        start = time.perf_counter()
+        db_migrations.migrate(conn, verbose=False)
+        # migrate() only creates partitions from today on
+        cursor.execute("SELECT ensure_properties_partitions(DATE '2026-02-04' - %(days)s, DATE '2026-02-04')",
+                       {'days': args.rows // 2000 + 31})
+        cursor.execute(_FILL_SQL, {'sites': SITES, 'rows': args.rows})
+        cursor.execute(_FILL_HISTORY_SQL, {'rows': args.rows})
+        cursor.execute(_FILL_REPORTS_SQL)
+        cursor.execute(_FILL_RUNS_SQL)
+        # Duplicates of the first two months go to properties_archive
+        cursor.execute("SELECT archive_listings(to_char(DATE '2026-02-04' - %(days)s + 60, 'YYYY-MM-DD'), '')",
+                       {'days': args.rows // 2000})
+        archived = cursor.fetchone()[0]
+        cursor.execute('SELECT refresh_listing_views()')
+        conn.commit()
+        conn.autocommit = True  # VACUUM cannot run inside a transaction
+        cursor.execute('VACUUM ANALYZE properties')
+        cursor.execute('VACUUM ANALYZE dedup_reports')
+        cursor.execute('VACUUM ANALYZE canonical_listings')
+        cursor.execute('VACUUM ANALYZE price_history')
+        cursor.execute('VACUUM ANALYZE properties_archive')
+        cursor.execute('VACUUM ANALYZE scrape_runs')
+        conn.autocommit = False
+        # Seq scans of empty partitions (properties_default, months ahead) are free
+        cursor.execute('''SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                          WHERE i.inhparent = 'properties'::regclass AND c.reltuples <= 0''')
+        empty_partitions = {row[0] for row in cursor.fetchall()}
+        print(f"Built {args.rows:,} listings ({archived:,} archived) in "
+              f"{time.perf_counter() - start:.0f}s\n")
+
+        explain = 'EXPLAIN (ANALYZE, FORMAT JSON)' if args.analyze else 'EXPLAIN (FORMAT JSON)'
+        print(f"{'query':<34} {'ok':<4} {'cost':>12} {'ms':>9}  access path")
+        for name, sql, params, expect_index in QUERIES:
+            cursor.execute(f'{explain} {sql}', params)
+            result = cursor.fetchone()[0]
+            result = result[0] if isinstance(result, list) else json.loads(result)[0]
+            plan = result['Plan']
+            indexed = uses_index(plan, empty_partitions)
+            ok = indexed or not expect_index
+            failures += not ok
+            ms = f"{result['Execution Time']:.1f}" if args.analyze else '-'
+            print(f"{name:<34} {'ok' if ok else 'FAIL':<4} {plan['Total Cost']:>12.0f} {ms:>9}  "
+                  f"{', '.join(access_paths(plan))}")
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        if not args.keep:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        conn.close()
+
+    if failures:
+        sys.exit(f"\n{failures} quer{'y' if failures == 1 else 'ies'} not served by an index")
+    print("\nAll app queries use an index")
+
+
+if __name__ == '__main__':
+    main()
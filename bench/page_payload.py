@@ -0,0 +1,75 @@
+"""
+bench/page_payload.py -- byte size of a rendered listings page
+
+Renders one page of synthetic cards (PAGE_SIZE = 51) through
+card_renderer twice -- logo inlined in every card vs. one SVG sprite
+referenced with <use> -- and prints the HTML payload of each, raw and
+gzipped (what actually crosses the websocket).
+
+    python bench/page_payload.py
+"""
+
+import base64
+import gzip
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from card_renderer import LOGO_SYMBOL_ID, render_cards, svg_sprite
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGE_SIZE = 51
+
+
+def synthetic_page(n=PAGE_SIZE):
+    return pd.DataFrame({
+        'id': range(1, n + 1),
+        'site': ['Brigitte Sauvager', 'Graslin Immobilier', 'Ouest France Immo'] * (n // 3) + ['Brigitte Sauvager'] * (n % 3),
+        'title': [f'Vente appartement {i % 5 + 1} pièces - Nantes Centre 44 - {40 + i} m²' for i in range(n)],
+        'description': ['Appartement traversant au 3e étage avec ascenseur, balcon et cave. ' * 3] * n,
+        'scraped_date': ['2026-02-04'] * n,
+        'price_numeric': [200000.0 + 1000 * i for i in range(n)],
+        'square_meters': [40.0 + i for i in range(n)],
+        'price_per_m2': [(200000.0 + 1000 * i) / (40 + i) for i in range(n)],
+        'price_history': [[{'price': 210000 + 1000 * i, 'date': '2026-01-10'}] if i % 4 == 0 else None for i in range(n)],
+        'url': [f'https://example.com/annonce/{i}' for i in range(n)],
+        'image_url': [f'https://example.com/photos/{i}.jpg' for i in range(n)],
+    })
+
+
+def page_html(cards, header):
+    return header + ''.join(card.html for card in cards)
+
+
+def main():
+    svg_text = (ROOT / 'img' / 'logo-nant-immo.svg').read_text(encoding='utf-8')
+    page = synthetic_page()
+    hrefs = {site: f'?agency={site}' for site in page['site'].unique()}
+
+    # Before: full SVG in every card, header logo as base64 <img>
+    logo_b64 = base64.b64encode(svg_text.encode()).decode()
+    before = page_html(
+        render_cards(page, svg_text, 'data:,', agency_hrefs=hrefs),
+        f'<img src="data:image/svg+xml;base64,{logo_b64}" class="header-logo">',
+    )
+
+    # After: one sprite, <use> everywhere
+    sprite_html, use_html = svg_sprite(svg_text, LOGO_SYMBOL_ID)
+    after = page_html(
+        render_cards(page, use_html, 'data:,', agency_hrefs=hrefs),
+        sprite_html + f'<span class="header-logo">{use_html}</span>',
+    )
+
+    print(f"{'':<18}{'raw bytes':>12}{'gzip bytes':>12}")
+    for label, html in (('inline logo', before), ('svg sprite', after)):
+        raw = html.encode()
+        print(f"{label:<18}{len(raw):>12,}{len(gzip.compress(raw)):>12,}")
+    saved = len(before.encode()) - len(after.encode())
+    print(f"saved {saved:,} bytes ({saved / len(before.encode()):.0%}) on a {PAGE_SIZE}-card page")
+
+
+if __name__ == '__main__':
+    main()
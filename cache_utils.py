@@ -0,0 +1,46 @@
+# cache_utils.py
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small thread-safe LRU map.
+
+    Streamlit runs each session in its own thread, so a cache shared through
+    st.cache_resource must guard its OrderedDict with a lock.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the cached value and mark it as recently used"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry if full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
@@ -0,0 +1,293 @@
+"""
+card_renderer.py -- HTML for the listing cards of one page
+
+Builds every card of a page in a single pass over column arrays (no
+iterrows), from one pre-formatted template. app.py emits the whole grid
+as one st.markdown block.
+
+The heart (and the flag in DEV_MODE) is a plain link inside the card:
+"?<current params>&fav=<id>#card-<id>", handled by app.py at the top of
+the next run, like the agency and page links. A 51-card page is one
+element instead of about 220 (a column, fragment, markdown block and
+heart button per card).
+
+Rendered fragments can be kept in an LRUCache keyed by (listing id, data
+version, favorite state, agency-overlay state). The agency and action
+links depend on the viewer's own query params, so they are left as
+placeholders in the cached HTML and substituted per render.
+"""
+
+import os
+import re
+from collections import namedtuple
+from itertools import repeat
+from urllib.parse import quote, urlsplit
+
+import pandas as pd
+
+# One rendered card; favorited records the heart state the html was rendered with
+Card = namedtuple('Card', ['id', 'html', 'title', 'site', 'favorited'])
+
+# Stand in for the per-viewer agency overlay link and for the "?<params>&"
+# prefix of the heart/flag links inside cached fragments
+_AGENCY_HREF = '\x00agency\x00'
+_ACTION_HREF = '\x00action\x00'
+
+_CARD_TEMPLATE = (
+    '<div class="card-wrapper" id="card-{row_id}">'
+    '<div class="card">'
+    '<a href="{card_url}" target="_blank" class="card-link">'
+    '<img src="{image_src}"{image_srcset} class="card-image" alt="Photo" loading="lazy" decoding="async">'
+    '</a>'
+    '<div class="card-header">'
+    '<div class="card-header-badge">{logo}</div>'
+    '<div class="card-header-meta">{site_html}{scraped_date}{dev_id}</div>'
+    '</div>'
+    '<a href="{card_url}" target="_blank" class="card-link">'
+    '<div class="card-title">{title}</div>'
+    '<div class="card-description">{description}</div>'
+    '</a>'
+    '{price_block}'
+    '</div>'
+    '</div>'
+)
+
+
+def format_price(price):
+    """Formate le prix pour l'affichage"""
+    if pd.notna(price):
+        return f"{int(price):,} €".replace(",", " ")
+    return "Prix non disponible"
+
+
+def format_price_per_m2(price_per_m2):
+    """Formate le prix au m² pour l'affichage sur les cartes"""
+    if pd.notna(price_per_m2) and price_per_m2 > 0:
+        return f"{int(round(price_per_m2)):,} €/m²".replace(",", " ")
+    return None
+
+
+def clean_ouestfrance_title(title):
+    """
+    Strips boilerplate from OuestFrance titles.
+    e.g. "Vente appartement 5 pièces - Nantes Zola 44 - 73 m²"
+      -> "5 pièces - Nantes Zola - 73 m²"
+
+    The scraper appends m² at the end, so the department code (e.g. "44")
+    is no longer the last token. We strip it wherever it appears as a
+    standalone 2-digit number preceded by a space, bounded by " - " or end.
+    """
+    # Remove leading "Vente appartement " (case-insensitive)
+    title = re.sub(r'^Vente\s+appartement\s+', '', title, flags=re.IGNORECASE)
+    # Remove department code: 2-digit number as a standalone word,
+    # optionally followed by " - " or end of string
+    title = re.sub(r'\s+\d{2}(?=\s*(?:-|$))', '', title)
+    return title.strip()
+
+
+LOGO_SYMBOL_ID = 'nantimmo-logo'
+
+
+def svg_sprite(svg_text, symbol_id):
+    """Wrap an SVG file's content in a hidden <symbol> sprite.
+
+    Returns (sprite_html, use_html): the sprite goes into the page once,
+    every other occurrence is the few bytes of use_html.
+    """
+    view_box = re.search(r'viewBox="([^"]+)"', svg_text).group(1)
+    # Drop the XML prolog and outer <svg> element, keep the drawing itself
+    inner = re.search(r'<svg[^>]*>(.*)</svg>', svg_text, flags=re.DOTALL).group(1)
+    inner = re.sub(r'<title>.*?</title>', '', inner, flags=re.DOTALL)
+    inner = re.sub(r'>\s+<', '><', inner.strip())
+    sprite_html = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" style="display:none">'
+        f'<symbol id="{symbol_id}" viewBox="{view_box}">{inner}</symbol>'
+        f'</svg>'
+    )
+    use_html = f'<svg viewBox="{view_box}"><use href="#{symbol_id}"/></svg>'
+    return sprite_html, use_html
+
+
+def _price_block(price, price_per_m2, square_meters, price_history, actions=''):
+    """Price row (ending with the actions links), preceded by the price history section when there is one"""
+    price_display = format_price(price)
+    price_m2_display = format_price_per_m2(price_per_m2)
+
+    # Price history: derive change signal from the page's price_history
+    # (listing_snapshot.fetch_price_histories): [{price, date}, ...] oldest first.
+    ph = price_history if (price_history and isinstance(price_history, list)) else []
+    if ph:
+        prev_price = ph[-1].get('price')
+        if prev_price is not None and pd.notna(price):
+            if price < prev_price:
+                p_color, p_arrow = '#10B981', '&#8595;'  # green, down
+            else:
+                p_color, p_arrow = '#ef4444', '&#8593;'  # red, up
+            amount_html = f'<span style="color:{p_color}">{p_arrow} {price_display}</span>'
+        else:
+            amount_html = price_display
+        # One line per history entry: price - m2/price - date
+        sq = square_meters if pd.notna(square_meters) else None
+        entry_lines = []
+        for e in ph:
+            ep = e.get('price')
+            if ep is None:
+                continue
+            ed = e.get('date', '')
+            em2 = (f' - {int(round(ep / sq)):,} €/m²'.replace(',', ' ')) if (sq and sq > 0) else ''
+            entry_lines.append(
+                f'<span class="card-price-history-entry">{format_price(ep)}{em2} - {ed}</span>'
+            )
+        history_section = (
+            '<div class="card-price-history">'
+            '<span class="card-price-history-label">Evolution du prix:</span>'
+            + ''.join(entry_lines) +
+            '</div>'
+        )
+    else:
+        amount_html = price_display
+        history_section = ''
+
+    m2_html = (
+        f'<div class="card-price-sep"></div><span class="card-price-m2">{price_m2_display}</span>'
+        if price_m2_display else ''
+    )
+    return (
+        f'{history_section}'
+        f'<div class="card-price-row">'
+        f'<span class="card-price-amount">{amount_html}</span>'
+        f'{m2_html}'
+        f'{actions}'
+        f'</div>'
+    )
+
+
+def _http_or(value, fallback):
+    return value if isinstance(value, str) and value.startswith('http') else fallback
+
+
+# Widths served by thumbnail_proxy.py; cards are ~300px wide (up to ~3x on retina)
+THUMB_WIDTHS = (320, 640, 960)
+_THUMB_SIZES = '(max-width: 640px) 100vw, (max-width: 1100px) 50vw, 33vw'
+
+# Photo hosts the proxy accepts (subdomains included; thumbnail_proxy.py
+# refuses any other). Photos from other hosts are hotlinked as before.
+THUMB_SOURCE_HOSTS = tuple(h.strip().lower() for h in os.getenv(
+    'THUMB_SOURCE_HOSTS', 'brigitte-sauvager.com,graslin-immobilier.com').split(',') if h.strip())
+
+
+def is_thumbnail_source(image_url):
+    """True when the proxy will serve this photo (its host is in THUMB_SOURCE_HOSTS)"""
+    try:
+        host = (urlsplit(image_url).hostname or '').lower()
+    except ValueError:
+        return False
+    return any(host == allowed or host.endswith('.' + allowed) for allowed in THUMB_SOURCE_HOSTS)
+
+
+def thumbnail_attrs(image_url, thumb_base):
+    """(src, extra <img> attributes) for a photo served through the thumbnail proxy"""
+    base = f"{thumb_base.rstrip('/')}/thumb?url={quote(image_url, safe='')}&w="
+    srcset = ', '.join(f'{base}{w} {w}w' for w in THUMB_WIDTHS)
+    return f'{base}{THUMB_WIDTHS[0]}', f' srcset="{srcset}" sizes="{_THUMB_SIZES}"'
+
+
+def _render_card(row_id, site, raw_title, raw_desc, scraped_date, price, price_m2, sq,
+                 history, live_url, url, image_url, is_favorited, overlay,
+                 logo_svg, no_image_uri, dev_mode, thumb_base=None):
+    """HTML of one card (agency and action links left as placeholders) and its cleaned title"""
+    # Whitespace collapsed: a blank line would end the grid's markdown HTML block
+    # Titre : nettoyer le préfixe/suffixe pour OuestFrance
+    raw_title = ' '.join(raw_title.split()) if isinstance(raw_title, str) else ''
+    title = clean_ouestfrance_title(raw_title) if site == 'Ouest France Immo' else raw_title
+
+    # Description : tronquer à 150 caractères
+    raw_desc = ' '.join(raw_desc.split()) if isinstance(raw_desc, str) else ''
+    description = (raw_desc[:150] + '…') if len(raw_desc) > 150 else (raw_desc or 'Pas de description')
+
+    if overlay:
+        site_html = f'{site}<br>'
+    else:
+        site_html = f'<a href="{_AGENCY_HREF}" class="agency-filter-link" target="_self">{site}</a>'
+
+    # Heart and flag: links handled by app.py (handle_card_action)
+    fav_class = 'card-fav card-fav-on' if is_favorited else 'card-fav'
+    fav_title = 'Retirer des favoris' if is_favorited else 'Ajouter aux favoris'
+    actions = (
+        f'<a href="{_ACTION_HREF}fav={row_id}#card-{row_id}" class="{fav_class}" '
+        f'target="_self" title="{fav_title}">&#x2665;&#xFE0E;</a>'
+    )
+    if dev_mode:
+        actions = (
+            f'<a href="{_ACTION_HREF}flag={row_id}#card-{row_id}" class="card-flag" '
+            f'target="_self" title="Signaler comme doublon">&#x1F6A9;</a>' + actions
+        )
+
+    # Photo: resized variants through the proxy when configured, else hotlinked
+    image_src = _http_or(image_url, None)
+    image_srcset = ''
+    if image_src is None:
+        image_src = no_image_uri
+    elif thumb_base and is_thumbnail_source(image_src):
+        image_src, image_srcset = thumbnail_attrs(image_src, thumb_base)
+
+    html = _CARD_TEMPLATE.format(
+        row_id=row_id,
+        card_url=_http_or(live_url, _http_or(url, '#')),
+        image_src=image_src,
+        image_srcset=image_srcset,
+        logo=logo_svg,
+        site_html=site_html,
+        scraped_date=scraped_date,
+        dev_id=f' · #{row_id}' if dev_mode else '',
+        title=title,
+        description=description,
+        price_block=_price_block(price, price_m2, sq, history, actions),
+    )
+    return html, title
+
+
+def render_cards(page_df, logo_svg, no_image_uri, agency_hrefs=None, dev_mode=False,
+                 favorites=frozenset(), cache=None, data_version=None, thumb_base=None,
+                 action_href='?'):
+    """Render all cards of a page in one pass.
+
+    agency_hrefs maps site -> "?..." link for the agency overlay; None means
+    the overlay is active and the site is shown as plain text. action_href
+    is the "?<current params>&" prefix of the heart/flag links. With a cache
+    (LRUCache), unchanged cards are reused across reruns and sessions.
+    thumb_base is the thumbnail proxy URL (photos are hotlinked when None);
+    it is fixed per process so it is not part of the cache key.
+    """
+    n = len(page_df)
+    overlay = agency_hrefs is None
+
+    def col(name):
+        return page_df[name].tolist() if name in page_df.columns else repeat(None, n)
+
+    cards = []
+    for (row_id, site, raw_title, raw_desc, scraped_date, price, price_m2, sq,
+         history, live_url, url, image_url) in zip(
+            col('id'), col('site'), col('title'), col('description'), col('scraped_date'),
+            col('price_numeric'), col('price_per_m2'), col('square_meters'),
+            col('price_history'), col('live_url'), col('url'), col('image_url')):
+
+        is_favorited = row_id in favorites
+        key = (row_id, data_version, is_favorited, overlay)
+        fragment = cache.get(key) if cache is not None else None
+        if fragment is None:
+            fragment = _render_card(
+                row_id, site, raw_title, raw_desc, scraped_date, price, price_m2, sq,
+                history, live_url, url, image_url, is_favorited, overlay,
+                logo_svg, no_image_uri, dev_mode, thumb_base,
+            )
+            if cache is not None:
+                cache.put(key, fragment)
+
+        html, title = fragment
+        html = html.replace(_ACTION_HREF, action_href)
+        if not overlay:
+            html = html.replace(_AGENCY_HREF, agency_hrefs[site])
+        cards.append(Card(row_id, html, title, site, is_favorited))
+    return cards
+
@@ -0,0 +1,1030 @@
+"""
+db_migrations.py -- versioned schema for the Nant'Immo database
+
+Owns every table, column, trigger and index the scrapers and the app rely
+on. Each migration is a numbered list of statements applied once, in
+order, in its own transaction; applied versions are recorded in
+schema_migrations.
+
+Statements are written to be idempotent (IF NOT EXISTS, OR REPLACE): the
+production database predates this module -- its columns were added by hand
+-- so the first run on it only records the versions and creates what is
+missing.
+
+    python db_migrations.py           # apply pending migrations
+    python db_migrations.py --status  # list applied / pending
+
+run_scrapers.setup_database() calls migrate() before every scrape; each
+call also creates the next months' partitions of properties (migration 9).
+"""
+
+import db_search
+
+# (version, name, statements). Never edit an applied migration: add a new one.
+MIGRATIONS = [
+    (1, 'properties table', [
+        '''
+        CREATE TABLE IF NOT EXISTS properties (
+            id SERIAL PRIMARY KEY,
+            site TEXT,
+            title TEXT,
+            price TEXT,
+            price_numeric INTEGER,
+            description TEXT,
+            url TEXT,
+            image_url TEXT,
+            scraped_date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Duplicate check on insert (get_existing_image_urls)
+        'CREATE INDEX IF NOT EXISTS idx_image_url ON properties(image_url)',
+    ]),
+    (2, 'listing detail and dedup columns', [
+        # Columns the app and the review page read, filled by the scrapers
+        # and the dedup job but never declared in setup_database() before
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS square_meters NUMERIC',
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS property_type TEXT',
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS live_url TEXT',
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS listing_ref TEXT',
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS price_history JSONB',
+        # NULL = canonical listing, else id of the listing this one duplicates
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS canonical_id INTEGER',
+        '''
+        CREATE TABLE IF NOT EXISTS dedup_reports (
+            id SERIAL PRIMARY KEY,
+            id_a INTEGER,
+            id_b INTEGER,
+            site_a TEXT,
+            site_b TEXT,
+            notes TEXT,
+            reported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            resolved BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        ''',
+    ]),
+    (3, 'updated_at watermark', [
+        # updated_at + created_at are the app's delta-refresh watermark.
+        # Backfill before the trigger exists so old rows keep their creation time.
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP',
+        'UPDATE properties SET updated_at = created_at WHERE updated_at IS NULL',
+        'ALTER TABLE properties ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP',
+        '''
+        CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.updated_at = CURRENT_TIMESTAMP;
+                RETURN NEW;
+            END
+            $$
+        ''',
+        'DROP TRIGGER IF EXISTS trg_properties_updated_at ON properties',
+        '''
+        CREATE TRIGGER trg_properties_updated_at
+            BEFORE UPDATE ON properties
+            FOR EACH ROW EXECUTE FUNCTION set_updated_at()
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_properties_updated_at ON properties(updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_properties_created_at ON properties(created_at)',
+    ]),
+    (4, 'data_version counter', [
+        # Single-row change counter polled by the app (replaces its cache TTL)
+        '''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'INSERT INTO data_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING',
+    ]),
+    (5, 'full-text search', db_search.SETUP_SQL),
+    (6, 'indexes for app query shapes', [
+        # Almost every read is "canonical listings only": partial indexes skip
+        # the linked duplicates entirely and stay smaller than full ones.
+        # Snapshot load (ORDER BY id DESC) and date pages (one scraped_date,
+        # newest first), plus the "last scrape" stat (max scraped_date)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_canonical_date
+            ON properties (scraped_date DESC, id DESC) WHERE canonical_id IS NULL
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_canonical_id
+            ON properties (id DESC) WHERE canonical_id IS NULL
+        ''',
+        # Source filter and agency overlay, usually with a date range
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_canonical_site_date
+            ON properties (site, scraped_date DESC) WHERE canonical_id IS NULL
+        ''',
+        # Property type scope + price range
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_canonical_type_price
+            ON properties (property_type, price_numeric) WHERE canonical_id IS NULL
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_canonical_surface
+            ON properties (square_meters) WHERE canonical_id IS NULL
+        ''',
+        # Linked duplicates: DEV toolbar count and the review page (newest
+        # pairs first, joined back to their canonical row by primary key)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_linked
+            ON properties (scraped_date DESC, id DESC) INCLUDE (canonical_id)
+            WHERE canonical_id IS NOT NULL
+        ''',
+        # Pending manual reports, newest first
+        '''
+        CREATE INDEX IF NOT EXISTS idx_dedup_reports_pending
+            ON dedup_reports (reported_at DESC) WHERE NOT resolved
+        ''',
+        'ANALYZE properties',
+    ]),
+    (7, 'canonical_listings view and listing_stats', [
+        # Canonical rows only, without search_vector, with what the app would
+        # otherwise derive per load. A listing and its linked duplicates form
+        # one group (COALESCE(canonical_id, id)): the latest sighting gives
+        # latest_price/last_seen_date, and updated_at is the group's latest
+        # change so the app's delta refresh notices a newly linked duplicate.
+        '''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS canonical_listings AS
+        WITH groups AS (
+            SELECT COALESCE(canonical_id, id) AS group_id,
+                   max(updated_at) AS updated_at,
+                   max(scraped_date) AS last_seen_date,
+                   (array_agg(price_numeric ORDER BY scraped_date DESC, id DESC))[1] AS latest_price
+            FROM properties
+            GROUP BY 1
+        )
+        SELECT c.id, c.site, c.title, c.price, c.price_numeric, c.description,
+               c.url, c.image_url, c.live_url, c.scraped_date, c.created_at,
+               g.updated_at,
+               c.property_type, c.square_meters, c.listing_ref, c.price_history,
+               CASE WHEN c.square_meters > 0
+                    THEN round(c.price_numeric / c.square_meters, 2) END AS price_per_m2,
+               COALESCE(g.latest_price, c.price_numeric) AS latest_price,
+               g.last_seen_date
+        FROM properties c
+        JOIN groups g ON g.group_id = c.id
+        WHERE c.canonical_id IS NULL
+        ''',
+        # Unique index: required by REFRESH ... CONCURRENTLY, and serves ORDER BY id DESC
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_canonical_listings_id ON canonical_listings (id)',
+        'CREATE INDEX IF NOT EXISTS idx_canonical_listings_updated_at ON canonical_listings (updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_canonical_listings_created_at ON canonical_listings (created_at)',
+        # Counts per site and scrape date (linked = hidden duplicates)
+        '''
+        CREATE TABLE IF NOT EXISTS listing_stats (
+            site TEXT NOT NULL,
+            scraped_date TEXT NOT NULL,
+            listings INTEGER NOT NULL,
+            linked INTEGER NOT NULL,
+            PRIMARY KEY (site, scraped_date)
+        )
+        ''',
+        # Called by every writer of properties, in its own transaction and
+        # before bumping data_version: the app never sees a new version with
+        # a stale view. CONCURRENTLY keeps the view readable meanwhile.
+        '''
+        CREATE OR REPLACE FUNCTION refresh_listing_views() RETURNS void
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                REFRESH MATERIALIZED VIEW CONCURRENTLY canonical_listings;
+                DELETE FROM listing_stats;
+                INSERT INTO listing_stats (site, scraped_date, listings, linked)
+                SELECT coalesce(site, ''), coalesce(scraped_date, ''),
+                       count(*) FILTER (WHERE canonical_id IS NULL),
+                       count(*) FILTER (WHERE canonical_id IS NOT NULL)
+                FROM properties
+                GROUP BY 1, 2;
+            END
+            $$
+        ''',
+        'SELECT refresh_listing_views()',
+    ]),
+    (8, 'price_history table', [
+        # Append-only: one row per previous price of a listing, oldest first
+        # by (date, id). Replaces reading the JSONB blob of every listing.
+        '''
+        CREATE TABLE IF NOT EXISTS price_history (
+            id BIGSERIAL PRIMARY KEY,
+            property_id INTEGER NOT NULL,
+            date TEXT,
+            price INTEGER NOT NULL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_price_history_property ON price_history (property_id, date, id)',
+        '''
+        INSERT INTO price_history (property_id, date, price)
+        SELECT p.id, e.value->>'date', round((e.value->>'price')::numeric)::integer
+        FROM properties p
+        CROSS JOIN LATERAL jsonb_array_elements(p.price_history) WITH ORDINALITY AS e(value, n)
+        WHERE jsonb_typeof(p.price_history) = 'array'
+          AND e.value->>'price' IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM price_history h WHERE h.property_id = p.id)
+        ORDER BY p.id, e.n
+        ''',
+        # Keeps the table in step with writers that still maintain the JSONB
+        # column (new array elements are mirrored) and records the old price
+        # when price_numeric changes on its own.
+        '''
+        CREATE OR REPLACE FUNCTION record_price_history() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                known INTEGER := 0;
+            BEGIN
+                IF TG_OP = 'UPDATE' THEN
+                    IF NEW.price_history IS DISTINCT FROM OLD.price_history THEN
+                        IF jsonb_typeof(OLD.price_history) = 'array' THEN
+                            known := jsonb_array_length(OLD.price_history);
+                        END IF;
+                    ELSIF NEW.price_numeric IS DISTINCT FROM OLD.price_numeric THEN
+                        IF OLD.price_numeric IS NOT NULL THEN
+                            INSERT INTO price_history (property_id, date, price)
+                            VALUES (OLD.id, OLD.scraped_date, OLD.price_numeric);
+                        END IF;
+                        RETURN NEW;
+                    ELSE
+                        RETURN NEW;
+                    END IF;
+                END IF;
+                IF jsonb_typeof(NEW.price_history) = 'array' THEN
+                    INSERT INTO price_history (property_id, date, price)
+                    SELECT NEW.id, e.value->>'date', round((e.value->>'price')::numeric)::integer
+                    FROM jsonb_array_elements(NEW.price_history) WITH ORDINALITY AS e(value, n)
+                    WHERE e.n > known AND e.value->>'price' IS NOT NULL
+                    ORDER BY e.n;
+                END IF;
+                RETURN NEW;
+            END
+            $$
+        ''',
+        'DROP TRIGGER IF EXISTS trg_properties_price_history ON properties',
+        '''
+        CREATE TRIGGER trg_properties_price_history
+            AFTER INSERT OR UPDATE OF price_numeric, price_history ON properties
+            FOR EACH ROW EXECUTE FUNCTION record_price_history()
+        ''',
+        # Same view without the JSONB column: the app fetches history per page
+        'DROP MATERIALIZED VIEW IF EXISTS canonical_listings',
+        '''
+        CREATE MATERIALIZED VIEW canonical_listings AS
+        WITH groups AS (
+            SELECT COALESCE(canonical_id, id) AS group_id,
+                   max(updated_at) AS updated_at,
+                   max(scraped_date) AS last_seen_date,
+                   (array_agg(price_numeric ORDER BY scraped_date DESC, id DESC))[1] AS latest_price
+            FROM properties
+            GROUP BY 1
+        )
+        SELECT c.id, c.site, c.title, c.price, c.price_numeric, c.description,
+               c.url, c.image_url, c.live_url, c.scraped_date, c.created_at,
+               g.updated_at,
+               c.property_type, c.square_meters, c.listing_ref,
+               CASE WHEN c.square_meters > 0
+                    THEN round(c.price_numeric / c.square_meters, 2) END AS price_per_m2,
+               COALESCE(g.latest_price, c.price_numeric) AS latest_price,
+               g.last_seen_date
+        FROM properties c
+        JOIN groups g ON g.group_id = c.id
+        WHERE c.canonical_id IS NULL
+        ''',
+        'CREATE UNIQUE INDEX idx_canonical_listings_id ON canonical_listings (id)',
+        'CREATE INDEX idx_canonical_listings_updated_at ON canonical_listings (updated_at)',
+        'CREATE INDEX idx_canonical_listings_created_at ON canonical_listings (created_at)',
+    ]),
+    (9, 'monthly partitions and cold archive', [
+        # properties becomes range-partitioned by scraped_date (ISO text, so
+        # month bounds compare correctly as strings). The table is rebuilt:
+        # rename, create the partitioned copy, move the rows, drop the old
+        # one -- all in this migration's transaction. The primary key must
+        # include the partition key; ids still come from the same sequence.
+        "UPDATE properties SET scraped_date = to_char(COALESCE(created_at, CURRENT_TIMESTAMP), 'YYYY-MM-DD') "
+        "WHERE scraped_date IS NULL",
+        'DROP MATERIALIZED VIEW IF EXISTS canonical_listings',
+        'ALTER TABLE properties RENAME TO properties_legacy',
+        # Frees the properties_pkey name for the new table
+        'ALTER TABLE properties_legacy DROP CONSTRAINT IF EXISTS properties_pkey',
+        '''
+        CREATE TABLE properties (LIKE properties_legacy INCLUDING DEFAULTS INCLUDING GENERATED)
+            PARTITION BY RANGE (scraped_date)
+        ''',
+        'ALTER TABLE properties ALTER COLUMN scraped_date SET NOT NULL',
+        'ALTER TABLE properties ADD PRIMARY KEY (id, scraped_date)',
+        # Anything outside the monthly partitions (malformed dates, or a
+        # month not created yet) lands here instead of failing the insert
+        'CREATE TABLE properties_default PARTITION OF properties DEFAULT',
+        # Creates the missing properties_YYYY_MM partitions. Rows already in
+        # properties_default for that month are moved into the new table
+        # before it is attached (ATTACH refuses overlapping default rows).
+        '''
+        CREATE OR REPLACE FUNCTION ensure_properties_partitions(first_day DATE, last_day DATE)
+            RETURNS void LANGUAGE plpgsql AS $$
+            DECLARE
+                month DATE := date_trunc('month', first_day);
+                part TEXT;
+                lo TEXT;
+                hi TEXT;
+                cols TEXT;
+            BEGIN
+                SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO cols
+                FROM pg_attribute
+                WHERE attrelid = 'properties'::regclass AND attnum > 0
+                  AND NOT attisdropped AND attgenerated = '';
+                WHILE month <= last_day LOOP
+                    part := 'properties_' || to_char(month, 'YYYY_MM');
+                    lo := to_char(month, 'YYYY-MM-DD');
+                    hi := to_char(month + INTERVAL '1 month', 'YYYY-MM-DD');
+                    IF to_regclass(part) IS NULL THEN
+                        EXECUTE format('CREATE TABLE %I (LIKE properties INCLUDING DEFAULTS INCLUDING GENERATED)', part);
+                        EXECUTE format(
+                            'WITH moved AS (DELETE FROM properties_default '
+                            'WHERE scraped_date >= %L AND scraped_date < %L RETURNING %s) '
+                            'INSERT INTO %I (%s) SELECT %s FROM moved',
+                            lo, hi, cols, part, cols, cols);
+                        EXECUTE format('ALTER TABLE properties ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                                       part, lo, hi);
+                    END IF;
+                    month := month + INTERVAL '1 month';
+                END LOOP;
+            END
+            $$
+        ''',
+        '''
+        SELECT ensure_properties_partitions(
+            COALESCE((SELECT min(scraped_date) FROM properties_legacy
+                      WHERE scraped_date ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}$')::date, CURRENT_DATE),
+            CURRENT_DATE + 62)
+        ''',
+        # Copy every stored column (including any added by hand), then hand
+        # the id sequence over before the old table goes
+        '''
+        DO $$
+        DECLARE
+            cols TEXT;
+            seq TEXT;
+        BEGIN
+            SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO cols
+            FROM pg_attribute
+            WHERE attrelid = 'properties_legacy'::regclass AND attnum > 0
+              AND NOT attisdropped AND attgenerated = '';
+            EXECUTE format('INSERT INTO properties (%s) SELECT %s FROM properties_legacy', cols, cols);
+            IF (SELECT count(*) FROM properties) <> (SELECT count(*) FROM properties_legacy) THEN
+                RAISE EXCEPTION 'properties copy incomplete';
+            END IF;
+            seq := pg_get_serial_sequence('properties_legacy', 'id');
+            IF seq IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY properties.id', seq);
+            END IF;
+        END
+        $$
+        ''',
+        'DROP TABLE properties_legacy',
+        # Same index set as before, now partitioned indexes
+        'CREATE INDEX idx_image_url ON properties (image_url)',
+        'CREATE INDEX idx_properties_updated_at ON properties (updated_at)',
+        'CREATE INDEX idx_properties_created_at ON properties (created_at)',
+        'CREATE INDEX idx_properties_search ON properties USING GIN (search_vector)',
+        '''
+        CREATE INDEX idx_properties_canonical_date
+            ON properties (scraped_date DESC, id DESC) WHERE canonical_id IS NULL
+        ''',
+        'CREATE INDEX idx_properties_canonical_id ON properties (id DESC) WHERE canonical_id IS NULL',
+        '''
+        CREATE INDEX idx_properties_canonical_site_date
+            ON properties (site, scraped_date DESC) WHERE canonical_id IS NULL
+        ''',
+        '''
+        CREATE INDEX idx_properties_canonical_type_price
+            ON properties (property_type, price_numeric) WHERE canonical_id IS NULL
+        ''',
+        '''
+        CREATE INDEX idx_properties_canonical_surface
+            ON properties (square_meters) WHERE canonical_id IS NULL
+        ''',
+        '''
+        CREATE INDEX idx_properties_linked
+            ON properties (scraped_date DESC, id DESC) INCLUDE (canonical_id)
+            WHERE canonical_id IS NOT NULL
+        ''',
+        '''
+        CREATE TRIGGER trg_properties_updated_at
+            BEFORE UPDATE ON properties
+            FOR EACH ROW EXECUTE FUNCTION set_updated_at()
+        ''',
+        '''
+        CREATE TRIGGER trg_properties_price_history
+            AFTER INSERT OR UPDATE OF price_numeric, price_history ON properties
+            FOR EACH ROW EXECUTE FUNCTION record_price_history()
+        ''',
+        # Cold storage: rows moved out by archive_listings(). archived_at is
+        # read by the app's delta refresh to drop them from its snapshot.
+        'CREATE TABLE IF NOT EXISTS properties_archive (LIKE properties)',
+        'ALTER TABLE properties_archive DROP COLUMN IF EXISTS search_vector',
+        'ALTER TABLE properties_archive ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+        'CREATE INDEX IF NOT EXISTS idx_properties_archive_archived_at ON properties_archive (archived_at)',
+        'CREATE INDEX IF NOT EXISTS idx_properties_archive_id ON properties_archive (id)',
+        # Moves linked duplicates scraped before linked_before, and whole
+        # groups (listing + duplicates) first scraped before stale_before.
+        # Returns the number of rows moved. Replaced in migration 13.
+        '''
+        CREATE OR REPLACE FUNCTION archive_listings(linked_before TEXT, stale_before TEXT)
+            RETURNS INTEGER LANGUAGE plpgsql AS $$
+            DECLARE
+                cols TEXT;
+                moved INTEGER;
+            BEGIN
+                SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO cols
+                FROM pg_attribute
+                WHERE attrelid = 'properties_archive'::regclass AND attnum > 0
+                  AND NOT attisdropped AND attname <> 'archived_at';
+                EXECUTE format($f$
+                    WITH stale_groups AS (
+                        SELECT COALESCE(canonical_id, id) AS group_id
+                        FROM properties
+                        GROUP BY 1
+                        HAVING max(scraped_date) < %L
+                    ), moved AS (
+                        DELETE FROM properties
+                        WHERE (canonical_id IS NOT NULL AND scraped_date < %L)
+                           OR COALESCE(canonical_id, id) IN (SELECT group_id FROM stale_groups)
+                        RETURNING %s
+                    )
+                    INSERT INTO properties_archive (%s) SELECT %s FROM moved
+                $f$, stale_before, linked_before, cols, cols, cols);
+                GET DIAGNOSTICS moved = ROW_COUNT;
+                RETURN moved;
+            END
+            $$
+        ''',
+        # The view depended on the old table: recreate it unchanged
+        '''
+        CREATE MATERIALIZED VIEW canonical_listings AS
+        WITH groups AS (
+            SELECT COALESCE(canonical_id, id) AS group_id,
+                   max(updated_at) AS updated_at,
+                   max(scraped_date) AS last_seen_date,
+                   (array_agg(price_numeric ORDER BY scraped_date DESC, id DESC))[1] AS latest_price
+            FROM properties
+            GROUP BY 1
+        )
+        SELECT c.id, c.site, c.title, c.price, c.price_numeric, c.description,
+               c.url, c.image_url, c.live_url, c.scraped_date, c.created_at,
+               g.updated_at,
+               c.property_type, c.square_meters, c.listing_ref,
+               CASE WHEN c.square_meters > 0
+                    THEN round(c.price_numeric / c.square_meters, 2) END AS price_per_m2,
+               COALESCE(g.latest_price, c.price_numeric) AS latest_price,
+               g.last_seen_date
+        FROM properties c
+        JOIN groups g ON g.group_id = c.id
+        WHERE c.canonical_id IS NULL
+        ''',
+        'CREATE UNIQUE INDEX idx_canonical_listings_id ON canonical_listings (id)',
+        'CREATE INDEX idx_canonical_listings_updated_at ON canonical_listings (updated_at)',
+        'CREATE INDEX idx_canonical_listings_created_at ON canonical_listings (created_at)',
+        'ANALYZE properties',
+    ]),
+    (10, 'scrape_runs metadata', [
+        # One row per scraper run, written by the load step. The app header
+        # reads the latest successful one instead of scanning listings;
+        # monitoring can alert on now() - max(finished_at).
+        '''
+        CREATE TABLE IF NOT EXISTS scrape_runs (
+            id SERIAL PRIMARY KEY,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL,
+            scraped INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0,
+            archived INTEGER NOT NULL DEFAULT 0,
+            site_counts JSONB NOT NULL DEFAULT '{}',
+            data_version BIGINT,
+            error TEXT
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_scrape_runs_success
+            ON scrape_runs (finished_at DESC) WHERE status = 'success'
+        ''',
+        # site_counts: {"<site>": {"scraped": n, "inserted": n}}. Records the
+        # data_version current at the end of the run.
+        '''
+        CREATE OR REPLACE FUNCTION record_scrape_run(
+            run_started_at TIMESTAMP, run_status TEXT, run_scraped INTEGER,
+            run_inserted INTEGER, run_archived INTEGER, run_site_counts JSONB,
+            run_error TEXT DEFAULT NULL)
+            RETURNS INTEGER LANGUAGE sql AS $$
+            INSERT INTO scrape_runs (started_at, status, scraped, inserted, archived,
+                                     site_counts, data_version, error)
+            SELECT run_started_at, run_status, run_scraped, run_inserted, run_archived,
+                   COALESCE(run_site_counts, '{}'), (SELECT version FROM data_version), run_error
+            RETURNING id
+            $$
+        ''',
+        # Seed from existing listings so the header has a value before the next run
+        '''
+        INSERT INTO scrape_runs (started_at, finished_at, status, scraped, inserted, site_counts, data_version)
+        SELECT min(created_at), max(created_at), 'success', count(*), count(*),
+               COALESCE((SELECT jsonb_object_agg(site, jsonb_build_object('scraped', n, 'inserted', n))
+                         FROM (SELECT COALESCE(site, '') AS site, count(*) AS n
+                               FROM properties
+                               WHERE scraped_date = (SELECT max(scraped_date) FROM properties)
+                               GROUP BY 1) s), '{}'),
+               (SELECT version FROM data_version)
+        FROM properties
+        WHERE scraped_date = (SELECT max(scraped_date) FROM properties)
+          AND NOT EXISTS (SELECT 1 FROM scrape_runs)
+        HAVING count(*) > 0
+        ''',
+    ]),
+    (11, 'stored match tier of linked duplicates', [
+        # How a duplicate was matched, stored when it is linked instead of
+        # parsed from its description by the review page. NULL tier = unknown.
+        # match_score: the linker's confidence (1 for a shared agency ref).
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS match_tier SMALLINT',
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS match_score REAL',
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS linked_at TIMESTAMP',
+        'ALTER TABLE properties_archive ADD COLUMN IF NOT EXISTS match_tier SMALLINT',
+        'ALTER TABLE properties_archive ADD COLUMN IF NOT EXISTS match_score REAL',
+        'ALTER TABLE properties_archive ADD COLUMN IF NOT EXISTS linked_at TIMESTAMP',
+        # Linkers that set match_tier/match_score keep their values; the
+        # dedup job's description markers ("-- ref", "-- tier 1",
+        # "-- fingerprint <score>") fill them otherwise
+        '''
+        CREATE OR REPLACE FUNCTION classify_match() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF NEW.canonical_id IS NULL THEN
+                    NEW.match_tier := NULL;
+                    NEW.match_score := NULL;
+                    NEW.linked_at := NULL;
+                    RETURN NEW;
+                END IF;
+                IF TG_OP = 'INSERT' OR NEW.canonical_id IS DISTINCT FROM OLD.canonical_id THEN
+                    NEW.linked_at := CURRENT_TIMESTAMP;
+                    IF TG_OP = 'UPDATE' AND NEW.match_tier IS NOT DISTINCT FROM OLD.match_tier THEN
+                        NEW.match_tier := NULL;  -- relinked: reclassify unless the writer set it
+                        NEW.match_score := NULL;
+                    END IF;
+                END IF;
+                IF NEW.match_tier IS NULL THEN
+                    NEW.match_tier := CASE
+                        WHEN NEW.description LIKE '%-- ref %' OR NEW.description LIKE '%-- tier 1%' THEN 1
+                        WHEN NEW.description LIKE '%-- fingerprint%' THEN 2
+                    END;
+                END IF;
+                IF NEW.match_score IS NULL THEN
+                    NEW.match_score := CASE NEW.match_tier
+                        WHEN 1 THEN 1
+                        WHEN 2 THEN substring(NEW.description from '-- fingerprint[^0-9]*([0-9]+(?:[.][0-9]+)?)')::real
+                    END;
+                END IF;
+                RETURN NEW;
+            END
+            $$
+        ''',
+        # Backfill without touching updated_at (no row content changes for the app)
+        'ALTER TABLE properties DISABLE TRIGGER trg_properties_updated_at',
+        '''
+        UPDATE properties SET
+            match_tier = CASE
+                WHEN description LIKE '%-- ref %' OR description LIKE '%-- tier 1%' THEN 1
+                WHEN description LIKE '%-- fingerprint%' THEN 2
+            END,
+            linked_at = COALESCE(updated_at, created_at)
+        WHERE canonical_id IS NOT NULL
+        ''',
+        '''
+        UPDATE properties SET match_score = CASE match_tier
+            WHEN 1 THEN 1
+            WHEN 2 THEN substring(description from '-- fingerprint[^0-9]*([0-9]+(?:[.][0-9]+)?)')::real
+        END
+        WHERE canonical_id IS NOT NULL
+        ''',
+        'ALTER TABLE properties ENABLE TRIGGER trg_properties_updated_at',
+        'DROP TRIGGER IF EXISTS trg_properties_classify_match ON properties',
+        '''
+        CREATE TRIGGER trg_properties_classify_match
+            BEFORE INSERT OR UPDATE OF canonical_id, description, match_tier ON properties
+            FOR EACH ROW EXECUTE FUNCTION classify_match()
+        ''',
+        # Review queue: newest pairs first, per tier
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_linked_tier
+            ON properties (match_tier, scraped_date DESC, id DESC) INCLUDE (canonical_id)
+            WHERE canonical_id IS NOT NULL
+        ''',
+        'ANALYZE properties',
+    ]),
+    (12, 'reviewed duplicate links', [
+        # Set when a reviewer confirms a pair on the dedup review page;
+        # cleared by classify_match() when the link changes
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS confirmed_at TIMESTAMP',
+        'ALTER TABLE properties_archive ADD COLUMN IF NOT EXISTS confirmed_at TIMESTAMP',
+        '''
+        CREATE OR REPLACE FUNCTION classify_match() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF NEW.canonical_id IS NULL THEN
+                    NEW.match_tier := NULL;
+                    NEW.match_score := NULL;
+                    NEW.linked_at := NULL;
+                    NEW.confirmed_at := NULL;
+                    RETURN NEW;
+                END IF;
+                IF TG_OP = 'INSERT' OR NEW.canonical_id IS DISTINCT FROM OLD.canonical_id THEN
+                    NEW.linked_at := CURRENT_TIMESTAMP;
+                    IF TG_OP = 'UPDATE' AND NEW.match_tier IS NOT DISTINCT FROM OLD.match_tier THEN
+                        NEW.match_tier := NULL;  -- relinked: reclassify unless the writer set it
+                        NEW.match_score := NULL;
+                    END IF;
+                    IF TG_OP = 'UPDATE' AND NEW.confirmed_at IS NOT DISTINCT FROM OLD.confirmed_at THEN
+                        NEW.confirmed_at := NULL;  -- a new pair needs a new review
+                    END IF;
+                END IF;
+                IF NEW.match_tier IS NULL THEN
+                    NEW.match_tier := CASE
+                        WHEN NEW.description LIKE '%-- ref %' OR NEW.description LIKE '%-- tier 1%' THEN 1
+                        WHEN NEW.description LIKE '%-- fingerprint%' THEN 2
+                    END;
+                END IF;
+                IF NEW.match_score IS NULL THEN
+                    NEW.match_score := CASE NEW.match_tier
+                        WHEN 1 THEN 1
+                        WHEN 2 THEN substring(NEW.description from '-- fingerprint[^0-9]*([0-9]+(?:[.][0-9]+)?)')::real
+                    END;
+                END IF;
+                RETURN NEW;
+            END
+            $$
+        ''',
+    ]),
+    (13, 'last seen date', [
+        # scraped_date is the first sighting: the scrapers only insert new
+        # image_urls. last_seen is bumped by touch_listings() on every scrape
+        # hit, so archive_listings() can tell a listing that is still online
+        # from one that is gone.
+        'ALTER TABLE properties ADD COLUMN IF NOT EXISTS last_seen DATE',
+        'ALTER TABLE properties_archive ADD COLUMN IF NOT EXISTS last_seen DATE',
+        'ALTER TABLE properties DISABLE TRIGGER trg_properties_updated_at',
+        '''
+        UPDATE properties SET last_seen = scraped_date::date
+        WHERE last_seen IS NULL AND scraped_date ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}$'
+        ''',
+        'ALTER TABLE properties ENABLE TRIGGER trg_properties_updated_at',
+        'ALTER TABLE properties ALTER COLUMN last_seen SET DEFAULT CURRENT_DATE',
+        # A sighting is not a content change: it must not move updated_at,
+        # or every scrape would push every listing through the app's delta
+        'DROP TRIGGER IF EXISTS trg_properties_updated_at ON properties',
+        '''
+        CREATE TRIGGER trg_properties_updated_at
+            BEFORE UPDATE ON properties
+            FOR EACH ROW WHEN (OLD.last_seen IS NOT DISTINCT FROM NEW.last_seen)
+            EXECUTE FUNCTION set_updated_at()
+        ''',
+        # Returns the number of listings whose last_seen moved
+        '''
+        CREATE OR REPLACE FUNCTION touch_listings(urls TEXT[], seen DATE)
+            RETURNS INTEGER LANGUAGE sql AS $$
+            WITH touched AS (
+                UPDATE properties SET last_seen = seen
+                WHERE image_url = ANY(urls) AND (last_seen IS NULL OR last_seen < seen)
+                RETURNING 1
+            )
+            SELECT count(*)::integer FROM touched
+        $$
+        ''',
+        # Same contract as before (ISO dates, '' disables a cutoff), on
+        # last_seen instead of scraped_date:
+        #   - whole groups (listing + duplicates) not seen since stale_before
+        #   - linked duplicates not seen since linked_before, except the
+        #     group's latest sighting (scraped_date DESC, id DESC), so the
+        #     view's last_seen_date and latest_price do not change
+        '''
+        CREATE OR REPLACE FUNCTION archive_listings(linked_before TEXT, stale_before TEXT)
+            RETURNS INTEGER LANGUAGE plpgsql AS $$
+            DECLARE
+                cols TEXT;
+                moved INTEGER;
+            BEGIN
+                SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO cols
+                FROM pg_attribute
+                WHERE attrelid = 'properties_archive'::regclass AND attnum > 0
+                  AND NOT attisdropped AND attname <> 'archived_at';
+                EXECUTE format($f$
+                    WITH stale_groups AS (
+                        SELECT COALESCE(canonical_id, id) AS group_id
+                        FROM properties
+                        GROUP BY 1
+                        HAVING max(COALESCE(last_seen::text, scraped_date)) < %L
+                    ), latest AS (
+                        SELECT DISTINCT ON (COALESCE(canonical_id, id)) id
+                        FROM properties
+                        ORDER BY COALESCE(canonical_id, id), scraped_date DESC, id DESC
+                    ), moved AS (
+                        DELETE FROM properties
+                        WHERE (canonical_id IS NOT NULL
+                               AND COALESCE(last_seen::text, scraped_date) < %L
+                               AND id NOT IN (SELECT id FROM latest))
+                           OR COALESCE(canonical_id, id) IN (SELECT group_id FROM stale_groups)
+                        RETURNING %s
+                    )
+                    INSERT INTO properties_archive (%s) SELECT %s FROM moved
+                $f$, stale_before, linked_before, cols, cols, cols);
+                GET DIAGNOSTICS moved = ROW_COUNT;
+                RETURN moved;
+            END
+            $$
+        ''',
+    ]),
+    (14, 'listing_ref lookup', [
+        # Report candidates sharing an agency reference (dedup_candidates._REF_SQL)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_properties_canonical_ref
+            ON properties (listing_ref) WHERE canonical_id IS NULL AND listing_ref IS NOT NULL
+        ''',
+    ]),
+    (15, 'refresh views on link changes', [
+        # The dedup linker (outside this repo) writes canonical_id directly.
+        # Any UPDATE statement that changes a link refreshes the derived
+        # views and bumps data_version itself, in the writer's transaction,
+        # so linked duplicates leave the app without waiting for a scrape.
+        # One refresh per statement: a writer issuing many link UPDATEs in
+        # one transaction should SET LOCAL listings.defer_refresh = 'on'
+        # and finish with SELECT refresh_listing_views(); SELECT bump_data_version();
+        '''
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS INTEGER
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v INTEGER;
+            BEGIN
+                UPDATE data_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                RETURNING version INTO v;
+                PERFORM pg_notify('listings_updated', v::text);
+                RETURN v;
+            END
+            $$
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION refresh_on_link_change() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF current_setting('listings.defer_refresh', true) = 'on' THEN
+                    RETURN NULL;
+                END IF;
+                IF EXISTS (SELECT 1 FROM old_rows o JOIN new_rows n ON n.id = o.id
+                           WHERE n.canonical_id IS DISTINCT FROM o.canonical_id) THEN
+                    PERFORM refresh_listing_views();
+                    PERFORM bump_data_version();
+                END IF;
+                RETURN NULL;
+            END
+            $$
+        ''',
+        # Transition tables rule out an UPDATE OF column list: the function
+        # compares canonical_id itself
+        'DROP TRIGGER IF EXISTS trg_properties_link_change ON properties',
+        '''
+        CREATE TRIGGER trg_properties_link_change
+            AFTER UPDATE ON properties
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION refresh_on_link_change()
+        ''',
+    ]),
+    (16, 'link-change trigger on canonical_id only', [
+        # Migration 15's trigger ran on every UPDATE of properties (scrape
+        # upserts, touch_listings...) and joined its transition tables each
+        # time. Now a row trigger fires only for rows whose canonical_id
+        # actually changed and just sets a transaction flag; the statement
+        # trigger, restricted to UPDATEs that set canonical_id, refreshes
+        # only when the flag is on.
+        'DROP TRIGGER IF EXISTS trg_properties_link_change ON properties',
+        # data_version.version is BIGINT; the return type needs a DROP
+        'DROP FUNCTION IF EXISTS bump_data_version()',
+        '''
+        CREATE FUNCTION bump_data_version() RETURNS BIGINT
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v BIGINT;
+            BEGIN
+                UPDATE data_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                RETURNING version INTO v;
+                PERFORM pg_notify('listings_updated', v::text);
+                RETURN v;
+            END
+            $$
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION note_link_change() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                PERFORM set_config('listings.link_changed', 'on', true);
+                RETURN NULL;
+            END
+            $$
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION refresh_on_link_change() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF current_setting('listings.link_changed', true) IS DISTINCT FROM 'on' THEN
+                    RETURN NULL;
+                END IF;
+                PERFORM set_config('listings.link_changed', 'off', true);
+                -- Deferred: the writer refreshes and bumps once at the end
+                IF current_setting('listings.defer_refresh', true) = 'on' THEN
+                    RETURN NULL;
+                END IF;
+                PERFORM refresh_listing_views();
+                PERFORM bump_data_version();
+                RETURN NULL;
+            END
+            $$
+        ''',
+        'DROP TRIGGER IF EXISTS trg_properties_link_row ON properties',
+        # Row AFTER triggers fire before the statement's AFTER trigger
+        '''
+        CREATE TRIGGER trg_properties_link_row
+            AFTER UPDATE OF canonical_id ON properties
+            FOR EACH ROW
+            WHEN (OLD.canonical_id IS DISTINCT FROM NEW.canonical_id)
+            EXECUTE FUNCTION note_link_change()
+        ''',
+        '''
+        CREATE TRIGGER trg_properties_link_change
+            AFTER UPDATE OF canonical_id ON properties
+            FOR EACH STATEMENT EXECUTE FUNCTION refresh_on_link_change()
+        ''',
+    ]),    (17, 'last_seen_date from last_seen', [
+        # last_seen_date was still the group's latest first sighting
+        # (scraped_date); it now uses last_seen like archive_listings(). A
+        # sighting does not move updated_at, so the app's delta refresh does
+        # not pick it up between full loads.
+        'DROP MATERIALIZED VIEW IF EXISTS canonical_listings',
+        '''
+        CREATE MATERIALIZED VIEW canonical_listings AS
+        WITH groups AS (
+            SELECT COALESCE(canonical_id, id) AS group_id,
+                   max(updated_at) AS updated_at,
+                   max(COALESCE(last_seen::text, scraped_date)) AS last_seen_date,
+                   (array_agg(price_numeric ORDER BY scraped_date DESC, id DESC))[1] AS latest_price
+            FROM properties
+            GROUP BY 1
+        )
+        SELECT c.id, c.site, c.title, c.price, c.price_numeric, c.description,
+               c.url, c.image_url, c.live_url, c.scraped_date, c.created_at,
+               g.updated_at,
+               c.property_type, c.square_meters, c.listing_ref,
+               CASE WHEN c.square_meters > 0
+                    THEN round(c.price_numeric / c.square_meters, 2) END AS price_per_m2,
+               COALESCE(g.latest_price, c.price_numeric) AS latest_price,
+               g.last_seen_date
+        FROM properties c
+        JOIN groups g ON g.group_id = c.id
+        WHERE c.canonical_id IS NULL
+        ''',
+        'CREATE UNIQUE INDEX idx_canonical_listings_id ON canonical_listings (id)',
+        'CREATE INDEX idx_canonical_listings_updated_at ON canonical_listings (updated_at)',
+        'CREATE INDEX idx_canonical_listings_created_at ON canonical_listings (created_at)',
+        # Archiving linked duplicates also keeps the group's latest sighting
+        # by last_seen, so last_seen_date still does not change
+        '''
+        CREATE OR REPLACE FUNCTION archive_listings(linked_before TEXT, stale_before TEXT)
+            RETURNS INTEGER LANGUAGE plpgsql AS $$
+            DECLARE
+                cols TEXT;
+                moved INTEGER;
+            BEGIN
+                SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO cols
+                FROM pg_attribute
+                WHERE attrelid = 'properties_archive'::regclass AND attnum > 0
+                  AND NOT attisdropped AND attname <> 'archived_at';
+                EXECUTE format($f$
+                    WITH stale_groups AS (
+                        SELECT COALESCE(canonical_id, id) AS group_id
+                        FROM properties
+                        GROUP BY 1
+                        HAVING max(COALESCE(last_seen::text, scraped_date)) < %L
+                    ), latest AS (
+                        SELECT DISTINCT ON (COALESCE(canonical_id, id)) id
+                        FROM properties
+                        ORDER BY COALESCE(canonical_id, id), scraped_date DESC, id DESC
+                    ), latest_seen AS (
+                        SELECT DISTINCT ON (COALESCE(canonical_id, id)) id
+                        FROM properties
+                        ORDER BY COALESCE(canonical_id, id),
+                                 COALESCE(last_seen::text, scraped_date) DESC, id DESC
+                    ), moved AS (
+                        DELETE FROM properties
+                        WHERE (canonical_id IS NOT NULL
+                               AND COALESCE(last_seen::text, scraped_date) < %L
+                               AND id NOT IN (SELECT id FROM latest)
+                               AND id NOT IN (SELECT id FROM latest_seen))
+                           OR COALESCE(canonical_id, id) IN (SELECT group_id FROM stale_groups)
+                        RETURNING %s
+                    )
+                    INSERT INTO properties_archive (%s) SELECT %s FROM moved
+                $f$, stale_before, linked_before, cols, cols, cols);
+                GET DIAGNOSTICS moved = ROW_COUNT;
+                RETURN moved;
+            END
+            $$
+        ''',
+    ]),
+]
+
+# Run after the migrations on every migrate(): keeps next months' partitions
+# ahead of the scrapers, so new rows never pile up in properties_default
+MAINTENANCE_SQL = [
+    'SELECT ensure_properties_partitions(CURRENT_DATE, CURRENT_DATE + 62)',
+]
+
+_CREATE_MIGRATIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Arbitrary app-wide key: two scrapers starting together apply migrations once
+_ADVISORY_LOCK_KEY = 724_310_041
+
+
+def applied_versions(cursor):
+    cursor.execute(_CREATE_MIGRATIONS_TABLE)
+    cursor.execute('SELECT version FROM schema_migrations')
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, trigram=False, verbose=True):
+    """Apply pending migrations on a psycopg2 connection. Returns the versions applied.
+
+    trigram=True also creates the optional pg_trgm search index
+    (SEARCH_TRIGRAM); it is not a numbered migration because it is opt-in
+    per deployment.
+    """
+    applied = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT pg_advisory_lock(%s)', (_ADVISORY_LOCK_KEY,))
+        try:
+            done = applied_versions(cursor)
+            conn.commit()
+            for version, name, statements in MIGRATIONS:
+                if version in done:
+                    continue
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name)
+                )
+                conn.commit()
+                applied.append(version)
+                if verbose:
+                    print(f"Applied migration {version}: {name}")
+            for statement in MAINTENANCE_SQL:
+                cursor.execute(statement)
+            if trigram:
+                for statement in db_search.TRIGRAM_SETUP_SQL:
+                    cursor.execute(statement)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (_ADVISORY_LOCK_KEY,))
+            conn.commit()
+    finally:
+        cursor.close()
+    return applied
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Apply Nant\'Immo schema migrations')
+    parser.add_argument('--status', action='store_true', help='list applied / pending versions only')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    try:
+        if args.status:
+            cursor = conn.cursor()
+            done = applied_versions(cursor)
+            conn.commit()
+            for version, name, _ in MIGRATIONS:
+                print(f"{'applied' if version in done else 'pending':>8}  {version:>3}  {name}")
+        else:
+            trigram = os.getenv('SEARCH_TRIGRAM', 'false').lower() == 'true'
+            if not migrate(conn, trigram=trigram):
+                print("Schema up to date")
+    finally:
+        conn.close()
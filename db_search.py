@@ -0,0 +1,97 @@
+"""
+db_search.py -- Postgres full-text keyword search over properties
+
+Used when the app runs with SEARCH_BACKEND=postgres: the `search` query param
+is answered by the GIN index on properties.search_vector instead of the
+in-process SearchIndex.
+
+  - search_vector : generated tsvector, French stemming + unaccent,
+                    title weighted A, description weighted B
+  - trigram index : optional (SEARCH_TRIGRAM=true), lets substring queries
+                    like "partement" still match via LIKE on the
+                    accent-folded, lowercased text (f_unaccent(lower(...)))
+
+SETUP_SQL is applied as migration 5 by db_migrations.py, TRIGRAM_SETUP_SQL
+by migrate(trigram=True).
+"""
+
+# unaccent() is only STABLE, so generated columns and expression indexes
+# cannot call it directly. The wrapper pins the dictionary and is declared
+# IMMUTABLE -- the usual Postgres idiom.
+# Extensions always go to public, which everything below names explicitly:
+# with another schema first in search_path (bench/explain_indexes.py) they
+# would otherwise land there.
+SETUP_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent SCHEMA public",
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent', $1) $$
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'french_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION public.french_unaccent (COPY = pg_catalog.french);
+            ALTER TEXT SEARCH CONFIGURATION public.french_unaccent
+                ALTER MAPPING FOR hword, hword_part, word WITH public.unaccent, french_stem;
+        END IF;
+    END
+    $$
+    """,
+    """
+    ALTER TABLE properties ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('public.french_unaccent', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('public.french_unaccent', coalesce(description, '')), 'B')
+        ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_properties_search ON properties USING GIN (search_vector)",
+]
+
+TRIGRAM_SETUP_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public",
+    """
+    CREATE INDEX IF NOT EXISTS idx_properties_search_trgm ON properties
+        USING GIN (f_unaccent(lower(coalesce(title, '') || ' ' || coalesce(description, '')))
+                   public.gin_trgm_ops)
+    """,
+]
+
+# Ranked ids of canonical listings matching the query. The trigram branch
+# must repeat the index expression verbatim for the planner to use it.
+_SEARCH_SQL = """
+    SELECT id, ts_rank(search_vector, websearch_to_tsquery('public.french_unaccent', :q)) AS rank
+    FROM properties
+    WHERE canonical_id IS NULL
+      AND search_vector @@ websearch_to_tsquery('public.french_unaccent', :q)
+"""
+
+_SEARCH_TRGM_SQL = """
+    SELECT id, ts_rank(search_vector, websearch_to_tsquery('public.french_unaccent', :q)) AS rank
+    FROM properties
+    WHERE canonical_id IS NULL
+      AND (
+        search_vector @@ websearch_to_tsquery('public.french_unaccent', :q)
+        OR f_unaccent(lower(coalesce(title, '') || ' ' || coalesce(description, '')))
+           LIKE '%' || f_unaccent(lower(:pattern)) || '%'
+      )
+"""
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so user input is matched literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_ranks(conn, query, trigram=False):
+    """Run a keyword query on a pg8000 native connection.
+
+    Returns {id: rank}. Trigram-only matches (substring hits with no
+    full-text match) get rank 0 and sort last under "Pertinence".
+    """
+    if trigram:
+        rows = conn.run(_SEARCH_TRGM_SQL, q=query, pattern=escape_like(query.strip()))
+    else:
+        rows = conn.run(_SEARCH_SQL, q=query)
+    return {row[0]: float(row[1]) for row in rows}
@@ -0,0 +1,127 @@
+"""
+dedup_actions.py -- review decisions on duplicate links, applied in bulk
+
+Used by pages/dedup_review.py. Each function applies one decision to any
+number of rows with a single array-parameter statement (id = ANY(%s)), in
+one transaction on a psycopg2 connection, and returns the ids it changed.
+
+Unlinking puts listings back into canonical_listings: the canonical_id
+trigger (db_migrations, migrations 15-16) refreshes the derived views and bumps
+data_version in the same transaction, and the app picks the change up on
+its next version poll. Confirming and resolving do not change what the app
+shows.
+
+link_report() closes a manual report by linking the reported listing to
+the candidate the reviewer picked (dedup_candidates.find_candidates), as a
+confirmed tier 3 (manual) pair.
+"""
+
+
+def _apply(conn, statement, ids):
+    """Run statement on ids in one transaction"""
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return []
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(statement, (ids,))
+            changed = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return changed
+
+
+def unlink_pairs(conn, dupe_ids):
+    """Make these duplicates canonical listings again"""
+    return _apply(conn, '''
+        UPDATE properties SET canonical_id = NULL
+        WHERE id = ANY(%s) AND canonical_id IS NOT NULL
+        RETURNING id
+    ''', dupe_ids)
+
+
+def confirm_pairs(conn, dupe_ids):
+    """Mark these links as reviewed (confirmed_at)"""
+    return _apply(conn, '''
+        UPDATE properties SET confirmed_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s) AND canonical_id IS NOT NULL AND confirmed_at IS NULL
+        RETURNING id
+    ''', dupe_ids)
+
+
+def resolve_reports(conn, report_ids):
+    """Close these manual reports"""
+    return _apply(conn, '''
+        UPDATE dedup_reports SET resolved = TRUE
+        WHERE id = ANY(%s) AND NOT resolved
+        RETURNING id
+    ''', report_ids)
+
+
+# Writes back match columns by id (canonical_id unchanged: classify_match()
+# keeps them, and only derives a tier where the stored one was NULL)
+_RESTORE_MATCH_SQL = '''
+    UPDATE properties p
+    SET match_tier = v.match_tier, match_score = v.match_score,
+        confirmed_at = v.confirmed_at, linked_at = v.linked_at
+    FROM unnest(%s::integer[], %s::smallint[], %s::real[], %s::timestamp[], %s::timestamp[])
+         AS v(id, match_tier, match_score, confirmed_at, linked_at)
+    WHERE p.id = v.id
+'''
+
+
+def link_report(conn, report_id, listing_id, candidate_id, score=None):
+    """Link listing_id and candidate_id (their groups merge under the older
+    canonical) and resolve report_id with the candidate as id_b.
+
+    Returns the id that became a duplicate, or None if both were already
+    in the same group.
+    """
+    try:
+        with conn.cursor() as cursor:
+            # Several link UPDATEs: one refresh at the end instead of one each
+            cursor.execute("SET LOCAL listings.defer_refresh = 'on'")
+            cursor.execute('''
+                SELECT id, COALESCE(canonical_id, id), site FROM properties
+                WHERE id = ANY(%s)
+            ''', ([listing_id, candidate_id],))
+            found = {row[0]: row for row in cursor.fetchall()}
+            if listing_id not in found or candidate_id not in found:
+                raise ValueError(f"annonce introuvable: {listing_id} / {candidate_id}")
+            roots = {found[listing_id][1], found[candidate_id][1]}
+            keep, merged = min(roots), max(roots)
+            if keep != merged:
+                # The reviewer's pick: tier 3, already confirmed
+                cursor.execute('''
+                    UPDATE properties
+                    SET canonical_id = %(keep)s, match_tier = 3, match_score = %(score)s,
+                        confirmed_at = CURRENT_TIMESTAMP
+                    WHERE id = %(merged)s
+                ''', {'keep': keep, 'merged': merged, 'score': score})
+                # Duplicates of the merged group follow it, keeping their own
+                # tier, score and review: classify_match() resets those on any
+                # canonical_id change, so they are written back afterwards
+                cursor.execute('''
+                    SELECT id, match_tier, match_score, confirmed_at, linked_at FROM properties
+                    WHERE canonical_id = %(merged)s FOR UPDATE
+                ''', {'merged': merged})
+                followers = cursor.fetchall()
+                if followers:
+                    cursor.execute(
+                        'UPDATE properties SET canonical_id = %(keep)s WHERE canonical_id = %(merged)s',
+                        {'keep': keep, 'merged': merged})
+                    cursor.execute(_RESTORE_MATCH_SQL, [list(column) for column in zip(*followers)])
+            cursor.execute('''
+                UPDATE dedup_reports SET id_b = %(id_b)s, site_b = %(site_b)s, resolved = TRUE
+                WHERE id = %(report)s
+            ''', {'id_b': candidate_id, 'site_b': found[candidate_id][2], 'report': report_id})
+            if keep != merged:
+                cursor.execute('SELECT refresh_listing_views()')
+                cursor.execute('SELECT bump_data_version()')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return merged if keep != merged else None
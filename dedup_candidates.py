@@ -0,0 +1,146 @@
+"""
+dedup_candidates.py -- top-k duplicate candidates for one listing
+
+A manual report (dedup_reports) names one listing; the review page asks
+for the listing it duplicates. Candidates are canonical listings of the
+same type in the same price and surface bucket, fetched through the
+partial index the app's filters already use
+(idx_properties_canonical_type_price), so one lookup reads a few hundred
+rows at most, whatever the table size. They are then scored in Python:
+
+    score = 0.45 text + 0.25 price + 0.20 surface + 0.10 photo
+
+  - text    : Jaccard similarity of title + description tokens
+              (search_index.tokenize: accent- and case-folded)
+  - price   : 1 at the same price, 0 at the edge of the window
+  - surface : same, for square meters (0.5 when either is unknown)
+  - photo   : same image file name (agencies often re-upload one photo)
+
+A shared listing_ref is a certain match and scores 1.
+
+    candidates = find_candidates(conn, listing_id, k=5)   # psycopg2 connection
+"""
+
+import posixpath
+from urllib.parse import urlsplit
+
+from search_index import tokenize
+
+PRICE_WINDOW = 0.05     # +/- 5 % around the reported price
+SURFACE_WINDOW = 0.08   # +/- 8 % around the reported surface
+MAX_FETCHED = 400       # candidates read from the bucket, closest price first
+
+_COLUMNS = '''id, site, title, description, price_numeric, square_meters,
+              property_type, listing_ref, image_url, url, scraped_date'''
+
+_LISTING_SQL = f'SELECT {_COLUMNS}, canonical_id FROM properties WHERE id = %(id)s'
+
+# Same type, price window, surface window when known. The reported
+# listing's own group is excluded. {type_clause}: "= %(type)s" or "IS NULL",
+# both served by the index (IS NOT DISTINCT FROM would not be).
+_BUCKET_SQL = f'''
+    SELECT {_COLUMNS} FROM properties
+    WHERE canonical_id IS NULL
+      AND property_type {{type_clause}}
+      AND price_numeric BETWEEN %(price_lo)s AND %(price_hi)s
+      AND (%(m2_lo)s::numeric IS NULL OR square_meters IS NULL
+           OR square_meters BETWEEN %(m2_lo)s AND %(m2_hi)s)
+      AND id <> %(group)s
+    ORDER BY abs(price_numeric - %(price)s), id DESC
+    LIMIT %(limit)s
+'''
+
+# No price: surface bucket only (idx_properties_canonical_surface)
+_SURFACE_BUCKET_SQL = f'''
+    SELECT {_COLUMNS} FROM properties
+    WHERE canonical_id IS NULL
+      AND square_meters BETWEEN %(m2_lo)s AND %(m2_hi)s
+      AND id <> %(group)s
+    ORDER BY abs(square_meters - %(m2)s), id DESC
+    LIMIT %(limit)s
+'''
+
+_REF_SQL = f'''
+    SELECT {_COLUMNS} FROM properties
+    WHERE canonical_id IS NULL AND listing_ref = %(ref)s AND id <> %(group)s
+    LIMIT 20
+'''
+
+
+def _rows(cursor, sql, params):
+    cursor.execute(sql, params)
+    names = [d[0] for d in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def _closeness(a, b, window):
+    """1 when equal, 0 at window (relative) apart; None when a value is missing"""
+    if a is None or b is None or not a:
+        return None
+    return max(0.0, 1 - abs(float(b) - float(a)) / (float(a) * window))
+
+
+def _photo_name(url):
+    return posixpath.basename(urlsplit(url).path).lower() if url else ''
+
+
+def score(listing, candidate, tokens=None):
+    """(score, parts) of one candidate against the reported listing"""
+    if listing['listing_ref'] and listing['listing_ref'] == candidate['listing_ref']:
+        return 1.0, {'ref': 1.0}
+    if tokens is None:
+        tokens = set(tokenize(listing['title'])) | set(tokenize(listing['description']))
+    other = set(tokenize(candidate['title'])) | set(tokenize(candidate['description']))
+    text = len(tokens & other) / len(tokens | other) if tokens | other else 0.0
+    price = _closeness(listing['price_numeric'], candidate['price_numeric'], PRICE_WINDOW)
+    surface = _closeness(listing['square_meters'], candidate['square_meters'], SURFACE_WINDOW)
+    photo_name = _photo_name(listing['image_url'])
+    photo = 1.0 if photo_name and photo_name == _photo_name(candidate['image_url']) else 0.0
+    parts = {'text': text, 'price': price if price is not None else 0.0,
+             'surface': surface if surface is not None else 0.5, 'photo': photo}
+    total = 0.45 * parts['text'] + 0.25 * parts['price'] + 0.20 * parts['surface'] + 0.10 * parts['photo']
+    return round(total, 3), parts
+
+
+def find_candidates(conn, listing_id, k=5):
+    """Top-k candidates for listing_id: list of candidate rows with 'score' and 'parts'.
+
+    Returns None when the listing does not exist.
+    """
+    cursor = conn.cursor()
+    try:
+        found = _rows(cursor, _LISTING_SQL, {'id': listing_id})
+        if not found:
+            return None
+        listing = found[0]
+        group = listing['canonical_id'] or listing['id']
+        price = listing['price_numeric']
+        m2 = float(listing['square_meters']) if listing['square_meters'] else None
+        m2_params = {'m2': m2,
+                     'm2_lo': m2 * (1 - SURFACE_WINDOW) if m2 else None,
+                     'm2_hi': m2 * (1 + SURFACE_WINDOW) if m2 else None}
+
+        candidates = {}
+        if listing['listing_ref']:
+            for row in _rows(cursor, _REF_SQL, {'ref': listing['listing_ref'], 'group': group}):
+                candidates[row['id']] = row
+        if price:
+            type_clause = 'IS NULL' if listing['property_type'] is None else '= %(type)s'
+            rows = _rows(cursor, _BUCKET_SQL.format(type_clause=type_clause), {
+                'type': listing['property_type'], 'price': price,
+                'price_lo': int(price * (1 - PRICE_WINDOW)), 'price_hi': int(price * (1 + PRICE_WINDOW)),
+                'group': group, 'limit': MAX_FETCHED, **m2_params})
+        elif m2:
+            rows = _rows(cursor, _SURFACE_BUCKET_SQL, {'group': group, 'limit': MAX_FETCHED, **m2_params})
+        else:
+            rows = []
+        for row in rows:
+            candidates.setdefault(row['id'], row)
+    finally:
+        cursor.close()
+
+    tokens = set(tokenize(listing['title'])) | set(tokenize(listing['description']))
+    for row in candidates.values():
+        row['score'], row['parts'] = score(listing, row, tokens)
+    ranked = sorted(candidates.values(), key=lambda r: (-r['score'], -r['id']))
+    return ranked[:k]
@@ -0,0 +1,123 @@
+"""
+facets.py -- result counts per filter value, without rescanning the listings
+
+FacetIndex encodes each listing once per snapshot: site, property type
+group, scrape date, price bucket and surface bucket as small integer
+codes. Counting a filter result (an array of row labels, see
+pagination.PagePlan) is then a handful of np.bincount calls.
+
+    facets = FacetIndex(df, PROPERTY_TYPE_GROUPS)
+    matrix = facets.crosstab(plan.rows)      # [site, type] counts
+    counts = facets.counts(plan.rows)        # per date, price/surface histograms
+
+The site x type matrix gives every count the filter form needs: for a
+result computed with sources and types left open, the rows of the selected
+types summed per site are the source counts, and any pending
+sources x types selection is a sub-matrix sum.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Histogram buckets (left-closed); values past the last edge share the last bucket
+PRICE_EDGES = [0, 100_000, 150_000, 200_000, 250_000, 300_000, 400_000, 500_000, 750_000]
+SURFACE_EDGES = [0, 20, 30, 40, 60, 80, 100, 150]
+
+_SPARK = '▁▂▃▄▅▆▇█'
+
+
+class FacetIndex:
+    """Integer-coded facet columns of one snapshot"""
+
+    def __init__(self, df, type_groups):
+        self._index = df.index
+        self._positional = (isinstance(df.index, pd.RangeIndex)
+                            and df.index.start == 0 and df.index.step == 1)
+        self.total = len(df)
+
+        site_codes, sites = pd.factorize(df['site'].fillna(''), sort=True)
+        self.sites = list(sites)
+        self._site = site_codes
+
+        # Type column = group label. Unclaimed types fall into "Autres";
+        # NULL gets its own last column: it passes every type filter.
+        self.type_labels = list(type_groups)
+        label_of = {raw: i for i, label in enumerate(self.type_labels) for raw in type_groups[label]}
+        other = self.type_labels.index('Autres') if 'Autres' in self.type_labels else len(self.type_labels)
+        ptype = df['property_type']
+        codes = ptype.map(label_of).fillna(other).to_numpy(dtype=np.int64)
+        codes[ptype.isna().to_numpy()] = len(self.type_labels)
+        self._type = codes
+
+        day_codes, days = pd.factorize(df['scraped_date_dt'], sort=True)
+        self.dates = list(days)
+        self._day = day_codes  # -1 = no date
+
+        self._price = _bucket(df['price_numeric'], PRICE_EDGES)
+        self._surface = _bucket(df['square_meters'], SURFACE_EDGES)
+
+    def _positions(self, rows):
+        if rows is None:
+            return slice(None)
+        if self._positional:
+            return np.asarray(rows, dtype=np.int64)
+        return self._index.get_indexer(rows)
+
+    def crosstab(self, rows=None):
+        """Counts per (site, type column) of the given rows (all rows if None)"""
+        at = self._positions(rows)
+        n_types = len(self.type_labels) + 1
+        flat = self._site[at] * n_types + self._type[at]
+        return np.bincount(flat, minlength=len(self.sites) * n_types).reshape(len(self.sites), n_types)
+
+    def counts(self, rows=None):
+        """{'dates': {date: n}, 'price': [n per bucket], 'surface': [n per bucket]}"""
+        at = self._positions(rows)
+        day = self._day[at]
+        per_day = np.bincount(day[day >= 0], minlength=len(self.dates))
+        return {
+            'dates': {d: int(n) for d, n in zip(self.dates, per_day) if n},
+            'price': _histogram(self._price[at], len(PRICE_EDGES)),
+            'surface': _histogram(self._surface[at], len(SURFACE_EDGES)),
+        }
+
+    def site_counts(self, matrix, type_labels):
+        """{site: n} for the selected type labels (NULL types always count)"""
+        cols = self._type_columns(type_labels)
+        return dict(zip(self.sites, matrix[:, cols].sum(axis=1).tolist()))
+
+    def type_counts(self, matrix, sites):
+        """{type label: n} for the selected sites"""
+        rows = [i for i, site in enumerate(self.sites) if site in set(sites)]
+        per_type = matrix[rows].sum(axis=0)
+        return dict(zip(self.type_labels, per_type.tolist()))
+
+    def selection_count(self, matrix, sites, type_labels):
+        """Listings matching sites x type labels"""
+        rows = [i for i, site in enumerate(self.sites) if site in set(sites)]
+        return int(matrix[np.ix_(rows, self._type_columns(type_labels))].sum())
+
+    def _type_columns(self, type_labels):
+        wanted = set(self.type_labels if type_labels is None else type_labels)
+        return [i for i, label in enumerate(self.type_labels) if label in wanted] + [len(self.type_labels)]
+
+
+def _bucket(values, edges):
+    """Bucket number per value, -1 for missing"""
+    values = values.to_numpy(dtype=float, na_value=np.nan)
+    out = np.searchsorted(edges, values, side='right') - 1
+    out[np.isnan(values) | (values < edges[0])] = -1
+    return out
+
+
+def _histogram(buckets, size):
+    return np.bincount(buckets[buckets >= 0], minlength=size).tolist()
+
+
+def sparkline(counts):
+    """Histogram as a line of block characters ('' when empty)"""
+    top = max(counts, default=0)
+    if not top:
+        return ''
+    return ''.join(_SPARK[min(len(_SPARK) - 1, n * len(_SPARK) // (top + 1))] if n else ' '
+                   for n in counts)
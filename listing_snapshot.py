@@ -0,0 +1,465 @@
+"""
+listing_snapshot.py -- in-memory snapshot of canonical listings
+
+Loads the canonical_listings view once (see db_migrations.py, migration 7),
+then keeps it current with delta refreshes: only rows whose
+created_at/updated_at is past the last watermark are fetched and merged into
+the cached frame and its search index. Rows that gained a canonical_id
+(linked as duplicates since the last refresh) are dropped.
+
+The scraper also publishes the same frame as a versioned Arrow IPC file
+(write_snapshot_file); a cold app process memory-maps the latest one and
+only falls back to the DB when no file exists.
+
+With shared=True the same directory is the node-wide cache for several
+Streamlit workers: the first worker to see a new data_version refreshes
+under an exclusive file lock and republishes, the others map its file.
+
+No Streamlit here -- app.py holds one ListingSnapshot per process via
+st.cache_resource.
+"""
+
+import decimal
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # in requirements.txt; without it DB-only (ListingSnapshot prints it once)
+    pa = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, workers may refresh twice
+    fcntl = None
+
+from search_index import SearchIndex
+
+# Re-read this much history before the watermark on every delta. A scrape
+# transaction stamps rows with its start time, so a long-running insert can
+# commit rows older than a watermark we already recorded.
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+# The view is refreshed by every writer before it bumps data_version
+_FULL_QUERY = 'SELECT * FROM canonical_listings ORDER BY id DESC'
+
+_DELTA_QUERY = '''
+    SELECT * FROM canonical_listings
+    WHERE updated_at > :wm OR created_at > :wm
+    ORDER BY id DESC
+'''
+
+# Rows that left the view since the watermark -- linked as duplicates, or
+# moved to properties_archive (run_scrapers.archive_old_listings): drop them
+_DROPPED_QUERY = '''
+    SELECT id FROM properties
+    WHERE canonical_id IS NOT NULL AND (updated_at > :wm OR created_at > :wm)
+    UNION ALL
+    SELECT id FROM properties_archive WHERE archived_at > :wm
+'''
+
+# Snapshot files: <dir>/listings-v<data_version>-<ns>.arrow, LATEST names the current one
+# (and, on a second line, a later data_version the file is still exact for)
+SNAPSHOT_PREFIX = 'listings-v'
+LATEST_POINTER = 'LATEST'
+KEEP_SNAPSHOTS = 3
+_SNAPSHOT_META_KEY = b'nantimmo'
+
+# Text columns of a mapped snapshot stay Arrow-backed (NaN for missing, like
+# pandas' own "str" dtype) instead of being copied into Python objects
+try:
+    _ARROW_STRING = pd.StringDtype('pyarrow', na_value=float('nan'))
+except TypeError:  # pandas < 2.3
+    _ARROW_STRING = pd.StringDtype('pyarrow_numpy')
+
+
+def fetch_properties(conn, query, **params):
+    """Run a properties query on a pg8000 native connection and return a DataFrame"""
+    rows = conn.run(query, **params)
+    columns = [desc['name'] for desc in conn.columns]
+    return normalize_frame(pd.DataFrame(rows, columns=columns))
+
+
+def normalize_frame(df):
+    """Driver-independent column types: floats for numerics, lists for price_history"""
+    # pg8000/psycopg2 return Decimal for numeric columns; cast to float for downstream arithmetic
+    for col in df.columns:
+        if df[col].apply(lambda x: isinstance(x, decimal.Decimal)).any():
+            df[col] = df[col].astype(float)
+    # pg8000 returns JSONB as a string; parse price_history into Python lists
+    if 'price_history' in df.columns:
+        df['price_history'] = df['price_history'].apply(
+            lambda x: json.loads(x) if isinstance(x, str) else x
+        )
+    return df
+
+
+_PRICE_HISTORY_QUERY = '''
+    SELECT property_id, date, price FROM price_history
+    WHERE property_id = ANY(:ids)
+    ORDER BY property_id, date, id
+'''
+
+
+def fetch_price_histories(conn, ids):
+    """Previous prices of the given listings in one query: {id: [{price, date}, ...]}, oldest first.
+
+    Listings without history are absent from the result.
+    """
+    histories = {}
+    if not ids:
+        return histories
+    for property_id, date, price in conn.run(_PRICE_HISTORY_QUERY, ids=[int(i) for i in ids]):
+        histories.setdefault(property_id, []).append({'price': price, 'date': date})
+    return histories
+
+
+def add_derived_columns(df):
+    """Adds the columns the app computes from stored ones"""
+    # Price per m²: NaN when either value is missing or surface is 0.
+    # Precomputed by canonical_listings; computed here for raw properties rows.
+    if 'price_per_m2' not in df.columns:
+        surface = df['square_meters'].where(df['square_meters'] > 0)
+        df['price_per_m2'] = (df['price_numeric'] / surface).round(2)
+    # Cast scraped_date to actual dates for range filtering
+    df['scraped_date_dt'] = pd.to_datetime(df['scraped_date'], errors='coerce').dt.date
+    return df
+
+
+def write_snapshot_file(df, directory, source_version, watermark):
+    """Publish df as an uncompressed Arrow IPC file (memory-mappable) and point LATEST at it.
+
+    Both the file and the pointer are written to a temp name then renamed,
+    so a reader never sees a half-written snapshot.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required to write snapshot files")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    out = df.copy()
+    # JSON text is simpler and faster to round-trip than list<struct> for ragged history
+    if 'price_history' in out.columns:
+        out['price_history'] = out['price_history'].apply(
+            lambda x: json.dumps(x) if isinstance(x, list) else None
+        )
+    table = pa.Table.from_pandas(out, preserve_index=False)
+    meta = {
+        'source_version': source_version,
+        'watermark': watermark.isoformat() if watermark is not None else None,
+    }
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        _SNAPSHOT_META_KEY: json.dumps(meta).encode(),
+    })
+
+    name = f'{SNAPSHOT_PREFIX}{source_version}-{time.time_ns()}.arrow'
+    tmp = directory / (name + '.tmp')
+    with pa.OSFile(str(tmp), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, directory / name)
+    _write_pointer(directory, name)
+
+    # Keep a few previous files: a process may still be mapping one of them
+    old = sorted(directory.glob(f'{SNAPSHOT_PREFIX}*.arrow'), key=os.path.getmtime)
+    for path in old[:-KEEP_SNAPSHOTS]:
+        path.unlink(missing_ok=True)
+    return directory / name
+
+
+def _write_pointer(directory, name, source_version=None):
+    pointer_tmp = directory / (LATEST_POINTER + '.tmp')
+    pointer_tmp.write_text(name if source_version is None else f'{name}\n{source_version}')
+    os.replace(pointer_tmp, directory / LATEST_POINTER)
+
+
+def mark_snapshot_current(directory, source_version):
+    """Record that the LATEST file is still exact at source_version (no rewrite)"""
+    path, _ = _read_pointer(directory)
+    if path is not None:
+        _write_pointer(Path(directory), path.name, source_version)
+
+
+@contextmanager
+def snapshot_lock(directory):
+    """Exclusive cross-process lock on a snapshot directory (flock on <dir>/.lock).
+
+    Not re-entrant: flock locks belong to the open file, so taking it twice
+    in one process deadlocks. write_snapshot_file does not lock; callers do.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / '.lock', 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _read_pointer(directory):
+    """(LATEST file path, data_version override or None); (None, None) without a usable file"""
+    if pa is None or directory is None:
+        return None, None
+    pointer = Path(directory) / LATEST_POINTER
+    if not pointer.exists():
+        return None, None
+    name, _, version = pointer.read_text().strip().partition('\n')
+    path = Path(directory) / name
+    if not path.exists():
+        return None, None
+    return path, (int(version) if version else None)
+
+
+def _snapshot_meta(schema, source_version=None):
+    meta = json.loads((schema.metadata or {}).get(_SNAPSHOT_META_KEY, b'{}'))
+    if meta.get('watermark'):
+        meta['watermark'] = pd.Timestamp(meta['watermark']).to_pydatetime()
+    if source_version is not None:
+        meta['source_version'] = source_version
+    return meta
+
+
+def read_snapshot_meta(directory):
+    """Metadata of the LATEST snapshot (schema only, no column data), or None"""
+    path, source_version = _read_pointer(directory)
+    if path is None:
+        return None
+    with pa.memory_map(str(path), 'r') as source:
+        return _snapshot_meta(pa.ipc.open_file(source).schema, source_version)
+
+
+def _arrow_types(arrow_type):
+    """to_pandas types_mapper: keep string columns as views of the mapped file"""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return _ARROW_STRING
+    return None
+
+
+def read_snapshot_file(directory):
+    """Memory-map the LATEST snapshot. Returns (df, meta) or None if there is none.
+
+    The frame is a view of the file: one column per block (no consolidation
+    copy), numeric columns are read-only numpy views of the map and text
+    columns Arrow-backed. Workers mapping the same file share its pages.
+    Only dates (objects) and price_history are materialised.
+    """
+    path, source_version = _read_pointer(directory)
+    if path is None:
+        return None
+
+    # The map stays alive as long as the table's buffers do; a concurrent
+    # prune only unlinks the name, the mapping itself remains valid
+    source = pa.memory_map(str(path), 'r')
+    table = pa.ipc.open_file(source).read_all()
+    meta = _snapshot_meta(table.schema, source_version)
+    df = table.to_pandas(split_blocks=True, self_destruct=True, types_mapper=_arrow_types)
+    del table  # self_destruct: unusable after the conversion
+    if 'price_history' in df.columns:
+        df['price_history'] = df['price_history'].apply(
+            lambda x: json.loads(x) if isinstance(x, str) else x
+        )
+    return df, meta
+
+
+def max_timestamp(df):
+    """Latest created_at/updated_at in a frame, or None if it has none"""
+    stamps = [pd.to_datetime(df[col]).max()
+              for col in ('created_at', 'updated_at') if col in df.columns]
+    stamps = [s for s in stamps if pd.notna(s)]
+    return max(stamps).to_pydatetime() if stamps else None
+
+
+class ListingSnapshot:
+    """Canonical listings frame + search index, refreshed by deltas.
+
+    (df, version, search_index) is published as one tuple, swapped in a
+    single assignment: readers take `current` once and get a consistent
+    triple. None of the three is mutated after publish (a delta builds a
+    new frame and a patched copy of the index).
+    """
+
+    def __init__(self, connect, snapshot_dir=None, shared=False):
+        self._connect = connect  # callable returning a pg8000 native connection
+        self._snapshot_dir = snapshot_dir  # scraper-published Arrow files, tried before the DB
+        if snapshot_dir is not None and pa is None:
+            # One line per process (app.py keeps a single ListingSnapshot)
+            print(f"pyarrow not installed: ignoring snapshot files in {snapshot_dir}, "
+                  f"every worker loads from the DB")
+        # Republish every refresh to snapshot_dir for the other workers on this node
+        self._shared = shared and snapshot_dir is not None and pa is not None
+        self._lock = threading.Lock()
+        self.current = (None, None, None)  # (df, version, search_index)
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.source_version = None  # data_version.version the frame was refreshed at
+        self._file_version = None  # source_version of the snapshot file the frame equals, if any
+
+    @property
+    def df(self):
+        return self.current[0]
+
+    @property
+    def version(self):
+        return self.current[1]
+
+    @property
+    def search_index(self):
+        return self.current[2]
+
+    def _publish(self, df, search_index, file_version=None):
+        self.current = (df, time.time_ns(), search_index)
+        self._file_version = file_version
+
+    def load_from_file(self):
+        """Cold start from the latest snapshot file, no DB round trip.
+
+        Returns False when no usable file exists. The file's watermark and
+        data_version let the next refresh continue with a delta.
+        """
+        published = read_snapshot_file(self._snapshot_dir)
+        if published is None:
+            return False
+        df, meta = published
+        self.watermark = meta.get('watermark')
+        self.source_version = meta.get('source_version')
+        self._publish(df, SearchIndex.from_columns(df['id'], df['title'], df['description']),
+                      file_version=self.source_version)
+        self.refreshed_at = time.monotonic()
+        return True
+
+    def load(self):
+        """Full load: replaces the frame, the index and the watermark"""
+        conn = self._connect()
+        try:
+            df = fetch_properties(conn, _FULL_QUERY)
+        finally:
+            conn.close()
+        df = add_derived_columns(df)
+        self.watermark = max_timestamp(df)
+        self._publish(df, SearchIndex.from_columns(df['id'], df['title'], df['description']))
+        self.refreshed_at = time.monotonic()
+
+    def refresh(self, max_age=600, source_version=None):
+        """Bring the snapshot up to date.
+
+        source_version is the scraper-maintained data_version counter: when
+        given, the DB is only touched if it differs from the one we last
+        refreshed at. Without it (table missing, poll failed) we fall back
+        to refreshing once the snapshot is older than max_age seconds.
+
+        Returns True when the data changed (and version was bumped).
+        """
+        with self._lock:
+            if self.df is not None:
+                if source_version is not None:
+                    if source_version == self.source_version:
+                        return False
+                elif time.monotonic() - self.refreshed_at < max_age:
+                    return False
+
+            # Timer mode has no shared notion of "current", so each worker
+            # refreshes on its own
+            if not self._shared or source_version is None:
+                return self._catch_up(source_version)
+
+            # Node-shared store: map the file if another worker already
+            # published this version, otherwise refresh once for everyone
+            if self._adopt_published(source_version):
+                return True
+            with snapshot_lock(self._snapshot_dir):
+                if self._adopt_published(source_version):
+                    return True
+                changed = self._catch_up(source_version)
+                # Still the rows of the LATEST file (a version bump with an
+                # empty delta): no rewrite, the pointer vouches for the new version
+                published = read_snapshot_meta(self._snapshot_dir)
+                if (not changed and published is not None
+                        and published.get('source_version') == self._file_version):
+                    mark_snapshot_current(self._snapshot_dir, self.source_version)
+                else:
+                    write_snapshot_file(self.df, self._snapshot_dir, self.source_version, self.watermark)
+                self._file_version = self.source_version
+                return changed
+
+    def _adopt_published(self, source_version):
+        """Map the shared file if it is exactly at source_version"""
+        meta = read_snapshot_meta(self._snapshot_dir)
+        if meta is None or meta.get('source_version') != source_version:
+            return False
+        return self.load_from_file()
+
+    def _catch_up(self, source_version):
+        """Start from the file (or a full DB load), then apply a watermark delta"""
+        if self.df is None:
+            if not self.load_from_file():
+                self.load()
+                self.source_version = source_version
+                return True
+            if source_version is None or source_version == self.source_version:
+                return True
+            # File is behind the DB: catch up with a delta below
+        if self.watermark is None:
+            self.load()
+            changed = True
+        else:
+            changed = self._apply_delta()
+        self.source_version = source_version
+        return changed
+
+    def _apply_delta(self):
+        conn = self._connect()
+        try:
+            since = self.watermark - WATERMARK_OVERLAP
+            fresh = fetch_properties(conn, _DELTA_QUERY, wm=since)
+            dropped_ids = {row[0] for row in conn.run(_DROPPED_QUERY, wm=since)}
+        finally:
+            conn.close()
+        self.refreshed_at = time.monotonic()
+        if fresh.empty and not dropped_ids:
+            return False
+
+        new_watermark = max_timestamp(fresh)
+        fresh = add_derived_columns(fresh)
+
+        # The overlap window re-reads rows we already hold; skip the merge
+        # when no held row left the view and every fresh row is unchanged
+        held = self.df[self.df['id'].isin(set(fresh['id']))]
+        dropped = self.df['id'].isin(dropped_ids).any()
+        if not dropped and _same_rows(held, fresh):
+            return False
+
+        # Updated rows are replaced, linked or archived rows vanish
+        changed_ids = dropped_ids | set(fresh['id'])
+        kept = self.df[~self.df['id'].isin(changed_ids)]
+        merged = pd.concat([fresh, kept], ignore_index=True)
+        merged = merged.sort_values('id', ascending=False, ignore_index=True)
+
+        search_index = self.search_index.patched(
+            changed_ids, zip(fresh['id'], fresh['title'], fresh['description']))
+
+        if new_watermark is not None:
+            self.watermark = max(self.watermark, new_watermark)
+        self._publish(merged, search_index)
+        return True
+
+
+def _same_rows(a, b):
+    """True when two frames hold the same rows (ignoring order and index)"""
+    if len(a) != len(b):
+        return False
+    cols = [c for c in ('id', 'updated_at', 'created_at') if c in a.columns and c in b.columns]
+    a = a[cols].sort_values('id').reset_index(drop=True)
+    b = b[cols].sort_values('id').reset_index(drop=True)
+    return a.equals(b)
@@ -2,18 +2,26 @@
 pages/dedup_review.py -- DEV_MODE only: cross-site duplicate pair review
 
 Two tabs:
-  1. Paires detectees  -- all rows the algorithm has linked (canonical_id IS NOT NULL)
-  2. Signalements      -- manual reports filed via the flag button on listing cards
+  1. Paires detectees  -- rows the algorithm has linked (canonical_id IS NOT NULL),
+                          50 per page, filtered by stored match_tier and site in SQL
+  2. Signalements      -- manual reports filed via the flag button on listing cards,
+                          with a top-k candidate search (dedup_candidates) to link
+                          the reported listing in one click
 
 Not linked from the main UI in production -- only accessible via the dev toolbar
 banner (DEV_MODE=true) or by navigating to /dedup_review directly.
 """
 
+import html
 import os
 import streamlit as st
 import pandas as pd
 import psycopg2
 
+from card_renderer import is_thumbnail_source, thumbnail_attrs
+from dedup_actions import confirm_pairs, link_report, resolve_reports, unlink_pairs
+from dedup_candidates import find_candidates
+
 DEV_MODE = os.environ.get("DEV_MODE", "false").lower() == "true"
 
 st.set_page_config(page_title="Dedup Review", layout="wide", page_icon="🔍")
@@ -30,12 +38,47 @@ else:
     st.stop()
 
 
+PAIRS_PAGE_SIZE = 50
+
+# match_tier values; NULL (unknown) is selected as 0
+MATCH_TIERS = {"All": None, "tier 1 (ref)": 1, "tier 2 (fingerprint)": 2,
+               "tier 3 (manual)": 3, "unknown": 0}
+TIER_LABELS = {1: "tier 1 (ref)", 2: "tier 2 (fingerprint)", 3: "tier 3 (manual)"}
+
+CANDIDATES_K = 5
+
+# Thumbnails through thumbnail_proxy.py when configured (same variable as app.py)
+THUMBNAIL_PROXY_URL = os.environ.get("THUMBNAIL_PROXY_URL") or None
+
+
+def _pairs_where(tier, site, include_confirmed):
+    """WHERE clause + params shared by the pair page and its count"""
+    clauses = ["p.canonical_id IS NOT NULL"]
+    params = {}
+    if not include_confirmed:
+        clauses.append("p.confirmed_at IS NULL")
+    if tier == 0:
+        clauses.append("p.match_tier IS NULL")
+    elif tier is not None:
+        clauses.append("p.match_tier = %(tier)s")
+        params["tier"] = tier
+    if site is not None:
+        clauses.append("(p.site = %(site)s OR c.site = %(site)s)")
+        params["site"] = site
+    return " AND ".join(clauses), params
+
+
 @st.cache_data(ttl=60)
-def load_pairs():
+def load_pairs(tier, site, include_confirmed, cursor):
+    """One page of linked pairs, newest first, after the keyset cursor (scraped_date, id)"""
+    where, params = _pairs_where(tier, site, include_confirmed)
+    if cursor is not None:
+        where += " AND (p.scraped_date, p.id) < (%(cursor_date)s, %(cursor_id)s)"
+        params.update(cursor_date=cursor[0], cursor_id=cursor[1])
     conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
     conn.autocommit = True
     try:
-        return pd.read_sql_query("""
+        return pd.read_sql_query(f"""
             SELECT
                 p.id            AS dupe_id,
                 p.site          AS dupe_site,
@@ -46,7 +89,9 @@ def load_pairs():
                 p.url           AS dupe_url,
                 p.image_url     AS dupe_image,
                 p.scraped_date  AS dupe_date,
-                p.description   AS dupe_desc,
+                p.match_tier,
+                p.match_score,
+                p.confirmed_at,
                 c.id            AS canonical_id,
                 c.site          AS canonical_site,
                 c.title         AS canonical_title,
@@ -58,8 +103,51 @@ def load_pairs():
                 c.scraped_date  AS canonical_date
             FROM properties p
             JOIN properties c ON c.id = p.canonical_id
+            WHERE {where}
             ORDER BY p.scraped_date DESC, p.id DESC
-        """, conn)
+            LIMIT {PAIRS_PAGE_SIZE}
+        """, conn, params=params)
+    finally:
+        conn.close()
+
+
+@st.cache_data(ttl=60)
+def load_pair_counts(tier, site, include_confirmed):
+    """(pairs per tier over all pairs, pairs matching the filters)"""
+    where, params = _pairs_where(tier, site, include_confirmed)
+    conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT COALESCE(match_tier, 0), count(*) FROM properties
+            WHERE canonical_id IS NOT NULL GROUP BY 1
+        """)
+        per_tier = dict(cur.fetchall())
+        if site is None and include_confirmed:
+            # Same answer as the join below, without it
+            matching = sum(per_tier.values()) if tier is None else per_tier.get(tier, 0)
+        else:
+            cur.execute(f"""
+                SELECT count(*) FROM properties p
+                JOIN properties c ON c.id = p.canonical_id
+                WHERE {where}
+            """, params)
+            matching = cur.fetchone()[0]
+        return per_tier, matching
+    finally:
+        conn.close()
+
+
+@st.cache_data(ttl=300)
+def load_sites():
+    conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        # listing_stats: pre-aggregated per site/date by refresh_listing_views()
+        cur.execute("SELECT DISTINCT site FROM listing_stats WHERE site <> '' ORDER BY 1")
+        return [row[0] for row in cur.fetchall()]
     finally:
         conn.close()
 
@@ -84,22 +172,76 @@ def load_reports():
         conn.close()
 
 
-def infer_match_type(desc: str) -> str:
-    if not desc:
-        return "unknown"
-    if "-- ref " in desc:
-        return "tier 1 (ref)"
-    if "-- fingerprint" in desc:
-        return "tier 2 (fingerprint)"
-    if "-- tier 1" in desc:
-        return "tier 1 (ref)"
-    return "unknown"
+@st.cache_data(ttl=60)
+def load_candidates(listing_id):
+    """Top-k duplicate candidates of one listing (None if it no longer exists)"""
+    conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
+    conn.autocommit = True
+    try:
+        return find_candidates(conn, listing_id, k=CANDIDATES_K)
+    finally:
+        conn.close()
+
+
+def link_candidate(report_id, listing_id, candidate):
+    """Link the reported listing to the picked candidate and resolve the report"""
+    conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
+    try:
+        link_report(conn, report_id, listing_id, int(candidate['id']), candidate['score'])
+    except Exception as e:
+        st.error(f"Erreur: {e}")
+        return
+    finally:
+        conn.close()
+    # New pair, resolved report, and both groups' candidates changed
+    load_pairs.clear()
+    load_pair_counts.clear()
+    load_reports.clear()
+    load_candidates.clear()
+    st.session_state.pop(f"cand_{report_id}", None)
+    st.toast(f"#{listing_id} lié à #{candidate['id']}")
+    st.rerun()
+
+
+def run_action(action, ids, kind, done_label):
+    """Apply one dedup_actions function to the ticked ids, then drop exactly the caches it affects"""
+    conn = psycopg2.connect(DATABASE_URL, connect_timeout=10)
+    try:
+        changed = action(conn, ids)
+    except Exception as e:
+        st.error(f"Erreur: {e}")
+        return
+    finally:
+        conn.close()
+    if kind == "pair":
+        load_pairs.clear()
+        # Confirming only changes the counts when confirmed pairs are hidden
+        if action is unlink_pairs or not st.session_state.get("pairs_include_confirmed"):
+            load_pair_counts.clear()
+    else:
+        load_reports.clear()
+    for i in ids:
+        st.session_state.pop(f"sel_{kind}_{i}", None)
+    st.toast(f"{len(changed)} {done_label}")
+    st.rerun()
+
+
+def thumb_html(image_url):
+    """Lazy-loaded <img>: the browser fetches it only when the pair is expanded"""
+    if not image_url:
+        return ''
+    src, extra = (thumbnail_attrs(image_url, THUMBNAIL_PROXY_URL)
+                  if THUMBNAIL_PROXY_URL and is_thumbnail_source(image_url)
+                  else (html.escape(image_url, quote=True), ''))
+    return (f'<img src="{src}"{extra} loading="lazy" decoding="async" '
+            f'style="width:100%;max-height:260px;object-fit:cover;border-radius:6px">')
 
 
 # ── Page header ────────────────────────────────────────────────────────────────
 
 st.markdown("## \U0001f50d Dedup Review")
-st.caption("Read-only. To unlink: `UPDATE properties SET canonical_id = NULL WHERE id = <id>`")
+st.caption("Cochez des paires ou des signalements, puis appliquez une action : "
+           "toute la sélection est écrite en une transaction.")
 
 tab_pairs, tab_reports = st.tabs(["Paires d\u00e9tect\u00e9es", "\U0001f6a9 Signalements en attente"])
 
@@ -107,56 +249,74 @@ tab_pairs, tab_reports = st.tabs(["Paires d\u00e9tect\u00e9es", "\U0001f6a9 Sign
 # ── Tab 1: detected pairs ──────────────────────────────────────────────────────
 
 with tab_pairs:
-    pairs = load_pairs()
-
-    if pairs.empty:
-        st.info("No linked pairs in the database.")
+    col_f1, col_f2 = st.columns(2)
+    with col_f1:
+        match_filter = st.selectbox("Match type", list(MATCH_TIERS), key="pairs_tier")
+    with col_f2:
+        site_filter = st.selectbox("Filter by site (either side)", ["All"] + load_sites(), key="pairs_site")
+    include_confirmed = st.checkbox("Inclure les paires confirmées", key="pairs_include_confirmed")
+    tier = MATCH_TIERS[match_filter]
+    site = None if site_filter == "All" else site_filter
+
+    # Keyset pagination: one cursor per page seen, reset when the filters change.
+    # Cursors stay valid when pairs are unlinked or confirmed in between.
+    if st.session_state.get("pairs_filters") != (tier, site, include_confirmed):
+        st.session_state.pairs_filters = (tier, site, include_confirmed)
+        st.session_state.pairs_cursors = [None]
+    cursors = st.session_state.pairs_cursors
+
+    per_tier, matching = load_pair_counts(tier, site, include_confirmed)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total pairs", sum(per_tier.values()))
+    col2.metric("Tier 1 (ref)", per_tier.get(1, 0))
+    col3.metric("Tier 2 (fingerprint)", per_tier.get(2, 0))
+    col4.metric("Tier 3 (manual)", per_tier.get(3, 0))
+
+    st.divider()
+
+    pairs = load_pairs(tier, site, include_confirmed, cursors[-1])
+    if pairs.empty and len(cursors) == 1:
+        st.info("No linked pairs match these filters.")
     else:
-        col1, col2, col3 = st.columns(3)
-        col1.metric("Total pairs", len(pairs))
-        tier1 = pairs['dupe_desc'].apply(lambda d: infer_match_type(d or '') == "tier 1 (ref)").sum()
-        col2.metric("Tier 1 (ref)", int(tier1))
-        col3.metric("Tier 2 (fingerprint)", int(len(pairs) - tier1))
-
-        st.divider()
-
-        col_f1, col_f2 = st.columns(2)
-        with col_f1:
-            match_filter = st.selectbox(
-                "Match type",
-                ["All", "tier 1 (ref)", "tier 2 (fingerprint)", "unknown"],
-            )
-        with col_f2:
-            site_options = sorted(set(pairs['dupe_site'].tolist() + pairs['canonical_site'].tolist()))
-            site_filter = st.selectbox("Filter by site (either side)", ["All"] + site_options)
-
-        filtered = pairs.copy()
-        if match_filter != "All":
-            filtered = filtered[filtered['dupe_desc'].apply(
-                lambda d: infer_match_type(d or '') == match_filter
-            )]
-        if site_filter != "All":
-            filtered = filtered[
-                (filtered['dupe_site'] == site_filter) |
-                (filtered['canonical_site'] == site_filter)
-            ]
-
-        st.caption(f"Showing {len(filtered)} of {len(pairs)} pairs")
-        st.divider()
-
-        for _, row in filtered.iterrows():
-            match_type = infer_match_type(row['dupe_desc'] or '')
+        first = (len(cursors) - 1) * PAIRS_PAGE_SIZE
+        st.caption(f"Showing {first + 1}–{first + len(pairs)} of {matching} pairs")
+
+        # Bulk actions on the ticked pairs of this page (checkbox state is
+        # already in session_state when the button's rerun starts)
+        page_ids = [int(i) for i in pairs['dupe_id']]
+        selected = [i for i in page_ids if st.session_state.get(f"sel_pair_{i}")]
+        act_all, act_unlink, act_confirm = st.columns(3)
+        with act_all:
+            if st.button("Tout cocher", use_container_width=True, key="pairs_select_all"):
+                for i in page_ids:
+                    st.session_state[f"sel_pair_{i}"] = True
+                st.rerun()
+        with act_unlink:
+            if st.button(f"Délier ({len(selected)})", disabled=not selected,
+                         use_container_width=True, key="pairs_unlink"):
+                run_action(unlink_pairs, selected, "pair", "délié(s)")
+        with act_confirm:
+            if st.button(f"Confirmer ({len(selected)})", disabled=not selected,
+                         use_container_width=True, key="pairs_confirm"):
+                run_action(confirm_pairs, selected, "pair", "confirmé(s)")
+
+        for _, row in pairs.iterrows():
+            match_type = TIER_LABELS.get(row['match_tier'], "unknown") if pd.notna(row['match_tier']) else "unknown"
             badge = "\U0001f535" if "tier 1" in match_type else "\U0001f7e1"
+            score = f" · {row['match_score']:.2f}" if pd.notna(row['match_score']) else ""
+
+            confirmed = " · \u2713" if pd.notna(row['confirmed_at']) else ""
 
-            with st.expander(
-                f"{badge} #{row['dupe_id']} {row['dupe_site']}  \u2192  #{row['canonical_id']} {row['canonical_site']}  |  {match_type}",
+            col_sel, col_pair = st.columns([0.04, 0.96])
+            col_sel.checkbox("select", key=f"sel_pair_{row['dupe_id']}", label_visibility="collapsed")
+            with col_pair, st.expander(
+                f"{badge} #{row['dupe_id']} {row['dupe_site']}  \u2192  #{row['canonical_id']} {row['canonical_site']}  |  {match_type}{score}{confirmed}",
                 expanded=False,
             ):
                 c1, c2 = st.columns(2)
 
                 with c1:
-                    if row['dupe_image']:
-                        st.image(row['dupe_image'], use_container_width=True)
+                    st.markdown(thumb_html(row['dupe_image']), unsafe_allow_html=True)
                     st.markdown(f"**Duplicate** \u00b7 `#{row['dupe_id']}`")
                     st.markdown(f"**Site:** {row['dupe_site']}")
                     st.markdown(f"**Date:** {row['dupe_date']}")
@@ -170,8 +330,7 @@ with tab_pairs:
                     st.markdown(f"[Voir l'annonce \u2192]({row['dupe_url']})")
 
                 with c2:
-                    if row['canonical_image']:
-                        st.image(row['canonical_image'], use_container_width=True)
+                    st.markdown(thumb_html(row['canonical_image']), unsafe_allow_html=True)
                     st.markdown(f"**Canonical** \u00b7 `#{row['canonical_id']}`")
                     st.markdown(f"**Site:** {row['canonical_site']}")
                     st.markdown(f"**Date:** {row['canonical_date']}")
@@ -184,7 +343,19 @@ with tab_pairs:
                     st.markdown(f"**Titre:** {_can_title}")
                     st.markdown(f"[Voir l'annonce \u2192]({row['canonical_url']})")
 
-                st.caption(f"To unlink: `UPDATE properties SET canonical_id = NULL WHERE id = {row['dupe_id']};`")
+
+        nav_prev, nav_label, nav_next = st.columns([1, 2, 1])
+        with nav_prev:
+            if st.button("\u2190 Pr\u00e9c.", disabled=len(cursors) == 1, use_container_width=True, key="pairs_prev"):
+                cursors.pop()
+                st.rerun()
+        with nav_label:
+            st.caption(f"Page {len(cursors)}")
+        with nav_next:
+            if st.button("Suiv. \u2192", disabled=len(pairs) < PAIRS_PAGE_SIZE, use_container_width=True, key="pairs_next"):
+                last = pairs.iloc[-1]
+                cursors.append((last['dupe_date'], int(last['dupe_id'])))
+                st.rerun()
 
 
 # ── Tab 2: pending reports ─────────────────────────────────────────────────────
@@ -199,8 +370,16 @@ with tab_reports:
     if pending.empty:
         st.info("Aucun signalement en attente.")
     else:
+        report_ids = [int(i) for i in pending['id']]
+        selected_reports = [i for i in report_ids if st.session_state.get(f"sel_report_{i}")]
+        if st.button(f"Marquer résolus ({len(selected_reports)})", disabled=not selected_reports,
+                     key="reports_resolve"):
+            run_action(resolve_reports, selected_reports, "report", "résolu(s)")
+
         for _, r in pending.iterrows():
-            with st.expander(
+            col_sel, col_report = st.columns([0.04, 0.96])
+            col_sel.checkbox("select", key=f"sel_report_{r['id']}", label_visibility="collapsed")
+            with col_report, st.expander(
                 f"\U0001f6a9 #{r['id_a']} {r['site_a'] or ''}  \u00b7  {str(r['reported_at'])[:16]}",
                 expanded=True,
             ):
@@ -211,7 +390,36 @@ with tab_reports:
                 m2    = f"{r['m2_a']} m\u00b2" if pd.notna(r['m2_a']) else '\u2014'
                 st.markdown(f"**Prix:** {price}  |  **Surface:** {m2}")
                 st.markdown(f"**Notes:** {r['notes'] or '*(aucune)*'}")
-                st.caption(f"To resolve: `UPDATE dedup_reports SET resolved = true WHERE id = {r['id']};`")
+
+                # Candidate search on demand: one indexed bucket query per report
+                if pd.isna(r['id_a']):
+                    continue
+                listing_id = int(r['id_a'])
+                if not st.session_state.get(f"cand_{r['id']}"):
+                    if st.button("\U0001f50e Chercher des candidats", key=f"find_{r['id']}"):
+                        st.session_state[f"cand_{r['id']}"] = True
+                        st.rerun()
+                    continue
+                candidates = load_candidates(listing_id)
+                if candidates is None:
+                    st.warning(f"L'annonce #{listing_id} n'existe plus.")
+                elif not candidates:
+                    st.info("Aucun candidat dans la même tranche de prix et de surface.")
+                for c in candidates or []:
+                    c_img, c_info, c_link = st.columns([0.2, 0.6, 0.2])
+                    c_img.markdown(thumb_html(c['image_url']), unsafe_allow_html=True)
+                    with c_info:
+                        c_price = f"{int(c['price_numeric']):,} \u20ac".replace(',', ' ') if c['price_numeric'] else '\u2014'
+                        c_m2 = f"{c['square_meters']} m\u00b2" if c['square_meters'] else '\u2014'
+                        c_title = c['title'] or '\u2014'
+                        st.markdown(f"**#{c['id']}** {c['site']} \u00b7 [{c_title}]({c['url']})")
+                        st.markdown(f"**Prix:** {c_price}  |  **Surface:** {c_m2}  |  **Date:** {c['scraped_date']}")
+                        parts = " \u00b7 ".join(f"{name} {value:.2f}" for name, value in c['parts'].items())
+                        st.caption(f"score {c['score']:.2f} ({parts})")
+                    with c_link:
+                        if st.button("Confirmer ce doublon", key=f"link_{r['id']}_{c['id']}",
+                                     use_container_width=True):
+                            link_candidate(int(r['id']), listing_id, c)
 
     if not resolved.empty:
         with st.expander(f"R\u00e9solus ({len(resolved)})", expanded=False):
@@ -0,0 +1,88 @@
+"""
+pagination.py -- date pages of a filter result, sliced without rescanning it
+
+The listings page shows one scrape date per page, newest first, at most
+page_size cards per page: a busy day spans several pages. A PagePlan is
+built once per filter result (and cached with it in app.py's filter LRU):
+
+    plan = PagePlan.build(filtered_df, PAGE_SIZE)
+    start, stop = plan.bounds(page)
+    page_df = df.loc[plan.rows[start:stop]]    # only the cards in view
+
+Rows are in keyset order (scraped_date DESC, sort key, id): the date
+grouping is a stable sort of the filter result, which filter_listings()
+already orders by sort key with id DESC as tiebreak. Any page costs the
+same to fetch, the first or the last.
+
+anchor()/page_of() give a page a cursor (the id of its first listing) that
+survives a data refresh: new listings shift page numbers, the cursor finds
+the page that now holds the same listing.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class PagePlan:
+    """Row labels of a filter result in page order, plus page boundaries"""
+
+    __slots__ = ('rows', 'ids', 'starts', 'dates', 'total', 'n_sites')
+
+    def __init__(self, rows, ids, starts, dates, n_sites):
+        self.rows = rows        # df index labels, page order
+        self.ids = ids          # listing ids, same order
+        self.starts = starts    # first position of each page
+        self.dates = dates      # scrape date of each page
+        self.total = len(rows)
+        self.n_sites = n_sites
+
+    @classmethod
+    def build(cls, filtered_df, page_size):
+        """Plan for a filtered (and sorted) frame"""
+        if filtered_df.empty:
+            empty = np.array([], dtype=np.int64)
+            return cls(filtered_df.index.to_numpy(), empty, empty, [], 0)
+
+        # Newest date first; stable, so the sort order within a date is kept
+        day = pd.to_datetime(filtered_df['scraped_date_dt']).to_numpy().astype('datetime64[D]').astype(np.int64)
+        order = np.argsort(-day, kind='stable')
+        day = day[order]
+
+        # A page starts on each new date, then every page_size rows within it
+        positions = np.arange(len(day))
+        new_date = np.empty(len(day), dtype=bool)
+        new_date[0] = True
+        new_date[1:] = day[1:] != day[:-1]
+        run_start = np.maximum.accumulate(np.where(new_date, positions, 0))
+        starts = np.flatnonzero((positions - run_start) % page_size == 0)
+
+        dates = filtered_df['scraped_date_dt'].to_numpy()[order][starts]
+        return cls(filtered_df.index.to_numpy()[order], filtered_df['id'].to_numpy()[order],
+                   starts, list(dates), filtered_df['site'].nunique())
+
+    @property
+    def page_count(self):
+        return max(1, len(self.starts))
+
+    def clamp(self, page):
+        return min(max(page, 0), self.page_count - 1)
+
+    def bounds(self, page):
+        """(start, stop) positions of a page in rows/ids"""
+        if not len(self.starts):
+            return 0, 0
+        page = self.clamp(page)
+        stop = self.starts[page + 1] if page + 1 < len(self.starts) else self.total
+        return int(self.starts[page]), int(stop)
+
+    def anchor(self, page):
+        """Cursor of a page: id of its first listing (None when empty)"""
+        start, stop = self.bounds(page)
+        return int(self.ids[start]) if stop > start else None
+
+    def page_of(self, listing_id):
+        """Page now holding listing_id, or None if it left the result"""
+        hits = np.flatnonzero(self.ids == listing_id)
+        if not len(hits):
+            return None
+        return int(np.searchsorted(self.starts, hits[0], side='right') - 1)
@@ -0,0 +1,101 @@
+"""
+perf.py -- timing spans for one Streamlit rerun
+
+    profiler = Profiler(enabled=True)
+    with profiler.span("filter", rows_in=len(df)) as span:
+        out = ...
+        span.rows_out = len(out)
+    profiler.report()   # list of dicts, one per span
+
+Each span records wall time, rows in/out and bytes emitted (HTML handed to
+Streamlit). A disabled profiler hands out one shared do-nothing span, so
+instrumented code costs a method call per phase and nothing else.
+
+write_json_line() appends the whole rerun as one JSON object, for
+aggregation outside the app (jq, pandas.read_json(lines=True)).
+"""
+
+import json
+import threading
+import time
+
+
+class Span:
+    """One timed phase; rows_in/rows_out/bytes are filled in by the caller"""
+
+    __slots__ = ('name', 'rows_in', 'rows_out', 'bytes', 'extra', '_start', 'ms')
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes = None
+        self.extra = None  # free-form note, e.g. "cache hit"
+        self.ms = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self._start) * 1000
+        return False
+
+    def as_dict(self):
+        return {'span': self.name, 'ms': round(self.ms, 2) if self.ms is not None else None,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'bytes': self.bytes, 'extra': self.extra}
+
+
+class _NullSpan:
+    """Shared by every span of a disabled profiler: attribute writes are dropped"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Collects the spans of one rerun (create a new one per rerun)"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []
+        self._start = time.perf_counter()
+
+    def span(self, name, rows_in=None):
+        if not self.enabled:
+            return _NULL_SPAN
+        span = Span(name, rows_in)
+        self.spans.append(span)
+        return span
+
+    def total_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def report(self):
+        return [span.as_dict() for span in self.spans]
+
+
+_log_lock = threading.Lock()
+
+
+def write_json_line(path, profiler, **context):
+    """Append one rerun (context + spans) to a JSON-lines file"""
+    if not profiler.enabled:
+        return
+    record = {'ts': time.time(), 'total_ms': round(profiler.total_ms(), 2),
+              **context, 'spans': profiler.report()}
+    line = json.dumps(record, default=str)
+    with _log_lock, open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
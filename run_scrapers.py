@@ -1,8 +1,10 @@
 import csv
-from datetime import datetime
+import json
+from datetime import datetime, timedelta, timezone
 import time
 import os
 import psycopg2
+import pandas as pd
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv  # New import
 
@@ -10,6 +12,12 @@ from dotenv import load_dotenv  # New import
 from scrapers import brigitte_sauvager
 from scrapers import graslin_immobilier
 
+import db_migrations
+from listing_snapshot import (
+    add_derived_columns, normalize_frame, write_snapshot_file, max_timestamp, pa,
+    snapshot_lock,
+)
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -20,50 +28,39 @@ path_to_file = Path(__file__).parent
 # data folder for CSV backups
 DATA_FOLDER = path_to_file / 'data/scrapers'
 
+# Arrow snapshots the app memory-maps at startup (must match the app's SNAPSHOT_DIR)
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', str(path_to_file / 'data/snapshots'))
+
 # Get database URL from environment variable
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Optional pg_trgm index for substring keyword search (see db_search.py)
+SEARCH_TRIGRAM = os.getenv('SEARCH_TRIGRAM', 'false').lower() == 'true'
+
+# Cold archive (see archive_old_listings): linked duplicates not seen for
+# ARCHIVE_LINKED_DAYS, and listings not seen for ARCHIVE_STALE_DAYS (last_seen,
+# bumped by mark_seen on every scrape). 0 disables.
+ARCHIVE_LINKED_DAYS = int(os.getenv('ARCHIVE_LINKED_DAYS', '90'))
+ARCHIVE_STALE_DAYS = int(os.getenv('ARCHIVE_STALE_DAYS', '365'))
+
 def setup_database():
-    """Create database table if it doesn't exist"""
+    """Bring the database schema up to date (see db_migrations.py)"""
     # Make sure local folder exists for CSV backups
     os.makedirs(DATA_FOLDER, exist_ok=True)
     
-    # Connect to PostgreSQL
     conn = psycopg2.connect(DATABASE_URL)
-    cursor = conn.cursor()
-    
-    # Create table with all our fields
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS properties (
-            id SERIAL PRIMARY KEY,
-            site TEXT,
-            title TEXT,
-            price TEXT,
-            price_numeric INTEGER,
-            description TEXT,
-            url TEXT,
-            image_url TEXT,
-            scraped_date TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create index on image_url for faster duplicate checking
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_image_url ON properties(image_url)
-    ''')
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        db_migrations.migrate(conn, trigram=SEARCH_TRIGRAM)
+    finally:
+        conn.close()
 
 def get_existing_image_urls():
     """Get all image URLs already in database to avoid duplicates"""
     conn = psycopg2.connect(DATABASE_URL)
     cursor = conn.cursor()
     
-    # Get all existing image URLs
-    cursor.execute('SELECT image_url FROM properties')
+    # Get all existing image URLs (archived ones too, or they come back as new)
+    cursor.execute('SELECT image_url FROM properties UNION SELECT image_url FROM properties_archive')
     existing = {row[0] for row in cursor.fetchall()}
     
     cursor.close()
@@ -89,6 +86,21 @@ def filter_duplicates(all_listings):
     print(f"Found {duplicate_count} duplicates, {len(new_listings)} new listings")
     return new_listings
 
+def mark_seen(all_listings):
+    """Bump last_seen of the listings scraped again (the insert only covers new ones)"""
+    urls = sorted({listing['image_url'] for listing in all_listings if listing.get('image_url')})
+    if not urls:
+        return 0
+    conn = psycopg2.connect(DATABASE_URL)
+    cursor = conn.cursor()
+    cursor.execute('SELECT touch_listings(%s, CURRENT_DATE)', (urls,))
+    touched = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Marked {touched} listings as seen today")
+    return touched
+
 def save_to_csv(all_listings):
     """Save listings to CSV file as backup"""
     if not all_listings:
@@ -108,6 +120,17 @@ def save_to_csv(all_listings):
     
     print(f"Saved backup to {filepath}")
 
+def bump_data_version(cursor):
+    """Signal the app that properties changed: bump data_version and NOTIFY listeners"""
+    cursor.execute('''
+        UPDATE data_version
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    ''')
+    version = cursor.fetchone()[0]
+    cursor.execute("SELECT pg_notify('listings_updated', %s)", (str(version),))
+    return version
+
 def save_to_database(new_listings):
     """Add only new listings to PostgreSQL database"""
     if not new_listings:
@@ -141,14 +164,89 @@ def save_to_database(new_listings):
         values
     )
     
+    # Same transaction as the insert: the app never sees the new version
+    # before the rows are visible, in properties and in the derived views
+    cursor.execute('SELECT refresh_listing_views()')
+    bump_data_version(cursor)
+    
     conn.commit()
     cursor.close()
     conn.close()
     print(f"Added {len(new_listings)} new listings to database")
 
+def archive_old_listings():
+    """Move old duplicates and listings gone offline to properties_archive"""
+    if ARCHIVE_LINKED_DAYS <= 0 and ARCHIVE_STALE_DAYS <= 0:
+        return 0
+    today = datetime.now().date()
+    # Compared as ISO text: nothing sorts before '', so '' disables a cutoff
+    linked_before = (today - timedelta(days=ARCHIVE_LINKED_DAYS)).isoformat() if ARCHIVE_LINKED_DAYS > 0 else ''
+    stale_before = (today - timedelta(days=ARCHIVE_STALE_DAYS)).isoformat() if ARCHIVE_STALE_DAYS > 0 else ''
+    
+    conn = psycopg2.connect(DATABASE_URL)
+    cursor = conn.cursor()
+    cursor.execute('SELECT archive_listings(%s, %s)', (linked_before, stale_before))
+    moved = cursor.fetchone()[0]
+    if moved:
+        # Same transaction as the move, like save_to_database
+        cursor.execute('SELECT refresh_listing_views()')
+        bump_data_version(cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Archived {moved} listings")
+    return moved
+
+def record_scrape_run(started_at, status, all_listings, new_listings, archived=0, error=None):
+    """One scrape_runs row: header stats for the app, freshness signal for monitoring"""
+    site_counts = {}
+    for listing in all_listings:
+        site_counts.setdefault(listing['site'], {'scraped': 0, 'inserted': 0})['scraped'] += 1
+    for listing in new_listings:
+        site_counts.setdefault(listing['site'], {'scraped': 0, 'inserted': 0})['inserted'] += 1
+    
+    conn = psycopg2.connect(DATABASE_URL)
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT record_scrape_run(%s, %s, %s, %s, %s, %s, %s)',
+        (started_at, status, len(all_listings), len(new_listings), archived,
+         json.dumps(site_counts), error)
+    )
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+def publish_snapshot():
+    """Write canonical listings, derived columns included, to a versioned Arrow file"""
+    if pa is None or not SNAPSHOT_DIR:
+        print("Snapshot skipped (pyarrow not installed or SNAPSHOT_DIR empty)")
+        return
+    
+    conn = psycopg2.connect(DATABASE_URL)
+    # Version, rows and watermark must come from one consistent view
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM data_version')
+        version = cursor.fetchone()[0]
+        cursor.close()
+        df = pd.read_sql_query(
+            'SELECT * FROM canonical_listings ORDER BY id DESC', conn
+        )
+    finally:
+        conn.close()
+    
+    df = add_derived_columns(normalize_frame(df))
+    # App workers may be republishing into the same directory
+    with snapshot_lock(SNAPSHOT_DIR):
+        path = write_snapshot_file(df, SNAPSHOT_DIR, version, max_timestamp(df))
+    print(f"Published snapshot v{version} ({len(df)} listings) to {path}")
+
 def run():
     """Run all scrapers and save results"""
-    print(f"Starting scrape at {datetime.now()}")
+    # Aware UTC: stored in the DB session's time zone, like finished_at's CURRENT_TIMESTAMP
+    started_at = datetime.now(timezone.utc)
+    print(f"Starting scrape at {started_at.astimezone():%Y-%m-%d %H:%M:%S}")
     
     # Make sure database table exists
     setup_database()
@@ -178,8 +276,22 @@ def run():
     # CSV backup (local)
     save_to_csv(all_listings)
     
-    # PostgreSQL database (online)
-    save_to_database(new_listings)
+    # PostgreSQL database (online), then keep the hot table small.
+    # The run is recorded in scrape_runs either way.
+    try:
+        mark_seen(all_listings)
+        save_to_database(new_listings)
+        archived = archive_old_listings()
+    except Exception as e:
+        try:
+            record_scrape_run(started_at, 'failed', all_listings, new_listings, error=str(e))
+        except Exception as record_error:
+            print(f"Could not record the failed run: {record_error}")
+        raise
+    record_scrape_run(started_at, 'success', all_listings, new_listings, archived)
+    
+    # Columnar snapshot for fast app cold starts
+    publish_snapshot()
     
     print(f"\nDone!")
 
@@ -0,0 +1,146 @@
+# search_index.py
+import bisect
+import re
+import threading
+import unicodedata
+
+# Letters/digits only once accents are folded: "l'étage" -> ["l", "etage"]
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Ligatures NFKD does not decompose
+_LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae', 'ß': 'ss'})
+
+
+def fold_text(text):
+    """Lowercase and strip accents: "Étage Cœur" -> "etage coeur" """
+    if not text:
+        return ''
+    text = str(text).lower().translate(_LIGATURES)
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Split text into accent-folded word tokens"""
+    return _TOKEN_RE.findall(fold_text(text))
+
+
+class SearchIndex:
+    """Inverted index over listing text, keyed by listing id.
+
+    Each token maps to the set of ids containing it. A query matches a
+    listing when every query token is a prefix of at least one of its
+    tokens, so "etag" finds "étage" and "3 pie" finds "3 pièces".
+
+    add/remove/search hold a lock: one index is shared by every session.
+    A delta refresh does not patch it in place but builds patched(), a new
+    index sharing the untouched postings, so a session searching the old
+    snapshot keeps the index that matches its frame.
+    """
+
+    def __init__(self):
+        self._postings = {}    # token -> set of ids
+        self._doc_tokens = {}  # id -> set of tokens (needed to remove a listing)
+        self._vocab = None     # sorted token list for prefix lookups, rebuilt lazily
+        self._owned = None     # patched() copies: tokens whose posting set is our own
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_columns(cls, ids, *text_columns):
+        """Build an index from parallel sequences: ids, then one sequence per text field"""
+        index = cls()
+        for doc_id, *texts in zip(ids, *text_columns):
+            index.add(doc_id, *texts)
+        return index
+
+    def add(self, doc_id, *texts):
+        """Index a listing, replacing any previous entry for the same id"""
+        with self._lock:
+            if doc_id in self._doc_tokens:
+                self.remove(doc_id)
+            tokens = set()
+            for text in texts:
+                if isinstance(text, str):
+                    tokens.update(tokenize(text))
+            self._doc_tokens[doc_id] = tokens
+            for token in tokens:
+                self._writable(token).add(doc_id)
+            self._vocab = None
+
+    def remove(self, doc_id):
+        """Drop a listing from the index (no-op if it is not indexed)"""
+        with self._lock:
+            tokens = self._doc_tokens.pop(doc_id, None)
+            if not tokens:
+                return
+            for token in tokens:
+                if token not in self._postings:
+                    continue
+                posting = self._writable(token)
+                posting.discard(doc_id)
+                if not posting:
+                    del self._postings[token]
+            self._vocab = None
+
+    def _writable(self, token):
+        """Posting set of token that this index may mutate (copied if shared)"""
+        posting = self._postings.get(token)
+        if self._owned is not None and token not in self._owned:
+            posting = set(posting) if posting is not None else set()
+            self._postings[token] = posting
+            self._owned.add(token)
+        elif posting is None:
+            posting = self._postings[token] = set()
+        return posting
+
+    def patched(self, remove_ids, docs):
+        """New index: this one without remove_ids, plus docs ((id, *texts) tuples).
+
+        This index is left untouched. Posting sets are shared and copied
+        only when a change touches them: a delta costs two dict copies.
+        """
+        with self._lock:
+            new = SearchIndex()
+            new._postings = dict(self._postings)
+            new._doc_tokens = dict(self._doc_tokens)
+        new._owned = set()
+        for doc_id in remove_ids:
+            new.remove(doc_id)
+        for doc_id, *texts in docs:
+            new.add(doc_id, *texts)
+        return new
+
+    def _prefix_postings(self, prefix):
+        """Union of the postings of every token starting with prefix"""
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        start = bisect.bisect_left(self._vocab, prefix)
+        end = bisect.bisect_left(self._vocab, prefix + '\uffff')
+        if end - start == 1:
+            return self._postings[self._vocab[start]]
+        ids = set()
+        for token in self._vocab[start:end]:
+            ids |= self._postings[token]
+        return ids
+
+    def search(self, query):
+        """Return the set of ids matching every token of query.
+
+        Returns None when the query has no searchable token (e.g. only
+        punctuation), meaning "no keyword filter".
+        """
+        with self._lock:
+            tokens = set(tokenize(query))
+            if not tokens:
+                return None
+            # Intersect smallest posting lists first so the working set shrinks fast
+            postings = sorted((self._prefix_postings(t) for t in tokens), key=len)
+            result = set(postings[0])
+            for posting in postings[1:]:
+                if not result:
+                    break
+                result &= posting
+            return result
+
+    def __len__(self):
+        return len(self._doc_tokens)
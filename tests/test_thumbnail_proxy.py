@@ -0,0 +1,222 @@
+"""
+thumbnail_proxy.py against a local stand-in image server
+
+    python -m pytest tests/test_thumbnail_proxy.py
+
+The stand-in serves a 1200x800 JPEG and a few redirects on 127.0.0.1.
+Host names are mapped to addresses by patching socket.getaddrinfo, so
+the SSRF checks see the same answers a real resolver would give.
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import card_renderer
+import thumbnail_proxy
+
+IMAGE_HOST = 'photos.brigitte-sauvager.com'      # allowlisted, "public"
+METADATA_HOST = 'meta.brigitte-sauvager.com'     # allowlisted, resolves to 169.254.169.254
+OTHER_HOST = 'images.example.org'                # not allowlisted
+
+
+def _jpeg(width=1200, height=800):
+    out = BytesIO()
+    Image.new('RGB', (width, height), (200, 120, 40)).save(out, 'JPEG')
+    return out.getvalue()
+
+
+@pytest.fixture(scope='module')
+def image_server():
+    photo = _jpeg()
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            port = self.server.server_port
+            redirects = {
+                '/relative': '/photo.jpg',
+                '/to-metadata': f'http://{METADATA_HOST}:{port}/latest/meta-data',
+                '/to-other': f'http://{OTHER_HOST}:{port}/photo.jpg',
+            }
+            if self.path in redirects:
+                self.send_response(302)
+                self.send_header('Location', redirects[self.path])
+                self.end_headers()
+                return
+            if self.path != '/photo.jpg':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(photo)))
+            self.end_headers()
+            self.wfile.write(photo)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_port, hits
+    server.shutdown()
+
+
+@pytest.fixture
+def fake_dns(monkeypatch):
+    """Allowlisted test hosts; IMAGE_HOST counts as public although it is 127.0.0.1"""
+    addresses = {IMAGE_HOST: '127.0.0.1', METADATA_HOST: '169.254.169.254', OTHER_HOST: '127.0.0.1'}
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host in addresses:
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (addresses[host], port))]
+        return real_getaddrinfo(host, port, *args, **kwargs)
+
+    real_is_public = thumbnail_proxy._is_public
+    monkeypatch.setattr(thumbnail_proxy.socket, 'getaddrinfo', getaddrinfo)
+    monkeypatch.setattr(thumbnail_proxy, '_is_public',
+                        lambda address: address == '127.0.0.1' or real_is_public(address))
+    monkeypatch.setattr(thumbnail_proxy, 'ALLOW_PRIVATE', False)
+    monkeypatch.setattr(card_renderer, 'THUMB_SOURCE_HOSTS', ('brigitte-sauvager.com',))
+
+
+def _url(port, path='/photo.jpg', host=IMAGE_HOST):
+    return f'http://{host}:{port}{path}'
+
+
+# ---- SSRF refusals ---------------------------------------------------------
+
+def test_refuses_host_outside_allowlist(image_server, fake_dns):
+    port, _ = image_server
+    with pytest.raises(ValueError, match='host not allowed'):
+        thumbnail_proxy.fetch_source(_url(port, host=OTHER_HOST))
+
+
+def test_refuses_private_address(image_server, fake_dns):
+    port, hits = image_server
+    before = len(hits)
+    with pytest.raises(ValueError, match='private address'):
+        thumbnail_proxy.fetch_source(_url(port, '/latest/meta-data', host=METADATA_HOST))
+    assert len(hits) == before
+
+
+def test_refuses_loopback_without_fake_dns(monkeypatch):
+    monkeypatch.setattr(thumbnail_proxy, 'ALLOW_PRIVATE', False)
+    monkeypatch.setattr(card_renderer, 'THUMB_SOURCE_HOSTS', ('localhost',))
+    with pytest.raises(ValueError, match='private address'):
+        thumbnail_proxy.fetch_source('http://localhost:1/photo.jpg')
+
+
+def test_refuses_non_http_schemes(fake_dns):
+    for url in ('file:///etc/passwd', 'ftp://photos.brigitte-sauvager.com/a.jpg', 'http:///nohost'):
+        with pytest.raises(ValueError, match='unsupported url'):
+            thumbnail_proxy.fetch_source(url)
+
+
+def test_redirect_hops_are_checked_again(image_server, fake_dns):
+    port, hits = image_server
+    with pytest.raises(ValueError, match='private address'):
+        thumbnail_proxy.fetch_source(_url(port, '/to-metadata'))
+    with pytest.raises(ValueError, match='host not allowed'):
+        thumbnail_proxy.fetch_source(_url(port, '/to-other'))
+    assert '/latest/meta-data' not in hits
+
+
+def test_follows_allowed_redirect(image_server, fake_dns):
+    port, _ = image_server
+    assert thumbnail_proxy.fetch_source(_url(port, '/relative'))[:2] == b'\xff\xd8'
+
+
+def test_cards_only_proxy_allowlisted_hosts(fake_dns):
+    assert card_renderer.is_thumbnail_source('https://photos.brigitte-sauvager.com/a.jpg')
+    assert card_renderer.is_thumbnail_source('https://brigitte-sauvager.com/a.jpg')
+    assert not card_renderer.is_thumbnail_source('https://evilbrigitte-sauvager.com/a.jpg')
+    assert not card_renderer.is_thumbnail_source('https://images.example.org/a.jpg')
+
+
+# ---- resize ----------------------------------------------------------------
+
+def test_thumbnail_is_resized_and_reencoded(image_server, fake_dns, tmp_path):
+    port, _ = image_server
+    service = thumbnail_proxy.ThumbnailService(thumbnail_proxy.DiskLRU(tmp_path, 10 * 1024 * 1024))
+    for width, fmt, pil_format in ((320, 'webp', 'WEBP'), (640, 'jpeg', 'JPEG')):
+        _, data = service.thumbnail(_url(port), width, fmt)
+        with Image.open(BytesIO(data)) as img:
+            assert img.format == pil_format
+            assert img.size == (width, round(800 * width / 1200))
+
+
+def test_source_fetched_once_for_all_widths(image_server, fake_dns, tmp_path):
+    port, hits = image_server
+    service = thumbnail_proxy.ThumbnailService(thumbnail_proxy.DiskLRU(tmp_path, 10 * 1024 * 1024))
+    before = len(hits)
+    for width in card_renderer.THUMB_WIDTHS:
+        service.thumbnail(_url(port), width, 'webp')
+    assert len(hits) - before == 1
+    assert service._inflight == {}
+
+
+# ---- LRU eviction ----------------------------------------------------------
+
+def test_disk_lru_evicts_least_recently_served(tmp_path):
+    cache = thumbnail_proxy.DiskLRU(tmp_path, max_bytes=300)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, b'x' * 100)
+        past = time.time() - 100 + ord(key)
+        os.utime(tmp_path / key, (past, past))
+    assert cache.get('a') == b'x' * 100  # served: now the most recent
+    cache.put('d', b'x' * 100)           # 400 > 300: evict down to 270
+    assert cache.get('b') is None and cache.get('c') is None
+    assert cache.get('a') is not None and cache.get('d') is not None
+    assert cache._size == sum(p.stat().st_size for p in tmp_path.iterdir())
+
+
+# ---- HTTP: cache headers ---------------------------------------------------
+
+@pytest.fixture
+def proxy(fake_dns, tmp_path):
+    server = thumbnail_proxy.serve('127.0.0.1', 0, cache_dir=tmp_path, max_bytes=10 * 1024 * 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_http_cache_headers_and_etag(image_server, proxy):
+    port, _ = image_server
+    thumb_url = f"{proxy}/thumb?url={urllib.request.quote(_url(port), safe='')}&w=320&fmt=webp"
+    with urllib.request.urlopen(thumb_url) as response:
+        assert response.status == 200
+        assert response.headers['Content-Type'] == 'image/webp'
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        etag = response.headers['ETag']
+        assert int(response.headers['Content-Length']) == len(response.read())
+    request = urllib.request.Request(thumb_url, headers={'If-None-Match': etag})
+    with pytest.raises(urllib.error.HTTPError) as not_modified:
+        urllib.request.urlopen(request)
+    assert not_modified.value.code == 304
+
+
+def test_http_rejects_unknown_width_and_refused_sources(image_server, proxy):
+    port, _ = image_server
+    quoted = urllib.request.quote(_url(port), safe='')
+    with pytest.raises(urllib.error.HTTPError) as bad_width:
+        urllib.request.urlopen(f'{proxy}/thumb?url={quoted}&w=123')
+    assert bad_width.value.code == 400
+    quoted = urllib.request.quote(_url(port, '/to-metadata'), safe='')
+    with pytest.raises(urllib.error.HTTPError) as refused:
+        urllib.request.urlopen(f'{proxy}/thumb?url={quoted}&w=320')
+    assert refused.value.code == 502
@@ -0,0 +1,298 @@
+"""
+thumbnail_proxy.py -- resized listing photos served from a local disk cache
+
+Cards hotlink agency photos that are often several MB; on mobile they are
+displayed ~300px wide. This small HTTP service fetches each source image
+once, stores resized WebP/JPEG variants on disk, and serves them with long
+cache headers:
+
+    GET /thumb?url=<image url>&w=320[&fmt=webp|jpeg]
+
+Run it next to the app and point the app at it:
+
+    python thumbnail_proxy.py --port 8502
+    THUMBNAIL_PROXY_URL=http://localhost:8502 streamlit run app.py
+
+The cache is bounded (THUMB_CACHE_MAX_MB); the least recently served files
+are evicted first. Pillow is required: without it nothing would be resized.
+
+Sources are limited to the listing image hosts (THUMB_SOURCE_HOSTS, shared
+with card_renderer, which hotlinks photos from any other host). Each
+hop, redirects included, is resolved once, refused if any address is
+private, and connected to that vetted address.
+"""
+
+import argparse
+import hashlib
+import http.client
+import ipaddress
+import os
+import socket
+import ssl
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import parse_qs, urljoin, urlparse
+
+from PIL import Image
+
+from card_renderer import THUMB_WIDTHS, is_thumbnail_source
+from scraper_utils import DEFAULT_HEADERS
+
+# Only the widths the cards ask for (srcset) are accepted, so a client
+# cannot fill the cache with arbitrary variants
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+CACHE_DIR = Path(os.getenv('THUMB_CACHE_DIR', Path(__file__).parent / 'data' / 'thumbs'))
+CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_MB', '500')) * 1024 * 1024
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+FETCH_TIMEOUT = 10
+MAX_REDIRECTS = 3
+# Private/loopback sources are refused unless explicitly allowed (local testing)
+ALLOW_PRIVATE = os.getenv('THUMB_ALLOW_PRIVATE', 'false').lower() == 'true'
+
+
+class DiskLRU:
+    """Files in one directory, evicted oldest-mtime first past max_bytes.
+
+    mtime is bumped on every hit (atime is unreliable on noatime mounts).
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = sum(p.stat().st_size for p in self.directory.iterdir() if p.is_file())
+
+    def _path(self, key):
+        return self.directory / key
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted between read and touch
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp = path.with_name(path.name + f'.{threading.get_ident()}.tmp')
+        tmp.write_bytes(data)
+        with self._lock:
+            old = path.stat().st_size if path.exists() else 0
+            os.replace(tmp, path)
+            self._size += len(data) - old
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted((p for p in self.directory.iterdir() if p.is_file() and not p.name.endswith('.tmp')),
+                       key=lambda p: p.stat().st_mtime)
+        # Evict down to 90% so we do not rescan on every put
+        target = int(self.max_bytes * 0.9)
+        for path in files:
+            if self._size <= target:
+                break
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+
+def _check_source(url):
+    """(parsed url, vetted IP): http(s), a listing image host, no private address
+    unless ALLOW_PRIVATE. The caller must connect to that IP, not re-resolve."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('unsupported url')
+    host = parsed.hostname.lower()
+    if not is_thumbnail_source(url):
+        raise ValueError('host not allowed')
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    if not addresses:
+        raise ValueError('host does not resolve')
+    if not ALLOW_PRIVATE and not all(_is_public(address) for address in addresses):
+        raise ValueError('private address')
+    return parsed, addresses[0]
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split('%')[0])
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+                or ip.is_multicast or ip.is_unspecified)
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Connects to a vetted IP; Host header stays the hostname"""
+
+    def __init__(self, host, ip, port, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self._ip = ip
+
+    def connect(self):
+        self.sock = socket.create_connection((self._ip, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """Connects to a vetted IP; certificate and SNI checked against the hostname"""
+
+    def __init__(self, host, ip, port, timeout):
+        super().__init__(host, port, timeout=timeout, context=ssl.create_default_context())
+        self._ip = ip
+
+    def connect(self):
+        sock = socket.create_connection((self._ip, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def fetch_source(url):
+    """Download an image, capped at MAX_SOURCE_BYTES. Redirects are followed
+    by hand (up to MAX_REDIRECTS), each hop checked like the first."""
+    for _ in range(MAX_REDIRECTS + 1):
+        parsed, ip = _check_source(url)
+        connection_class = _PinnedHTTPSConnection if parsed.scheme == 'https' else _PinnedHTTPConnection
+        connection = connection_class(parsed.hostname, ip, parsed.port, FETCH_TIMEOUT)
+        try:
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+            connection.request('GET', path, headers=DEFAULT_HEADERS)
+            response = connection.getresponse()
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader('Location')
+                if not location:
+                    raise ValueError('redirect without location')
+                url = urljoin(url, location)
+                continue
+            if response.status != 200:
+                raise ValueError(f'source returned HTTP {response.status}')
+            data = response.read(MAX_SOURCE_BYTES + 1)
+        finally:
+            connection.close()
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ValueError('source image too large')
+        return data
+    raise ValueError('too many redirects')
+
+
+def resize(data, width, fmt):
+    """Downscale to width (never upscale) and re-encode"""
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert('RGB')
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        out = BytesIO()
+        if fmt == 'webp':
+            img.save(out, 'WEBP', quality=75, method=4)
+        else:
+            img.save(out, 'JPEG', quality=78, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class ThumbnailService:
+    """Source fetch + variant rendering on top of one DiskLRU"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._inflight = {}  # key -> [Lock, waiters], so concurrent misses fetch once
+        self._inflight_lock = threading.Lock()
+
+    def _fill(self, key, produce):
+        """Cached bytes for key, produced once across concurrent misses.
+
+        The per-key lock lives only while someone waits on it: the last
+        holder removes it, so _inflight stays as small as the misses in flight.
+        """
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        with self._inflight_lock:
+            entry = self._inflight.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                data = self.cache.get(key)
+                if data is None:
+                    data = produce()
+                    self.cache.put(key, data)
+                return data
+        finally:
+            with self._inflight_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._inflight[key]
+
+    def source(self, url):
+        key = 'src-' + hashlib.sha256(url.encode()).hexdigest()
+        return self._fill(key, lambda: fetch_source(url))
+
+    def thumbnail(self, url, width, fmt):
+        """Returns (etag, bytes)"""
+        key = f"{hashlib.sha256(url.encode()).hexdigest()}-w{width}.{fmt}"
+        return key, self._fill(key, lambda: resize(self.source(url), width, fmt))
+
+
+def make_handler(service):
+    class ThumbnailHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            if parsed.path != '/thumb':
+                self.send_error(404)
+                return
+            params = parse_qs(parsed.query)
+            url = params.get('url', [''])[0]
+            fmt = params.get('fmt', ['webp'])[0]
+            try:
+                width = int(params.get('w', [THUMB_WIDTHS[0]])[0])
+            except ValueError:
+                width = 0
+            if not url or width not in THUMB_WIDTHS or fmt not in FORMATS:
+                self.send_error(400, 'expected url, w in %s, fmt in %s' % (THUMB_WIDTHS, tuple(FORMATS)))
+                return
+
+            try:
+                etag, data = service.thumbnail(url, width, fmt)
+            except Exception as e:
+                self.send_error(502, f'cannot fetch image: {e}')
+                return
+
+            if self.headers.get('If-None-Match') == f'"{etag}"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', FORMATS[fmt])
+            self.send_header('Content-Length', str(len(data)))
+            # Variants are content-addressed by (url, width, fmt): cache forever
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            self.send_header('ETag', f'"{etag}"')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # one line per thumbnail is noise
+
+    return ThumbnailHandler
+
+
+def serve(host='0.0.0.0', port=8502, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """Build the server (not started) -- handy for running it in a thread"""
+    service = ThumbnailService(DiskLRU(cache_dir, max_bytes))
+    return ThreadingHTTPServer((host, port), make_handler(service))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Listing thumbnail proxy')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8502)
+    args = parser.parse_args()
+    server = serve(args.host, args.port)
+    print(f"Thumbnail proxy on http://{args.host}:{args.port} (cache: {CACHE_DIR})")
+    server.serve_forever()